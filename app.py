@@ -6,15 +6,42 @@
     Description: FastAPI application configuration and startup logic.
 """
 import asyncio
-from itertools import permutations
-from typing import Tuple, List
+import time
+from functools import partial
+from typing import Tuple, List, Dict, Mapping, Optional
 from fastapi import FastAPI
 from fastapi_lifespan_manager import LifespanManager
 from fastapi.middleware.cors import CORSMiddleware
 from routes.websockets import ws_router
-from main import fetch_all_order_books
+from routes.stats import stats_router, metrics_router
+from main import get_exchange_pair_order_book
 from utils import OrderBookMerger
 from data_types import OrderData
+from local_order_book import LocalOrderBook
+from order_book_snapshot import OrderBookSnapshot
+from http_client import ExchangeHTTPSession
+from quote_subscriptions import QuoteSubscriptionHub
+from order_status_subscriptions import OrderStatusHub
+from order_repository import OrderRepository
+from matching_engine import MatchingEngine
+from event_loop_monitor import EventLoopMonitor
+from metrics import ORDER_BOOK_MERGE_SECONDS
+from refresh_scheduler import RefreshScheduler, RefreshJob
+from venue_book_cache import VenueBookCache
+from shared_book import SharedBookReader
+from redis_client import RedisOrderBookStorage
+from log import LOGGER as log
+from config import (
+    ORDER_BOOK_MODE,
+    ORDER_BOOK_BACKEND,
+    STREAM_MERGE_INTERVAL,
+    STATS_LOG_INTERVAL,
+    BOOK_SOURCE,
+    SHARED_BOOK_POLL_INTERVAL,
+    ORDER_EXECUTION,
+    VENUE_MAX_AGE,
+    CURRENCY_PAIRS,
+)
 
 
 manager = LifespanManager()
@@ -25,42 +52,315 @@ class OrderBookFastAPI(FastAPI):
         if not app.extra.get("order_book"):
             app.extra["order_book"] = {}
 
-    def get_app_order_book(self, pair: str):
+    def get_app_order_book(self, pair: str) -> Optional[OrderBookSnapshot]:
         return app.extra.get("order_book", {}).get(pair)
 
     def set_app_order_book(
-        self, pair: str, order_books: Tuple[List[OrderData], List[OrderData]]
-    ):
-        app.extra["order_book"][pair] = order_books
+        self,
+        pair: str,
+        order_books: Tuple[List[OrderData], List[OrderData]],
+        source_times: Mapping[str, float],
+        build_started_at: Optional[float] = None,
+    ) -> OrderBookSnapshot:
+        """
+        Install a newly merged book of 'pair' as its next snapshot.
+
+        Args:
+            pair (str): The currency pair, e.g. BTCUSD.
+            order_books (Tuple[List[OrderData], List[OrderData]]): The
+                merged bids and asks.
+            source_times (Mapping[str, float]): Epoch time each contributing
+                exchange's book was received.
+            build_started_at (Optional[float]): Epoch time the merge
+                started.
+
+        Returns:
+            OrderBookSnapshot: The installed snapshot.
+        """
+        versions = app.extra.setdefault("order_book_version", {})
+        versions[pair] = versions.get(pair, 0) + 1
+        # Index the book once here, every quote on it is then a lookup
+        snapshot = OrderBookSnapshot(
+            *order_books,
+            pair=pair,
+            version=versions[pair],
+            source_times=source_times,
+            build_started_at=build_started_at,
+        )
+        self.install_app_order_book(snapshot)
+        return snapshot
+
+    def install_app_order_book(self, snapshot: OrderBookSnapshot):
+        """
+        Serve 'snapshot', match the resting orders against it and hand it to
+        the subscribers and publishers.
+        """
+        # A single assignment, readers see either the old or the new book
+        app.extra["order_book"][snapshot.pair] = snapshot
+        matching_engine = app.extra.get("matching_engine")
+        if matching_engine is not None:
+            matching_engine.match(snapshot)
+        quote_hub = app.extra.get("quote_hub")
+        if quote_hub is not None:
+            quote_hub.publish(snapshot.pair, snapshot)
+        for book_publisher in app.extra.get("book_publishers", ()):
+            try:
+                book_publisher.publish(snapshot)
+            except Exception as e:
+                log.exception(f"Publishing the {snapshot.pair} book failed: {e}")
+
+    def drop_app_order_book(self, pair: str):
+        if app.extra.get("order_book", {}).pop(pair, None) is not None:
+            log.warning(f"No fresh exchange data, dropped the {pair} book")
 
     def flush_app_order_book(self):
         if app.extra.get("order_book"):
             app.extra["order_book"] = {}
 
 
-async def update_order_book(web_app: OrderBookFastAPI, pair: str, interval: float):
+def install_venue_order_books(web_app: OrderBookFastAPI, pair: str):
+    """
+    Merge the fresh exchange books of 'pair' and install the result.
+
+    Exchanges whose latest book is older than the cache's max_age
+    (VENUE_MAX_AGE) are left out.
+    If none is fresh the pair's book is dropped, so quotes fail instead of
+    using stale prices.
+    """
+    venue_books = web_app.extra["venue_books"].get_fresh(pair)
+    if not venue_books:
+        web_app.drop_app_order_book(pair)
+        return
+    build_started_at = time.time()
+    merge_started_at = time.perf_counter()
+    merged_order_book = OrderBookMerger.merge_order_books(
+        [venue_book.order_book for venue_book in venue_books.values()]
+    )
+    ORDER_BOOK_MERGE_SECONDS.labels(pair).observe(
+        time.perf_counter() - merge_started_at
+    )
+    web_app.set_app_order_book(
+        pair,
+        merged_order_book,
+        {
+            exchange: venue_book.received_at
+            for exchange, venue_book in venue_books.items()
+        },
+        build_started_at,
+    )
+
+
+def on_venue_refresh(web_app: OrderBookFastAPI, job: RefreshJob, order_book):
+    web_app.extra["venue_books"].update(
+        job.pair, job.exchange, order_book, job.refreshed_at
+    )
+    install_venue_order_books(web_app, job.pair)
+
+
+async def expire_stale_venues(web_app: OrderBookFastAPI, pairs: List[str]):
+    """Rebuild books still holding an exchange that stopped refreshing."""
+    max_age = web_app.extra["venue_books"].max_age
     while True:
-        await asyncio.sleep(interval)
-        order_books = await fetch_all_order_books(pair)
-        if order_books is not None:
+        await asyncio.sleep(max_age / 4)
+        for pair in pairs:
+            snapshot = web_app.get_app_order_book(pair)
+            if snapshot is not None and \
+                    max(snapshot.source_ages().values()) > max_age:
+                install_venue_order_books(web_app, pair)
+
+
+async def stream_order_book(web_app: OrderBookFastAPI, pair: str):
+    local_books: Dict[str, LocalOrderBook] = {}
+    book_changed = asyncio.Event()
+    merge_seconds = ORDER_BOOK_MERGE_SECONDS.labels(pair)
+
+    def on_update(local_book: LocalOrderBook):
+        local_books[local_book.exchange] = local_book
+        book_changed.set()
+
+    stream_tasks = [
+        asyncio.create_task(exchange_order_book.stream_order_book(on_update))
+        for exchange_order_book in get_exchange_pair_order_book(pair)
+    ]
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(book_changed.wait(), VENUE_MAX_AGE / 4)
+            except asyncio.TimeoutError:
+                # No level changed, rebuild only to drop a feed that went
+                # silent
+                snapshot = web_app.get_app_order_book(pair)
+                now = time.time()
+                if snapshot is None or all(
+                    now - local_books[exchange].received_at <= VENUE_MAX_AGE
+                    for exchange in snapshot.source_times
+                ):
+                    continue
+            book_changed.clear()
+            build_started_at = time.time()
+            # Like poll mode, leave out books whose feed has not been heard
+            # from for VENUE_MAX_AGE. A feed with no level changes is still
+            # live as long as it sends heartbeats
+            synced_books = [
+                local_book
+                for local_book in local_books.values()
+                if local_book.synced
+                and build_started_at - local_book.received_at <= VENUE_MAX_AGE
+            ]
+            if not synced_books:
+                web_app.drop_app_order_book(pair)
+                continue
+            order_books = [
+                local_book.to_columnar()
+                if ORDER_BOOK_BACKEND == "columnar"
+                else local_book.to_order_data()
+                for local_book in synced_books
+            ]
+            merge_started_at = time.perf_counter()
             merged_order_book = OrderBookMerger.merge_order_books(order_books)
-            web_app.set_app_order_book(pair, merged_order_book)
+            merge_seconds.observe(time.perf_counter() - merge_started_at)
+            web_app.set_app_order_book(
+                pair,
+                merged_order_book,
+                {
+                    local_book.exchange: local_book.received_at
+                    for local_book in synced_books
+                },
+                build_started_at,
+            )
+            # Coalesce bursts of diffs into one merge per interval
+            await asyncio.sleep(STREAM_MERGE_INTERVAL)
+    finally:
+        for stream_task in stream_tasks:
+            stream_task.cancel()
+        await asyncio.gather(*stream_tasks, return_exceptions=True)
+
+
+async def read_shared_order_books(web_app: OrderBookFastAPI, pairs: List[str]):
+    """Install the books a book_builder.py process publishes."""
+    readers: Dict[str, SharedBookReader] = {}
+    try:
+        while True:
+            for pair in pairs:
+                reader = readers.get(pair)
+                if reader is None:
+                    try:
+                        reader = readers[pair] = SharedBookReader(pair)
+                    except FileNotFoundError:
+                        continue  # The builder has not published it yet
+                current = web_app.get_app_order_book(pair)
+                if current is not None and current.version == reader.version:
+                    continue
+                snapshot = reader.read()
+                if snapshot is not None:
+                    web_app.install_app_order_book(snapshot)
+            await asyncio.sleep(SHARED_BOOK_POLL_INTERVAL)
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+async def log_stats(web_app: OrderBookFastAPI):
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        log.info(
+            f"Exchange fetch stats: {web_app.extra['http_session'].get_stats()}"
+        )
+        log.info(f"Quote fan-out stats: {web_app.extra['quote_hub'].get_stats()}")
+        log.info(
+            "Event loop lag: "
+            f"{web_app.extra['event_loop_monitor'].get_stats()}"
+        )
+        if "order_repository" in web_app.extra:
+            log.info(
+                "Order repository stats: "
+                f"{web_app.extra['order_repository'].get_stats()}"
+            )
+        if "matching_engine" in web_app.extra:
+            log.info(
+                "Matching engine stats: "
+                f"{web_app.extra['matching_engine'].get_stats()}"
+            )
+        if "refresh_scheduler" in web_app.extra:
+            log.info(
+                "Refresh stats: "
+                f"{web_app.extra['refresh_scheduler'].get_stats()}"
+            )
+            log.info(
+                f"Venue book stats: {web_app.extra['venue_books'].get_stats()}"
+            )
 
 
 @manager.add  # type: ignore
 async def start_up(web_app: OrderBookFastAPI):
     web_app.initialize_app_order_book()
-    pairs = ["BTCUSD", "ETHUSD"]
-    intervals = [1.2, 2.3, 3.4]
-    permut = permutations(intervals, len(pairs))
-    unique_comb = []
-    for comb in permut:
-        zipped = zip(comb, pairs)
-        unique_comb.extend(list(zipped))
-    for interval, pair in unique_comb:
-        asyncio.create_task(update_order_book(app, pair, interval))
+    web_app.extra["quote_hub"] = QuoteSubscriptionHub()
+    event_loop_monitor = EventLoopMonitor()
+    web_app.extra["event_loop_monitor"] = event_loop_monitor
+    # Every task below is cancelled and awaited on shutdown, before the
+    # resources they use are closed
+    background_tasks = [asyncio.create_task(event_loop_monitor.run())]
+    pairs = list(CURRENCY_PAIRS)
+    order_repository: Optional[OrderRepository] = None
+    # A book_builder.py process only builds and publishes books, orders are
+    # served, rested and filled by the API processes alone
+    if not web_app.extra.get("book_builder"):
+        order_repository = OrderRepository()
+        web_app.extra["order_repository"] = order_repository
+        order_status_hub = OrderStatusHub(order_repository)
+        web_app.extra["order_status_hub"] = order_status_hub
+        background_tasks.append(asyncio.create_task(order_status_hub.run()))
+        if ORDER_EXECUTION == "match":
+            matching_engine = MatchingEngine(order_repository)
+            await matching_engine.restore(pairs)
+            web_app.extra["matching_engine"] = matching_engine
+    http_session = ExchangeHTTPSession()
+    web_app.extra["http_session"] = http_session
+    background_tasks.append(asyncio.create_task(log_stats(web_app)))
+    book_source = web_app.extra.get("book_source", BOOK_SOURCE)
+    if book_source == "shared_memory":
+        background_tasks.append(asyncio.create_task(
+            read_shared_order_books(web_app, pairs)
+        ))
+    elif book_source == "redis":
+        book_storage = RedisOrderBookStorage()
+        web_app.extra["book_storage"] = book_storage
+        background_tasks.append(asyncio.create_task(
+            book_storage.subscribe(pairs, web_app.install_app_order_book)
+        ))
+    elif ORDER_BOOK_MODE == "stream":
+        for pair in pairs:
+            background_tasks.append(
+                asyncio.create_task(stream_order_book(web_app, pair))
+            )
+    else:
+        web_app.extra["venue_books"] = VenueBookCache()
+        refresh_scheduler = RefreshScheduler(
+            partial(on_venue_refresh, web_app)
+        )
+        for pair in pairs:
+            for exchange_order_book in get_exchange_pair_order_book(
+                pair, http_session
+            ):
+                refresh_scheduler.add_job(pair, exchange_order_book)
+        web_app.extra["refresh_scheduler"] = refresh_scheduler
+        refresh_scheduler.start()
+        background_tasks.append(
+            asyncio.create_task(expire_stale_venues(web_app, pairs))
+        )
     yield
+    if "refresh_scheduler" in web_app.extra:
+        await web_app.extra["refresh_scheduler"].stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if order_repository is not None:
+        await order_repository.close()
+    if "book_storage" in web_app.extra:
+        await web_app.extra["book_storage"].close()
     web_app.flush_app_order_book()
+    log.info(f"Exchange fetch stats: {http_session.get_stats()}")
+    await http_session.close()
 
 
 app = OrderBookFastAPI(lifespan=manager)
@@ -76,3 +376,5 @@ app.add_middleware(
 
 # app.include_router(router, prefix="/api")
 app.include_router(ws_router)
+app.include_router(stats_router)
+app.include_router(metrics_router)
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+"""
+    Module: bench_hot_paths
+    Description: Micro-benchmark suite of the order book hot paths, merging
+    (OrderBookMerger.merge_order_books), indexing (IndexedOrderBook),
+    pricing (PriceCalculator.calculate_price), routing
+    (ExchangeLimitOrderCalculator.get_best_limit_orders) and parsing
+    (OrderData.from_order and the exchange parsers, on the recorded payloads
+    in benchmarks/fixtures).
+
+    Synthetic books of 1k to 1M levels per side, split across 3 to 10
+    venues, are run on both book backends. Quotes are sized as fractions of
+    the side's total depth so they are comparable across book sizes. Each
+    case reports ops/s (median of several runs) and the peak memory allocated
+    by one call, and is compared to benchmarks/baseline.json: a case slower
+    or allocating more than the tolerance allows, confirmed by re-measuring
+    it, is reported and the suite exits with status 1.
+
+    Columnar sides store exchanges as codes into EXCHANGES, so synthetic
+    venues beyond those share their codes there.
+
+    Usage:
+        python benchmarks/bench_hot_paths.py [--levels 1000 10000 ...] \
+            [--venues 3 10] [--cases merge price ...] [--tolerance 0.3] \
+            [--save-baseline]
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import orjson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (  # noqa: E402
+    ExchangeLimitOrderCalculator,
+    IndexedOrderBook,
+    OrderBookMerger,
+    PriceCalculator,
+)
+from columnar_order_book import (  # noqa: E402
+    EXCHANGES,
+    ColumnarOrderBook,
+    ColumnarOrderSide,
+)
+from order_books import (  # noqa: E402
+    CoinbaseOrderBook,
+    GeminiOrderBook,
+    KrakenOrderBook,
+)
+from data_types import BTCUSDExchangePairs, Operation, OrderData  # noqa: E402
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+CASES = ("merge", "index", "price", "price_indexed", "route", "parse")
+BACKENDS = ("objects", "columnar")
+QUOTE_FRACTIONS = (0.0001, 0.01, 0.5)  # of the side's total depth
+REPEAT = 5
+# A case that looks like a regression is measured again up to this many
+# times, keeping the best, so one noisy run does not fail the suite
+CONFIRM_RUNS = 2
+# Allocations below this are noise (free lists, small caches)
+ALLOCATION_SLACK = 16 * 1024
+
+Benchmark = Tuple[str, Callable[[], object]]
+
+
+def make_venue_books(
+    levels: int, venues: int, backend: str, seed: int = 0
+) -> List[Tuple]:
+    """
+    Sorted synthetic books of 'venues' venues holding 'levels' levels per
+    side in total, around a mid price of 50000 with 0.5 ticks.
+    """
+    rng = np.random.default_rng(seed)
+    per_venue = max(levels // venues, 1)
+    venue_books = []
+    for venue in range(venues):
+        offset = rng.uniform(0, 0.5)
+        steps = np.arange(per_venue) * 0.5 + offset
+        sides = []
+        for prices in (50000.0 - 0.25 - steps, 50000.0 + 0.25 + steps):
+            amounts = rng.uniform(0.01, 1.0, per_venue)
+            timestamps = np.full(per_venue, 1700000000000, dtype=np.int64)
+            if backend == "columnar":
+                sides.append(ColumnarOrderSide(
+                    prices, amounts, timestamps,
+                    np.full(per_venue, venue % len(EXCHANGES), dtype=np.uint8),
+                ))
+            else:
+                exchange = f"VENUE{venue}"
+                sides.append([
+                    OrderData(price, amount, 1700000000000, exchange)
+                    for price, amount in zip(prices.tolist(), amounts.tolist())
+                ])
+        venue_books.append(ColumnarOrderBook(*sides)
+                           if backend == "columnar" else tuple(sides))
+    return venue_books
+
+
+def get_book_benchmarks(
+    cases: List[str], levels: int, venues: int, backend: str
+) -> List[Benchmark]:
+    venue_books = make_venue_books(levels, venues, backend)
+    merged = OrderBookMerger.merge_order_books(venue_books)
+    indexed = IndexedOrderBook(*merged)
+    depth = float(indexed.ask_index.cumulative_amount[-1])
+    prefix = f"{backend}/v{venues}/l{levels}"
+    benchmarks: List[Benchmark] = []
+    if "merge" in cases:
+        benchmarks.append((
+            f"merge/{prefix}",
+            lambda: OrderBookMerger.merge_order_books(venue_books),
+        ))
+    if "index" in cases:
+        benchmarks.append((f"index/{prefix}",
+                           lambda: IndexedOrderBook(*merged)))
+    for fraction in QUOTE_FRACTIONS:
+        quantity = depth * fraction
+        suffix = f"{prefix}/q{fraction:g}"
+        if "price" in cases:
+            benchmarks.append((
+                f"price/{suffix}",
+                lambda q=quantity: PriceCalculator.calculate_price(
+                    merged, Operation.BUY, q
+                ),
+            ))
+        if "price_indexed" in cases:
+            benchmarks.append((
+                f"price_indexed/{suffix}",
+                lambda q=quantity: PriceCalculator.calculate_price(
+                    indexed, Operation.BUY, q
+                ),
+            ))
+        if "route" in cases:
+            benchmarks.append((
+                f"route/{suffix}",
+                lambda q=quantity: (
+                    ExchangeLimitOrderCalculator.get_best_limit_orders(
+                        merged, Operation.BUY, q
+                    )
+                ),
+            ))
+    return benchmarks
+
+
+def get_parse_benchmarks() -> List[Benchmark]:
+    benchmarks: List[Benchmark] = []
+    for exchange_order_book, fixture in (
+        (CoinbaseOrderBook(BTCUSDExchangePairs.COINBASE),
+         "coinbase_btcusd.json"),
+        (KrakenOrderBook(BTCUSDExchangePairs.KRAKEN), "kraken_btcusd.json"),
+        (GeminiOrderBook(BTCUSDExchangePairs.GEMINI), "gemini_btcusd.json"),
+    ):
+        with open(os.path.join(FIXTURES_DIR, fixture), "rb") as raw_fixture:
+            raw = raw_fixture.read()
+        exchange = exchange_order_book.exchange_name
+        order_book = json.loads(raw)
+        if isinstance(exchange_order_book, KrakenOrderBook):
+            order_book = order_book["result"][
+                exchange_order_book._get_result_key()
+            ]
+        levels = order_book["bids"] + order_book["asks"]
+        benchmarks.append((
+            f"parse/from_order/{exchange.lower()}",
+            lambda levels=levels, exchange=exchange: [
+                OrderData.from_order(level, exchange) for level in levels
+            ],
+        ))
+        benchmarks.append((
+            f"parse/payload/{exchange.lower()}",
+            lambda book=exchange_order_book, raw=raw: book.parse_order_book(
+                raw
+            ),
+        ))
+    return benchmarks
+
+
+def settle_allocator() -> None:
+    """
+    Free one large array before measuring. glibc raises its mmap threshold
+    to the size of a freed mmapped block, after which large arrays come from
+    the heap rather than fresh, page faulting mappings. Without this the
+    speed of a case depends on what the process allocated before it.
+    """
+    block = np.ones(3 * 1024 * 1024)  # 24 MiB, below the 32 MiB cap
+    del block
+
+
+def measure(function: Callable[[], object]) -> Dict[str, float]:
+    """Median ops/s of REPEAT runs and the peak bytes allocated by one call."""
+    timer = timeit.Timer(function)
+    # Calls per run, so that a run lasts at least 0.2 s
+    number, _ = timer.autorange()
+    # The median rather than the best run, a lucky run recorded in the
+    # baseline would make every later comparison look like a regression
+    elapsed = statistics.median(timer.repeat(repeat=REPEAT, number=number))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_s": number / elapsed, "peak_alloc": peak - start}
+
+
+def check(
+    name: str, result: Dict[str, float], baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> str:
+    expected = baseline.get(name)
+    if expected is None:
+        return "new"
+    problems = []
+    if result["ops_per_s"] < expected["ops_per_s"] * (1 - tolerance):
+        problems.append(
+            f"{result['ops_per_s'] / expected['ops_per_s'] - 1:+.0%} ops/s"
+        )
+    if result["peak_alloc"] > \
+            expected["peak_alloc"] * (1 + tolerance) + ALLOCATION_SLACK:
+        problems.append(
+            f"{result['peak_alloc'] - expected['peak_alloc']:+,} B allocated"
+        )
+    if problems:
+        return "REGRESSION " + ", ".join(problems)
+    return f"{result['ops_per_s'] / expected['ops_per_s'] - 1:+.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", type=int, nargs="+",
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--venues", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS,
+                        default=list(BACKENDS))
+    parser.add_argument("--cases", nargs="+", choices=CASES,
+                        default=list(CASES))
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown and extra allocation, as a "
+                             "fraction of the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="record the results as the new baseline")
+    args = parser.parse_args()
+
+    baseline: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "rb") as baseline_file:
+            baseline = json.loads(baseline_file.read())
+
+    settle_allocator()
+    benchmarks: List[Benchmark] = []
+    if "parse" in args.cases:
+        benchmarks += get_parse_benchmarks()
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+    print(f"{'case':<48}{'ops/s':>14}{'alloc KiB':>12}  vs baseline")
+
+    def run(benchmarks: List[Benchmark]) -> None:
+        for name, function in benchmarks:
+            result = measure(function)
+            verdict = check(name, result, baseline, args.tolerance)
+            for _ in range(CONFIRM_RUNS):
+                if not verdict.startswith("REGRESSION"):
+                    break
+                retry = measure(function)
+                result = {
+                    "ops_per_s": max(result["ops_per_s"], retry["ops_per_s"]),
+                    "peak_alloc": min(result["peak_alloc"],
+                                      retry["peak_alloc"]),
+                }
+                verdict = check(name, result, baseline, args.tolerance)
+            results[name] = result
+            if verdict.startswith("REGRESSION"):
+                regressions.append(name)
+            print(f"{name:<48}{result['ops_per_s']:>14,.1f}"
+                  f"{result['peak_alloc'] / 1024:>12,.1f}  {verdict}")
+
+    run(benchmarks)
+    for backend in args.backends:
+        for venues in args.venues:
+            for levels in args.levels:
+                # Built per size so the largest books are freed in between
+                run(get_book_benchmarks(args.cases, levels, venues, backend))
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "wb") as baseline_file:
+            baseline_file.write(json.dumps(
+                baseline, option=json.OPT_INDENT_2 | json.OPT_SORT_KEYS
+            ))
+        print(f"Saved {len(results)} results to {args.baseline}")
+    elif regressions:
+        sys.exit(f"{len(regressions)} regressions against {args.baseline}: "
+                 f"{', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+"""
+    Module: bench_orders
+    Description: End-to-end limit order throughput through the Celery
+    worker: submits orders the way /ws/execute-limit-order does and times
+    until every one of them is FILLED in Redis.
+
+    Run the worker, with beat, and no execution delay, e.g.
+        ORDER_EXECUTION_DELAY=0 celery -A tasks.orders.celery_worker worker \
+            -B -P solo --without-gossip -Q tasks,celery
+
+    Usage:
+        python benchmarks/bench_orders.py [--orders 1000] [--timeout 300]
+"""
+import argparse
+import os
+import sys
+import time
+from uuid import uuid4
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tasks.orders import send_limit_order  # noqa: E402
+from config import (  # noqa: E402
+    REDIS_URL_LOCALHOST,
+    ORDER_STATUS_KEY,
+    EXECUTED_ORDERS_KEY,
+)
+from data_types import OrderStatus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    redis_client = redis.Redis.from_url(REDIS_URL_LOCALHOST)
+    order_ids = [uuid4().hex for _ in range(args.orders)]
+    executed_before = redis_client.xlen(EXECUTED_ORDERS_KEY.format("ABCD"))
+    status_keys = [ORDER_STATUS_KEY.format(order_id) for order_id in order_ids]
+    filled = OrderStatus.FILLED.value.encode()
+
+    start_time = time.monotonic()
+    for order_id in order_ids:
+        send_limit_order.delay({
+            "order_id": order_id,
+            "price": 50000.0,
+            "amount": 0.1,
+            "timestamp": int(time.time() * 1000),
+            "exchange": "KRAKEN",
+            "operation": "BUY",
+            "currency_pair": "BTCUSD",
+        })
+    submitted_time = time.monotonic()
+    filled_count = 0
+    while time.monotonic() - start_time < args.timeout:
+        filled_count = sum(
+            status == filled for status in redis_client.mget(status_keys)
+        )
+        if filled_count == args.orders:
+            break
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start_time
+    executed = (redis_client.xlen(EXECUTED_ORDERS_KEY.format("ABCD"))
+                - executed_before)
+
+    print(f"orders:        {args.orders}")
+    print(f"submitted in:  {submitted_time - start_time:.3f} s")
+    print(f"filled:        {filled_count} in {elapsed:.3f} s")
+    print(f"recorded:      {executed}")
+    print(f"throughput:    {filled_count / elapsed:.1f} orders/s")
+    if filled_count != args.orders:
+        sys.exit(f"Timed out with {args.orders - filled_count} orders pending")
+
+
+if __name__ == "__main__":
+    main()
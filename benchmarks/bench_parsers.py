@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""
+    Module: bench_parsers
+    Description: Micro-benchmark of the exchange-specific orjson parsers
+    against the stdlib json + _standardize_order_book path, on the recorded
+    payloads in benchmarks/fixtures.
+
+    Usage:
+        python benchmarks/bench_parsers.py [--number 50] [--repeat 5]
+"""
+import argparse
+import json as stdlib_json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from order_books import (  # noqa: E402
+    CoinbaseOrderBook,
+    ExchangeOrderBook,
+    GeminiOrderBook,
+    KrakenOrderBook,
+)
+from data_types import BTCUSDExchangePairs  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as fixture:
+        return fixture.read()
+
+
+def legacy_parse(exchange_order_book: ExchangeOrderBook, raw: bytes):
+    """The pre-fast-path pipeline: stdlib json then OrderData.from_order."""
+    order_book = stdlib_json.loads(raw)
+    if isinstance(exchange_order_book, KrakenOrderBook):
+        order_book = order_book["result"][exchange_order_book._get_result_key()]
+    return ExchangeOrderBook._standardize_order_book(
+        order_book["bids"], order_book["asks"],
+        exchange_order_book.exchange_name
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        (CoinbaseOrderBook(BTCUSDExchangePairs.COINBASE),
+         "coinbase_btcusd.json"),
+        (KrakenOrderBook(BTCUSDExchangePairs.KRAKEN), "kraken_btcusd.json"),
+        (GeminiOrderBook(BTCUSDExchangePairs.GEMINI), "gemini_btcusd.json"),
+    ]
+    print(f"{'exchange':<10}{'levels':>8}{'legacy ms':>12}{'fast ms':>10}"
+          f"{'speedup':>9}")
+    for exchange_order_book, fixture in cases:
+        raw = load_fixture(fixture)
+        expected = legacy_parse(exchange_order_book, raw)
+        parsed = exchange_order_book.parse_order_book(raw)
+        # list() also compares ColumnarOrderBook sides level by level
+        if list(map(list, parsed)) != list(map(list, expected)):
+            raise AssertionError(f"{fixture}: fast parser output differs")
+        # Best of several runs, the least disturbed by other processes
+        legacy = min(timeit.repeat(
+            lambda: legacy_parse(exchange_order_book, raw),
+            number=args.number, repeat=args.repeat,
+        )) / args.number
+        fast = min(timeit.repeat(
+            lambda: exchange_order_book.parse_order_book(raw),
+            number=args.number, repeat=args.repeat,
+        )) / args.number
+        levels = len(expected[0]) + len(expected[1])
+        print(f"{exchange_order_book.exchange_name:<10}{levels:>8}"
+              f"{legacy * 1000:>12.3f}{fast * 1000:>10.3f}"
+              f"{legacy / fast:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+"""
+    Module: load_pending_orders
+    Description: Load test of delayed order execution: puts N orders in the
+    pending state at once, due over a spread of delays, and measures how
+    late the Celery worker fills them and the throughput it sustains while
+    they are all pending.
+
+    Orders are submitted straight to Redis, as send_limit_order does, so the
+    submission rate does not limit how many are pending. Pass --via-celery
+    to submit through the send_limit_order task instead.
+
+    Run the worker with beat, e.g.
+        celery -A tasks.orders.celery_worker worker -B \
+            -P solo --without-gossip -Q tasks,celery
+
+    Usage:
+        python benchmarks/load_pending_orders.py [--orders 10000] \
+            [--min-delay 3] [--max-delay 10] [--timeout 120] [--via-celery]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from uuid import uuid4
+
+import numpy as np
+import orjson as json
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tasks.orders import send_limit_order, submit_order  # noqa: E402
+from config import (  # noqa: E402
+    REDIS_URL_LOCALHOST,
+    ORDER_STATUS_CHANNEL,
+    ORDER_DELAY_QUEUE_KEY,
+)
+from data_types import OrderStatus  # noqa: E402
+
+SUBMIT_PIPELINE = 500
+
+
+def get_order(order_id: str) -> dict:
+    return {
+        "order_id": order_id,
+        "price": 50000.0,
+        "amount": 0.1,
+        "timestamp": int(time.time() * 1000),
+        "exchange": "KRAKEN",
+        "operation": "BUY",
+        "currency_pair": "BTCUSD",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--min-delay", type=float, default=3.0)
+    parser.add_argument("--max-delay", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--via-celery", action="store_true",
+                        help="submit through send_limit_order, delays then "
+                             "come from ORDER_EXECUTION_DELAY")
+    args = parser.parse_args()
+
+    redis_client = redis.Redis.from_url(REDIS_URL_LOCALHOST)
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(ORDER_STATUS_CHANNEL)
+    filled_status = OrderStatus.FILLED.value
+
+    due_times = {}
+    start_time = time.time()
+    if args.via_celery:
+        for _ in range(args.orders):
+            order_id = uuid4().hex
+            due_times[order_id] = None
+            send_limit_order.delay(get_order(order_id))
+    else:
+        with redis_client.pipeline(transaction=False) as pipeline:
+            for i in range(args.orders):
+                order_id = uuid4().hex
+                delay = random.uniform(args.min_delay, args.max_delay)
+                due_times[order_id] = time.time() + delay
+                submit_order(pipeline, get_order(order_id), uuid4().hex, delay)
+                if (i + 1) % SUBMIT_PIPELINE == 0:
+                    pipeline.execute()
+            pipeline.execute()
+    submitted_time = time.time()
+
+    filled_times = {}
+    peak_pending = 0
+    next_sample = 0.0
+    while len(filled_times) < args.orders and \
+            time.time() - start_time < args.timeout:
+        now = time.time()
+        if now >= next_sample:
+            peak_pending = max(peak_pending, redis_client.zcard(
+                ORDER_DELAY_QUEUE_KEY
+            ))
+            next_sample = now + 0.1
+        message = pubsub.get_message(timeout=0.1)
+        if message is None:
+            continue
+        update = json.loads(message["data"])
+        if update["status"] == filled_status and \
+                update["orderId"] in due_times:
+            filled_times[update["orderId"]] = update["timestamp"] / 1000
+    pubsub.close()
+
+    print(f"orders:        {args.orders}")
+    print(f"submitted in:  {submitted_time - start_time:.3f} s")
+    print(f"peak pending:  {peak_pending}")
+    print(f"filled:        {len(filled_times)}")
+    if filled_times:
+        fills = np.array(sorted(filled_times.values()))
+        window = fills[-1] - fills[0]
+        print(f"fill window:   {window:.3f} s")
+        if window > 0:
+            print(f"throughput:    {len(fills) / window:.1f} orders/s")
+        lateness = np.array([
+            filled_times[order_id] - due_times[order_id]
+            for order_id in filled_times if due_times[order_id] is not None
+        ]) * 1000
+        if len(lateness):
+            p50, p99, p999 = np.percentile(lateness, [50, 99, 99.9])
+            print(f"lateness ms:   p50 {p50:.1f}  p99 {p99:.1f}  "
+                  f"p99.9 {p999:.1f}  max {lateness.max():.1f}")
+    if len(filled_times) != args.orders:
+        sys.exit(f"Timed out with {args.orders - len(filled_times)} orders "
+                 f"pending")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+"""
+    Module: load_websockets
+    Description: Websocket load test of one app process. Starts the stub
+    exchanges and the app on them, opens N concurrent clients on
+    /ws/order-book and/or /ws/limit-order, each sending quote requests at a
+    fixed rate, and reports throughput, p50/p99/p99.9 per-message latency
+    and the app's event loop lag over the measurement window.
+
+    Requests follow a fixed schedule per client and latency is measured
+    from the scheduled send time, so a stalled server is charged for the
+    requests it delayed (no coordinated omission). Client phases and
+    quantities come from --seed, the stub books from --stub-seed, and the
+    stub, app and driver processes can be pinned to CPUs, so a run is
+    reproducible on one Linux box.
+
+    Usage:
+        python benchmarks/load_websockets.py [--clients 100] [--rate 2] \
+            [--duration 30] [--warmup 5] [--endpoint mixed] \
+            [--driver-processes 1] [--app-cpus 0] [--stub-cpus 1] \
+            [--driver-cpus 2 3] [--json results.json]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import numpy as np
+import orjson as json
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = {
+    "order-book": "/ws/order-book",
+    "limit-order": "/ws/limit-order",
+}
+PAIRS = ("BTCUSD", "ETHUSD")
+
+
+def get_stub_env(stub_port: int) -> Dict[str, str]:
+    stub = f"localhost:{stub_port}"
+    return {
+        "COINBASE_REST_URL": f"http://{stub}/coinbase",
+        "COINBASE_WS_URL": f"ws://{stub}/coinbase/ws",
+        "KRAKEN_REST_URL": f"http://{stub}/kraken",
+        "KRAKEN_WS_URL": f"ws://{stub}/kraken/ws",
+        "GEMINI_REST_URL": f"http://{stub}/gemini",
+        "GEMINI_WS_URL": f"ws://{stub}/gemini",
+    }
+
+
+def start_process(
+    command: List[str], cpus: Optional[List[int]], env: Dict[str, str]
+) -> subprocess.Popen:
+    return subprocess.Popen(
+        command,
+        cwd=ROOT_DIR,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None,
+    )
+
+
+async def wait_for_quotes(url: str, timeout: float) -> None:
+    """Wait until the app answers a quote for every pair."""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.ws_connect(
+                    url + ENDPOINTS["order-book"]
+                ) as websocket:
+                    for pair in PAIRS:
+                        await websocket.send_json(
+                            {"currencyPair": pair, "quantity": 1}
+                        )
+                        message = await websocket.receive(timeout=5)
+                        if "buy_price" not in json.loads(message.data):
+                            raise ValueError(message.data)
+                return
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+
+async def get_event_loop_stats(url: str, reset: bool) -> Dict[str, Any]:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            url.replace("ws://", "http://") + "/stats/event-loop",
+            params={"reset": "true" if reset else "false"},
+        ) as response:
+            return await response.json()
+
+
+async def run_client(
+    session: aiohttp.ClientSession, url: str, endpoint: str, rate: float,
+    started_at: float, window: tuple, rng: random.Random,
+    latencies: List[float], counters: Dict[str, int],
+) -> None:
+    interval = 1.0 / rate
+    # Spread the clients evenly over one interval
+    scheduled = started_at + rng.uniform(0, interval)
+    async with session.ws_connect(url + ENDPOINTS[endpoint]) as websocket:
+        while scheduled < window[1]:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            request = {
+                "currencyPair": rng.choice(PAIRS),
+                "quantity": round(rng.uniform(0.1, 10), 2),
+            }
+            if endpoint == "limit-order":
+                request["operation"] = rng.choice(("BUY", "SELL"))
+            await websocket.send_str(json.dumps(request).decode())
+            message = await websocket.receive()
+            received_at = time.monotonic()
+            if message.type != aiohttp.WSMsgType.TEXT:
+                counters["disconnects"] += 1
+                return
+            if window[0] <= scheduled:
+                latencies.append(received_at - scheduled)
+                counters["responses"] += 1
+                if message.data.startswith("Error"):
+                    counters["errors"] += 1
+            scheduled += interval
+
+
+def run_driver(
+    url: str, clients: List[str], rate: float, started_at: float,
+    window: tuple, seed: int, cpus: Optional[List[int]],
+) -> Dict[str, Any]:
+    """Run 'clients' (their endpoints) in one process, return the samples."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+    async def run() -> Dict[str, Any]:
+        latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        counters = {endpoint: {"responses": 0, "errors": 0, "disconnects": 0}
+                    for endpoint in ENDPOINTS}
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(
+                run_client(session, url, endpoint, rate, started_at, window,
+                           random.Random(seed * 100003 + index),
+                           latencies[endpoint], counters[endpoint])
+                for index, endpoint in enumerate(clients)
+            ))
+        return {"latencies": latencies, "counters": counters}
+
+    return asyncio.run(run())
+
+
+def summarize(latencies: List[float], counters: Dict[str, int],
+              duration: float) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {
+        **counters, "throughput": round(counters["responses"] / duration, 1),
+    }
+    if latencies:
+        samples = np.array(latencies) * 1000
+        p50, p99, p999 = np.percentile(samples, [50, 99, 99.9])
+        summary.update({
+            "p50_ms": round(float(p50), 3),
+            "p99_ms": round(float(p99), 3),
+            "p999_ms": round(float(p999), 3),
+            "max_ms": round(float(samples.max()), 3),
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=2.0,
+                        help="requests per second per client")
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="seconds measured, after the warm up")
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--endpoint", default="mixed",
+                        choices=[*ENDPOINTS, "mixed"],
+                        help="mixed splits the clients between both")
+    parser.add_argument("--driver-processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None,
+                        help="load an already running app instead, e.g. "
+                             "ws://localhost:8000")
+    parser.add_argument("--app-port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=8081)
+    parser.add_argument("--stub-levels", type=int, default=1000)
+    parser.add_argument("--stub-seed", type=int, default=0)
+    parser.add_argument("--app-cpus", type=int, nargs="+")
+    parser.add_argument("--stub-cpus", type=int, nargs="+")
+    parser.add_argument("--driver-cpus", type=int, nargs="+")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    processes = []
+    url = args.url or f"ws://localhost:{args.app_port}"
+    try:
+        if args.url is None:
+            env = get_stub_env(args.stub_port)
+            processes.append(start_process(
+                [sys.executable, "stub_exchange.py",
+                 "--port", str(args.stub_port),
+                 "--levels", str(args.stub_levels),
+                 "--seed", str(args.stub_seed)],
+                args.stub_cpus, env,
+            ))
+            processes.append(start_process(
+                [sys.executable, "-m", "uvicorn", "app:app",
+                 "--port", str(args.app_port), "--log-level", "warning"],
+                args.app_cpus, {**env, "BOOK_SOURCE": "exchanges"},
+            ))
+        asyncio.run(wait_for_quotes(url, timeout=60))
+
+        endpoints = list(ENDPOINTS) if args.endpoint == "mixed" \
+            else [args.endpoint]
+        clients = [endpoints[index % len(endpoints)]
+                   for index in range(args.clients)]
+        # Every driver shares one schedule, connecting takes the first second
+        started_at = time.monotonic() + 1.0
+        window = (started_at + args.warmup,
+                  started_at + args.warmup + args.duration)
+        driver_count = max(1, min(args.driver_processes, args.clients))
+        pool = multiprocessing.get_context("spawn").Pool(driver_count)
+        try:
+            pending = [
+                pool.apply_async(run_driver, (
+                    url, clients[index::driver_count], args.rate, started_at,
+                    window, args.seed + index, args.driver_cpus,
+                ))
+                for index in range(driver_count)
+            ]
+            time.sleep(max(window[0] - time.monotonic(), 0))
+            asyncio.run(get_event_loop_stats(url, reset=True))
+            time.sleep(max(window[1] - time.monotonic(), 0))
+            event_loop = asyncio.run(get_event_loop_stats(url, reset=False))
+            driver_results = [result.get() for result in pending]
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    results: Dict[str, Any] = {
+        "config": {key: value for key, value in vars(args).items()
+                   if key != "json"},
+        "endpoints": {},
+        "event_loop_lag": event_loop,
+    }
+    all_latencies: List[float] = []
+    all_counters = {"responses": 0, "errors": 0, "disconnects": 0}
+    for endpoint in endpoints:
+        latencies = [latency for result in driver_results
+                     for latency in result["latencies"][endpoint]]
+        counters = {
+            name: sum(result["counters"][endpoint][name]
+                      for result in driver_results)
+            for name in all_counters
+        }
+        all_latencies += latencies
+        for name in all_counters:
+            all_counters[name] += counters[name]
+        results["endpoints"][endpoint] = summarize(latencies, counters,
+                                                   args.duration)
+    results["total"] = summarize(all_latencies, all_counters, args.duration)
+
+    print(f"clients {args.clients} x {args.rate:g} req/s, "
+          f"{args.duration:g} s measured after {args.warmup:g} s warm up")
+    print(f"{'endpoint':<14}{'msg/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'p99.9 ms':>10}{'max ms':>9}{'errors':>8}")
+    for name, summary in [*results["endpoints"].items(),
+                          ("total", results["total"])]:
+        print(f"{name:<14}{summary['throughput']:>9.1f}"
+              f"{summary.get('p50_ms', 0):>9.2f}"
+              f"{summary.get('p99_ms', 0):>9.2f}"
+              f"{summary.get('p999_ms', 0):>10.2f}"
+              f"{summary.get('max_ms', 0):>9.2f}"
+              f"{summary['errors'] + summary['disconnects']:>8}")
+    print(f"event loop lag: {event_loop}")
+    if args.json:
+        with open(args.json, "wb") as results_file:
+            results_file.write(json.dumps(results, option=json.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
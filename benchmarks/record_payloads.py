@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+"""
+    Module: record_payloads
+    Description: Record raw order book responses from the exchanges (or a
+    stub_exchange.py server via the *_REST_URL settings) as benchmark
+    fixtures.
+
+    Usage:
+        python benchmarks/record_payloads.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import get_exchange_pair_order_book  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+
+async def record(pair: str) -> None:
+    for exchange_order_book in get_exchange_pair_order_book(pair):
+        raw = await exchange_order_book.get_raw_order_book_from_exchange(
+            exchange_order_book._url
+        )
+        path = os.path.join(
+            FIXTURES_DIR,
+            f"{exchange_order_book.exchange_name.lower()}_{pair.lower()}.json",
+        )
+        with open(path, "wb") as fixture:
+            fixture.write(raw)
+        print(f"Recorded {len(raw)} bytes to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(record(sys.argv[1] if len(sys.argv) > 1 else "BTCUSD"))
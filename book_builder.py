@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+"""
+    Module: book_builder
+    Description: Dedicated process that fetches and merges the order books
+    (poll or stream mode, as configured) and publishes every snapshot to
+    shared memory, for web workers on this host started with
+    BOOK_SOURCE=shared_memory, and/or to Redis, for nodes started with
+    BOOK_SOURCE=redis. It starts no order services, the web workers
+    alone accept, match and fill orders.
+
+    Usage:
+        python book_builder.py [--target shared_memory] [--target redis]
+        BOOK_SOURCE=shared_memory uvicorn app:app --workers 4
+"""
+import argparse
+import asyncio
+import signal
+from typing import List
+
+from app import app
+from shared_book import SharedBookPublisher
+from redis_client import RedisOrderBookStorage
+from log import LOGGER as log
+
+PUBLISHERS = {
+    "shared_memory": SharedBookPublisher,
+    "redis": RedisOrderBookStorage,
+}
+
+
+async def run_book_builder(targets: List[str]) -> None:
+    publishers = [PUBLISHERS[target]() for target in targets]
+    app.extra["book_source"] = "exchanges"
+    app.extra["book_builder"] = True
+    app.extra["book_publishers"] = publishers
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        async with app.router.lifespan_context(app):
+            log.info(f"Book builder publishing to {', '.join(targets)}")
+            await stop.wait()
+    finally:
+        for publisher in publishers:
+            result = publisher.close()
+            if asyncio.iscoroutine(result):
+                await result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", action="append", choices=PUBLISHERS,
+                        help="where to publish books, default shared_memory")
+    args = parser.parse_args()
+    asyncio.run(run_book_builder(args.target or ["shared_memory"]))
@@ -0,0 +1,208 @@
+from typing import Any, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from data_types import OrderData
+
+# Exchange names are stored as small integer codes, index into this tuple
+EXCHANGES = ("COINBASE", "KRAKEN", "GEMINI")
+EXCHANGE_CODES = {exchange: code for code, exchange in enumerate(EXCHANGES)}
+
+
+class ColumnarOrderSide:
+    """
+    One side of an order book held in contiguous NumPy arrays.
+
+    Iterating yields OrderData, so code written against List[OrderData]
+    keeps working, while the hot paths in utils use the arrays directly.
+
+    Attributes:
+        price (np.ndarray): float64 level prices.
+        amount (np.ndarray): float64 level amounts.
+        timestamp (np.ndarray): int64 level timestamps.
+        exchange (np.ndarray): uint8 exchange codes, see EXCHANGES.
+    """
+
+    __slots__ = ("price", "amount", "timestamp", "exchange")
+
+    def __init__(
+        self,
+        price: np.ndarray,
+        amount: np.ndarray,
+        timestamp: np.ndarray,
+        exchange: np.ndarray,
+    ) -> None:
+        self.price = price
+        self.amount = amount
+        self.timestamp = timestamp
+        self.exchange = exchange
+
+    @classmethod
+    def empty(cls) -> "ColumnarOrderSide":
+        return cls(
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_levels(cls, levels: List[Any], exchange: str) -> "ColumnarOrderSide":
+        """
+        Build a side in bulk from raw exchange levels.
+
+        Args:
+            levels (List[Any]): [price, amount, timestamp, ...] lists or
+                                {"price", "amount", "timestamp"} dicts, the
+                                same shapes OrderData.from_order accepts.
+            exchange (str): The exchange the levels come from.
+
+        Returns:
+            ColumnarOrderSide: The side, in the order of 'levels'.
+
+        Raises:
+            TypeError: If the type of the levels is not supported.
+        """
+        count = len(levels)
+        if count == 0:
+            return cls.empty()
+        if isinstance(levels[0], list):
+            prices, amounts, timestamps = zip(*(level[:3] for level in levels))
+        elif isinstance(levels[0], dict):
+            prices, amounts, timestamps = zip(
+                *(
+                    (level["price"], level["amount"], level["timestamp"])
+                    for level in levels
+                )
+            )
+        else:
+            raise TypeError(f"Unsupported type for 'levels': {type(levels[0])}")
+        return cls(
+            np.fromiter(map(float, prices), np.float64, count),
+            np.fromiter(map(float, amounts), np.float64, count),
+            np.fromiter(map(float, timestamps), np.float64, count).astype(
+                np.int64
+            ),
+            np.full(count, EXCHANGE_CODES[exchange], dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_orders(cls, orders: List[OrderData]) -> "ColumnarOrderSide":
+        """Build a side from standardized OrderData."""
+        count = len(orders)
+        return cls(
+            np.fromiter((order.price for order in orders), np.float64, count),
+            np.fromiter((order.amount for order in orders), np.float64, count),
+            np.fromiter((order.timestamp for order in orders), np.int64, count),
+            np.fromiter(
+                (EXCHANGE_CODES[order.exchange] for order in orders),
+                np.uint8,
+                count,
+            ),
+        )
+
+    @classmethod
+    def concatenate(cls, sides: List["ColumnarOrderSide"]) -> "ColumnarOrderSide":
+        if not sides:
+            return cls.empty()
+        return cls(
+            np.concatenate([side.price for side in sides]),
+            np.concatenate([side.amount for side in sides]),
+            np.concatenate([side.timestamp for side in sides]),
+            np.concatenate([side.exchange for side in sides]),
+        )
+
+    def take(self, indices: np.ndarray) -> "ColumnarOrderSide":
+        return ColumnarOrderSide(
+            self.price[indices],
+            self.amount[indices],
+            self.timestamp[indices],
+            self.exchange[indices],
+        )
+
+    def cap_notional(self, max_notional: float) -> "ColumnarOrderSide":
+        """Keep levels up to and including the one crossing 'max_notional'."""
+        cumulative_notional = np.cumsum(self.price * self.amount)
+        count = int(np.searchsorted(cumulative_notional, max_notional)) + 1
+        if count >= len(self):
+            return self
+        # Copy so the dropped tail is freed rather than kept alive by views
+        return ColumnarOrderSide(
+            self.price[:count].copy(),
+            self.amount[:count].copy(),
+            self.timestamp[:count].copy(),
+            self.exchange[:count].copy(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def __iter__(self) -> Iterator[OrderData]:
+        for price, amount, timestamp, code in zip(
+            self.price.tolist(),
+            self.amount.tolist(),
+            self.timestamp.tolist(),
+            self.exchange.tolist(),
+        ):
+            yield OrderData(price, amount, timestamp, EXCHANGES[code])
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.price.nbytes
+            + self.amount.nbytes
+            + self.timestamp.nbytes
+            + self.exchange.nbytes
+        )
+
+
+class ColumnarOrderBook(NamedTuple):
+    """
+    Bid and ask sides held as ColumnarOrderSide.
+
+    Unpacks like the (bids, asks) tuples used everywhere else, so it can be
+    passed to OrderBookMerger, PriceCalculator and
+    ExchangeLimitOrderCalculator unchanged.
+    """
+
+    bids: ColumnarOrderSide
+    asks: ColumnarOrderSide
+
+    @classmethod
+    def from_raw(
+        cls, bids: List[Any], asks: List[Any], exchange: str
+    ) -> "ColumnarOrderBook":
+        """Build an exchange book from raw bid and ask levels."""
+        return cls(
+            ColumnarOrderSide.from_levels(bids, exchange),
+            ColumnarOrderSide.from_levels(asks, exchange),
+        )
+
+    @classmethod
+    def from_order_data(
+        cls, order_book: Tuple[List[OrderData], List[OrderData]]
+    ) -> "ColumnarOrderBook":
+        bids, asks = order_book
+        return cls(
+            ColumnarOrderSide.from_orders(bids),
+            ColumnarOrderSide.from_orders(asks),
+        )
+
+    @classmethod
+    def merge(cls, order_books: List["ColumnarOrderBook"]) -> "ColumnarOrderBook":
+        """
+        Merge exchange books into one book.
+
+        Each exchange side is already sorted, the stable sort (timsort)
+        merges those runs and keeps the exchange order for equal prices.
+
+        Returns:
+            ColumnarOrderBook: Bids sorted by price descending and asks
+            sorted by price ascending.
+        """
+        bids = ColumnarOrderSide.concatenate([book.bids for book in order_books])
+        asks = ColumnarOrderSide.concatenate([book.asks for book in order_books])
+        return cls(
+            bids.take(np.argsort(-bids.price, kind="stable")),
+            asks.take(np.argsort(asks.price, kind="stable")),
+        )
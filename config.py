@@ -1,7 +1,38 @@
+import os
+
+from data_types import DepthLimit
+
 REDIS_URL = "redis://redis:6379/0"
 
 REDIS_URL_LOCALHOST = "redis://localhost:6379/0"
 
+REDIS_RECONNECT_DELAY = 1.0  # seconds before resubscribing after an error
+REDIS_MAX_CONNECTIONS = 16  # per process, for the websocket handlers
+REDIS_POOL_TIMEOUT = 5  # seconds to wait for a free pooled connection
+REDIS_MAX_PIPELINE = 512  # commands per auto-pipelined round trip
+
+# Currency pairs served, books are built and orders accepted for these only
+CURRENCY_PAIRS = ("BTCUSD", "ETHUSD")
+
+# Seconds a limit order waits before it is filled, random 3-10 if unset
+ORDER_EXECUTION_DELAY = (
+    int(os.environ["ORDER_EXECUTION_DELAY"])
+    if os.environ.get("ORDER_EXECUTION_DELAY") else None
+)
+# How limit orders are filled: "delay" after ORDER_EXECUTION_DELAY
+# regardless of price, or "match" once the merged book crosses their price
+ORDER_EXECUTION = os.environ.get("ORDER_EXECUTION", "delay")
+ORDER_DISPATCH_INTERVAL = 0.25  # seconds between checks for due orders
+ORDER_DISPATCH_BATCH = 500  # due orders filled per Redis round trip
+ORDER_BATCH_MAX_SIZE = 1000  # orders accepted in one batch message
+ORDER_BATCH_CHUNK_SIZE = 100  # orders per Celery message of a batch
+ORDER_STATUS_MAX_BATCH_SIZE = 1000  # order ids per status query
+ORDER_STATUS_MAX_SUBSCRIPTIONS = 1000  # order ids subscribed per connection
+EXECUTED_ORDERS_MAX_LEN = 100000  # approximate cap of a client's history
+EXECUTED_ORDERS_PAGE_SIZE = 100  # default executed orders per request
+EXECUTED_ORDERS_MAX_PAGE_SIZE = 10000
+EXECUTED_ORDERS_CHUNK_SIZE = 500  # executed orders per websocket frame
+
 # Websocket endpoints
 WS_PREFIX = "/ws"
 ORDER_BOOK_ENDPOINT = "/order-book"
@@ -10,9 +41,105 @@ EXECUTE_LIMIT_ORDER_ENDPOINT = "/execute-limit-order"
 GET_LIMIT_ORDER_STATUS_ENDPOINT = "/get-limit-order-status"
 GET_EXECUTED_ORDERS_ENDPOINT = "/get-executed-orders"
 
+# HTTP endpoints
+STATS_PREFIX = "/stats"
+EVENT_LOOP_STATS_ENDPOINT = "/event-loop"
+METRICS_ENDPOINT = "/metrics"  # Prometheus exposition
+
+# Websocket message actions
+SUBSCRIBE_ACTION = "subscribe"
+UNSUBSCRIBE_ACTION = "unsubscribe"
+# (pair, quantity, side) quote subscriptions per connection
+QUOTE_MAX_SUBSCRIPTIONS = 100
+
 
 # Redis Keys
 ORDER_KEY = "order:{}"
 TASK_ID_KEY = "order:{}:task_id"
-EXECUTED_ORDERS_KEY = "executed_orders:{}"
+EXECUTED_ORDERS_KEY = "executed_orders:{}:stream"  # per client
 ORDER_STATUS_KEY = "order:{}:status"
+ORDER_STATUS_CHANNEL = "order_status_updates"
+ORDER_DELAY_QUEUE_KEY = "pending_orders"  # sorted set scored by due time
+RESTING_ORDERS_KEY = "resting_orders:{}"  # ids of unfilled orders per pair
+ORDER_BOOK_SNAPSHOT_KEY = "order_book:{}:snapshot"
+ORDER_BOOK_CHANNEL = "order_book:{}:updates"
+
+
+# Exchange endpoints (override to point at a local stub_exchange.py server)
+COINBASE_REST_URL = os.environ.get(
+    "COINBASE_REST_URL", "https://api.pro.coinbase.com"
+)
+COINBASE_WS_URL = os.environ.get(
+    "COINBASE_WS_URL", "wss://ws-feed.exchange.coinbase.com"
+)
+KRAKEN_REST_URL = os.environ.get("KRAKEN_REST_URL", "https://api.kraken.com")
+KRAKEN_WS_URL = os.environ.get("KRAKEN_WS_URL", "wss://ws.kraken.com")
+GEMINI_REST_URL = os.environ.get("GEMINI_REST_URL", "https://api.gemini.com")
+GEMINI_WS_URL = os.environ.get("GEMINI_WS_URL", "wss://api.gemini.com")
+
+
+# Order book refresh
+# "poll": periodic REST snapshots, "stream": snapshot + level-2 diff feeds
+ORDER_BOOK_MODE = os.environ.get("ORDER_BOOK_MODE", "poll")
+STREAM_MERGE_INTERVAL = 0.1  # seconds between merges of streamed books
+STREAM_RECONNECT_DELAY = 1.0  # seconds to wait before resyncing a feed
+STREAM_RECEIVE_TIMEOUT = 10.0  # resync a feed that stays silent this long
+
+# "objects": List[OrderData] per side, "columnar": NumPy arrays per side
+ORDER_BOOK_BACKEND = os.environ.get("ORDER_BOOK_BACKEND", "objects")
+
+# Shared exchange HTTP session
+EXCHANGE_CONNECT_TIMEOUT = 2.0  # seconds
+EXCHANGE_READ_TIMEOUT = 5.0  # seconds
+EXCHANGE_CONNECTION_LIMIT_PER_HOST = 4
+EXCHANGE_DNS_CACHE_TTL = 300  # seconds
+EXCHANGE_KEEPALIVE_TIMEOUT = 60.0  # seconds
+STATS_LOG_INTERVAL = 60.0  # seconds between fetch/fan-out stats logs
+LOOP_LAG_INTERVAL = 0.05  # seconds between event loop lag samples
+LOOP_LAG_SAMPLES = 10000  # latest lag samples kept
+# Port the Celery worker serves its Prometheus metrics on
+CELERY_METRICS_PORT = int(os.environ.get("CELERY_METRICS_PORT", 9808))
+
+# Per-pair, per-exchange order book depth caps, unlisted books are uncapped.
+# max_levels is sent to the exchange where supported (Kraken count, Gemini
+# limit_bids/limit_asks), both caps are enforced during standardisation.
+ORDER_BOOK_DEPTH_LIMITS = {
+    "BTCUSD": {
+        "COINBASE": DepthLimit(max_levels=500, max_notional=50_000_000.0),
+        "KRAKEN": DepthLimit(max_levels=500, max_notional=50_000_000.0),
+        "GEMINI": DepthLimit(max_levels=500, max_notional=50_000_000.0),
+    },
+    "ETHUSD": {
+        "COINBASE": DepthLimit(max_levels=500, max_notional=20_000_000.0),
+        "KRAKEN": DepthLimit(max_levels=500, max_notional=20_000_000.0),
+        "GEMINI": DepthLimit(max_levels=500, max_notional=20_000_000.0),
+    },
+}
+
+# Poll mode refresh scheduler, one job per (pair, exchange)
+REFRESH_INTERVALS = {  # target seconds between refreshes of one job
+    "COINBASE": 1.0,
+    "KRAKEN": 2.0,
+    "GEMINI": 1.0,
+}
+REFRESH_JITTER = 0.1  # +/- fraction of the interval, spreads jobs apart
+# Public REST limits shared by all pairs: (requests, per seconds)
+EXCHANGE_RATE_LIMITS = {
+    "COINBASE": (10, 1.0),
+    "KRAKEN": (1, 1.0),
+    "GEMINI": (2, 1.0),
+}
+REFRESH_BACKOFF_INITIAL = 1.0  # seconds after the first failed refresh
+REFRESH_BACKOFF_MAX = 30.0  # seconds, backoff doubles up to this
+EXCHANGE_FETCH_DEADLINE = 3.0  # seconds, a slower fetch counts as failed
+# Drop an exchange from the merged book once its data is older than this
+VENUE_MAX_AGE = 10.0  # seconds
+
+# Where web workers get merged books from: "exchanges" fetches them in
+# every worker, "shared_memory" reads the books a book_builder.py process
+# publishes on this host, "redis" follows the books one publishes to Redis.
+BOOK_SOURCE = os.environ.get("BOOK_SOURCE", "exchanges")
+BOOK_REDIS_URL = os.environ.get("BOOK_REDIS_URL", REDIS_URL_LOCALHOST)
+SHARED_BOOK_NAME = "order_book_{}"  # shared memory segment name per pair
+SHARED_BOOK_CAPACITY = 16384  # max levels per side in a shared book
+SHARED_BOOK_POLL_INTERVAL = 0.02  # seconds between version checks
@@ -1,6 +1,6 @@
 from enum import Enum
 from dataclasses import dataclass
-from typing import Tuple, Any, overload
+from typing import Tuple, Any, Optional, overload
 
 
 class ExchangePairs(str, Enum):
@@ -136,3 +136,18 @@ class OrderData:
         else:
             raise TypeError(f"Unsupported type for 'item': {type(item)}")
         return cls(price, amount, timestamp, exchange)
+
+
+@dataclass(frozen=True)
+class DepthLimit:
+    """
+    Dataclass capping how much of an exchange's order book is kept.
+
+    Attributes:
+        max_levels (Optional[int]): Maximum number of levels per side.
+        max_notional (Optional[float]): Maximum cumulative price * amount per
+                                        side, the level crossing it is kept.
+    """
+
+    max_levels: Optional[int] = None
+    max_notional: Optional[float] = None
@@ -0,0 +1,54 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict
+
+import numpy as np
+
+from config import LOOP_LAG_INTERVAL, LOOP_LAG_SAMPLES
+
+
+class EventLoopMonitor:
+    """
+    Measures event loop lag: how late a timer due every 'interval' seconds
+    actually runs. Anything blocking the loop, e.g. a slow merge or a
+    synchronous Redis call, shows up as lag for every connection served by
+    it.
+
+    The latest LOOP_LAG_SAMPLES samples are kept.
+
+    Usage:
+        event_loop_monitor = EventLoopMonitor()
+        asyncio.create_task(event_loop_monitor.run())
+        ...
+        event_loop_monitor.get_stats()
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL) -> None:
+        self.interval = interval
+        self._lags: Deque[float] = deque(maxlen=LOOP_LAG_SAMPLES)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(self.interval)
+            self._lags.append(
+                max(loop.time() - started_at - self.interval, 0.0)
+            )
+
+    def reset(self) -> None:
+        self._lags.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lag percentiles of the kept samples, in milliseconds."""
+        if not self._lags:
+            return {"samples": 0}
+        lags = np.fromiter(self._lags, np.float64, len(self._lags)) * 1000
+        p50, p99, p999 = np.percentile(lags, [50, 99, 99.9])
+        return {
+            "samples": len(lags),
+            "p50_ms": round(float(p50), 3),
+            "p99_ms": round(float(p99), 3),
+            "p999_ms": round(float(p999), 3),
+            "max_ms": round(float(lags.max()), 3),
+        }
@@ -0,0 +1,174 @@
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import orjson as json
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+
+from config import (
+    EXCHANGE_CONNECT_TIMEOUT,
+    EXCHANGE_READ_TIMEOUT,
+    EXCHANGE_CONNECTION_LIMIT_PER_HOST,
+    EXCHANGE_DNS_CACHE_TTL,
+    EXCHANGE_KEEPALIVE_TIMEOUT,
+)
+
+
+class FetchStats:
+    """
+    Latency and connection counters for the requests made to one host.
+
+    Attributes:
+        requests (int): Completed requests.
+        errors (int): Requests that raised.
+        new_connections (int): Requests that had to open a connection.
+        reused_connections (int): Requests served on a pooled connection.
+        total_latency (float): Sum of request latencies in seconds.
+        max_latency (float): Slowest request latency in seconds.
+        total_bytes (int): Sum of response body sizes.
+    """
+
+    __slots__ = (
+        "requests",
+        "errors",
+        "new_connections",
+        "reused_connections",
+        "total_latency",
+        "max_latency",
+        "total_bytes",
+    )
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_bytes = 0
+
+    @property
+    def reuse_rate(self) -> float:
+        connections = self.new_connections + self.reused_connections
+        return self.reused_connections / connections if connections else 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_rate": round(self.reuse_rate, 4),
+            "mean_latency": round(self.mean_latency, 6),
+            "max_latency": round(self.max_latency, 6),
+            "total_bytes": self.total_bytes,
+        }
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    stats = trace_config_ctx.trace_request_ctx
+    if stats is not None:
+        stats.new_connections += 1
+
+
+async def _on_connection_reuseconn(session, trace_config_ctx, params):
+    stats = trace_config_ctx.trace_request_ctx
+    if stats is not None:
+        stats.reused_connections += 1
+
+
+class ExchangeHTTPSession:
+    """
+    Long-lived, pooled aiohttp session shared by all exchange fetches.
+
+    Keeps connections alive between refreshes so a fetch does not pay a new
+    TCP and TLS handshake, caches DNS lookups, caps the connections opened
+    to each exchange host and records FetchStats per host.
+
+    Usage:
+        http_session = ExchangeHTTPSession()
+        ...
+        data = await http_session.get_json(url)
+        ...
+        await http_session.close()
+    """
+
+    __slots__ = ("_session", "stats")
+
+    def __init__(self) -> None:
+        self._session: Optional[ClientSession] = None
+        self.stats: Dict[str, FetchStats] = {}
+
+    def _get_session(self) -> ClientSession:
+        # Created lazily so the connector binds to the running event loop
+        if self._session is None or self._session.closed:
+            trace_config = TraceConfig()
+            trace_config.on_connection_create_end.append(
+                _on_connection_create_end
+            )
+            trace_config.on_connection_reuseconn.append(
+                _on_connection_reuseconn
+            )
+            connector = TCPConnector(
+                limit_per_host=EXCHANGE_CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=EXCHANGE_DNS_CACHE_TTL,
+                keepalive_timeout=EXCHANGE_KEEPALIVE_TIMEOUT,
+            )
+            self._session = ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(
+                    total=None,
+                    sock_connect=EXCHANGE_CONNECT_TIMEOUT,
+                    sock_read=EXCHANGE_READ_TIMEOUT,
+                ),
+                headers={"Accept-Encoding": "gzip"},
+                trace_configs=[trace_config],
+            )
+        return self._session
+
+    async def get_bytes(self, url: str) -> bytes:
+        """
+        GET 'url' on the shared session and return the raw response body.
+
+        Raises:
+            aiohttp.ClientError: If the request fails or returns an error
+                                 status.
+            asyncio.TimeoutError: If connecting or reading times out.
+        """
+        host = urlsplit(url).netloc
+        stats = self.stats.get(host)
+        if stats is None:
+            stats = self.stats[host] = FetchStats()
+        start_time = time.monotonic()
+        try:
+            async with self._get_session().get(
+                url, trace_request_ctx=stats
+            ) as response:
+                response.raise_for_status()
+                body = await response.read()
+        except Exception:
+            stats.errors += 1
+            raise
+        latency = time.monotonic() - start_time
+        stats.requests += 1
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+        stats.total_bytes += len(body)
+        return body
+
+    async def get_json(self, url: str) -> Any:
+        """GET 'url' on the shared session and return the decoded JSON body."""
+        return json.loads(await self.get_bytes(url))
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: stats.to_dict() for host, stats in self.stats.items()}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
@@ -0,0 +1,235 @@
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import time
+
+import numpy as np
+
+from data_types import OrderData, DepthLimit
+from columnar_order_book import (
+    ColumnarOrderBook,
+    ColumnarOrderSide,
+    EXCHANGE_CODES,
+)
+
+
+class SequenceGapError(Exception):
+    """Raised when a level-2 feed skips one or more sequence numbers."""
+
+
+@dataclass
+class BookUpdate:
+    """
+    Exchange independent level-2 update.
+
+    Attributes:
+        sequence (Optional[int]): Feed sequence number, None if the exchange
+                                  does not provide one.
+        snapshot (bool): True if the update replaces the whole book.
+        bids (List[Tuple[float, float]]): (price, amount) bid levels, an
+                                          amount of 0 removes the level.
+        asks (List[Tuple[float, float]]): (price, amount) ask levels, an
+                                          amount of 0 removes the level.
+    """
+
+    sequence: Optional[int] = None
+    snapshot: bool = False
+    bids: List[Tuple[float, float]] = field(default_factory=list)
+    asks: List[Tuple[float, float]] = field(default_factory=list)
+
+
+class LocalOrderBook:
+    """
+    Level-2 order book of a single exchange, kept up to date from a diff feed.
+
+    Attributes:
+        exchange (str): The exchange the book belongs to.
+        sequence (Optional[int]): Last applied feed sequence number.
+        synced (bool): True once a snapshot has been applied.
+        updated_at (float): Unix time of the last update that changed the
+                            book.
+        received_at (float): Unix time the feed was last heard from,
+            heartbeats and empty updates included. A quiet but healthy feed
+            keeps this recent while updated_at ages.
+        depth_limit (DepthLimit): Caps applied when the book is converted,
+                                  like those of a REST snapshot.
+        stream_depth (Optional[int]): Levels per side the feed maintains,
+            if it does not remove levels pushed out of that depth (Kraken).
+            Levels past it are dropped after every update.
+    """
+
+    __slots__ = (
+        "exchange",
+        "depth_limit",
+        "stream_depth",
+        "sequence",
+        "synced",
+        "updated_at",
+        "received_at",
+        "_bids",
+        "_asks",
+        "_bid_prices",
+        "_ask_prices",
+    )
+
+    def __init__(
+        self,
+        exchange: str,
+        depth_limit: Optional[DepthLimit] = None,
+        stream_depth: Optional[int] = None,
+    ) -> None:
+        self.exchange = exchange
+        self.depth_limit = depth_limit or DepthLimit()
+        self.stream_depth = stream_depth
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all levels, the book needs a new snapshot to be usable."""
+        self.sequence: Optional[int] = None
+        self.synced = False
+        self.updated_at = 0.0
+        self.received_at = 0.0
+        self._bids: Dict[float, Tuple[float, int]] = {}
+        self._asks: Dict[float, Tuple[float, int]] = {}
+        # Both price lists are kept in ascending order
+        self._bid_prices: List[float] = []
+        self._ask_prices: List[float] = []
+
+    def apply(self, update: BookUpdate) -> bool:
+        """
+        Apply a level-2 update to the book.
+
+        Args:
+            update (BookUpdate): The update to apply.
+
+        Returns:
+            bool: True if the update changed the book.
+
+        Raises:
+            SequenceGapError: If the update does not follow the last applied
+                              sequence number.
+        """
+        if update.snapshot:
+            self.reset()
+        elif not self.synced:
+            # Diffs received before the snapshot cannot be applied
+            return False
+        elif (
+            update.sequence is not None
+            and self.sequence is not None
+            and update.sequence != self.sequence + 1
+        ):
+            raise SequenceGapError(
+                f"{self.exchange}: expected sequence {self.sequence + 1}, "
+                f"got {update.sequence}"
+            )
+
+        if update.sequence is not None:
+            self.sequence = update.sequence
+        self.synced = True
+        if not update.bids and not update.asks and not update.snapshot:
+            return False
+
+        self.updated_at = time.time()
+        timestamp = int(self.updated_at)
+        for price, amount in update.bids:
+            self._set_level(self._bids, self._bid_prices, price, amount,
+                            timestamp)
+        for price, amount in update.asks:
+            self._set_level(self._asks, self._ask_prices, price, amount,
+                            timestamp)
+        if self.stream_depth is not None:
+            self._truncate()
+        return True
+
+    def _truncate(self) -> None:
+        """Drop the levels past stream_depth, the worst prices of each side."""
+        excess = len(self._bid_prices) - self.stream_depth
+        if excess > 0:
+            for price in self._bid_prices[:excess]:
+                del self._bids[price]
+            del self._bid_prices[:excess]
+        excess = len(self._ask_prices) - self.stream_depth
+        if excess > 0:
+            for price in self._ask_prices[-excess:]:
+                del self._asks[price]
+            del self._ask_prices[-excess:]
+
+    @staticmethod
+    def _set_level(
+        levels: Dict[float, Tuple[float, int]],
+        prices: List[float],
+        price: float,
+        amount: float,
+        timestamp: int,
+    ) -> None:
+        if amount > 0.0:
+            if price not in levels:
+                insort(prices, price)
+            levels[price] = (amount, timestamp)
+        elif levels.pop(price, None) is not None:
+            del prices[bisect_left(prices, price)]
+
+    def to_order_data(self) -> Tuple[List[OrderData], List[OrderData]]:
+        """
+        Return the book in the standardized format.
+
+        Returns:
+            Tuple[List[OrderData], List[OrderData]]: Bids sorted by price
+            descending and asks sorted by price ascending.
+        """
+        bids = [
+            OrderData(price, *self._bids[price], self.exchange)
+            for price in self._capped_prices(self._bids,
+                                             self._bid_prices[::-1])
+        ]
+        asks = [
+            OrderData(price, *self._asks[price], self.exchange)
+            for price in self._capped_prices(self._asks, self._ask_prices)
+        ]
+        return bids, asks
+
+    def to_columnar(self) -> ColumnarOrderBook:
+        """Return the book as a ColumnarOrderBook, sorted like to_order_data."""
+        return ColumnarOrderBook(
+            self._to_columnar_side(
+                self._bids,
+                self._capped_prices(self._bids, self._bid_prices[::-1]),
+            ),
+            self._to_columnar_side(
+                self._asks, self._capped_prices(self._asks, self._ask_prices)
+            ),
+        )
+
+    def _capped_prices(
+        self, levels: Dict[float, Tuple[float, int]], prices: List[float]
+    ) -> List[float]:
+        """
+        'prices', best first, cut to depth_limit: at most max_levels, up to
+        and including the level crossing max_notional.
+        """
+        max_levels = self.depth_limit.max_levels
+        max_notional = self.depth_limit.max_notional
+        if max_levels is not None:
+            prices = prices[:max_levels]
+        if max_notional is None:
+            return prices
+        notional = 0.0
+        for count, price in enumerate(prices, 1):
+            notional += price * levels[price][0]
+            if notional >= max_notional:
+                return prices[:count]
+        return prices
+
+    def _to_columnar_side(
+        self, levels: Dict[float, Tuple[float, int]], prices: List[float]
+    ) -> ColumnarOrderSide:
+        count = len(prices)
+        return ColumnarOrderSide(
+            np.array(prices, dtype=np.float64),
+            np.fromiter((levels[price][0] for price in prices), np.float64,
+                        count),
+            np.fromiter((levels[price][1] for price in prices), np.int64,
+                        count),
+            np.full(count, EXCHANGE_CODES[self.exchange], dtype=np.uint8),
+        )
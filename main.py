@@ -1,6 +1,6 @@
 import time
 
-from typing import List
+from typing import List, Optional
 import asyncio
 import argparse
 from asyncio import TimeoutError
@@ -13,52 +13,81 @@ from order_books import (
 )
 from utils import PriceCalculator, OrderBookMerger
 from data_types import BTCUSDExchangePairs, Operation, ETHUSDExchangePairs
+from http_client import ExchangeHTTPSession
 from log import LOGGER as log
+from config import ORDER_BOOK_DEPTH_LIMITS, EXCHANGE_FETCH_DEADLINE
 
 
-def get_exchange_pair_order_book(pair: str) -> List[ExchangeOrderBook]:
+def get_exchange_pair_order_book(
+    pair: str, http_session: Optional[ExchangeHTTPSession] = None
+) -> List[ExchangeOrderBook]:
     exchange_pairs = {
         "BTCUSD": [
-            CoinbaseOrderBook(BTCUSDExchangePairs.COINBASE),
-            KrakenOrderBook(BTCUSDExchangePairs.KRAKEN),
-            GeminiOrderBook(BTCUSDExchangePairs.GEMINI),
+            (CoinbaseOrderBook, BTCUSDExchangePairs.COINBASE),
+            (KrakenOrderBook, BTCUSDExchangePairs.KRAKEN),
+            (GeminiOrderBook, BTCUSDExchangePairs.GEMINI),
         ],
         "ETHUSD": [
-            CoinbaseOrderBook(ETHUSDExchangePairs.COINBASE),
-            KrakenOrderBook(ETHUSDExchangePairs.KRAKEN),
-            GeminiOrderBook(ETHUSDExchangePairs.GEMINI),
+            (CoinbaseOrderBook, ETHUSDExchangePairs.COINBASE),
+            (KrakenOrderBook, ETHUSDExchangePairs.KRAKEN),
+            (GeminiOrderBook, ETHUSDExchangePairs.GEMINI),
         ],
     }
 
     if pair in exchange_pairs:
-        return exchange_pairs[pair]
+        depth_limits = ORDER_BOOK_DEPTH_LIMITS.get(pair, {})
+        return [
+            order_book_class(
+                exchange_pair,
+                http_session,
+                depth_limits.get(order_book_class.exchange_name),
+            )
+            for order_book_class, exchange_pair in exchange_pairs[pair]
+        ]
     raise ValueError("Invalid pair")
 
 
-async def fetch_all_order_books(pair: str):
+async def fetch_all_order_books(
+    pair: str, http_session: Optional[ExchangeHTTPSession] = None
+):
     """
     Fetch standardized order books for a currency pair
     from multiple exchanges asynchronously.
 
+    Exchanges that fail or miss EXCHANGE_FETCH_DEADLINE are logged and left
+    out, the others are still returned.
+
+    Args:
+        pair (str): The currency pair, e.g. BTCUSD.
+        http_session (Optional[ExchangeHTTPSession]): Shared pooled session
+            to fetch with.
+
     Returns:
-        Union[Tuple[List[OrderData], List[OrderData]], None]: A tuple
-        containing standardized bids and asks from multiple exchanges,
-        or None if an error occurs.
+        Union[List[Tuple[List[OrderData], List[OrderData]]], None]: The
+        standardized bids and asks of every exchange that answered,
+        or None if none did.
     """
-    exchange_order_books = get_exchange_pair_order_book(pair)
+    exchange_order_books = get_exchange_pair_order_book(pair, http_session)
     tasks = [
-        exchange_order_book.get_standardized_order_book()
+        asyncio.wait_for(
+            exchange_order_book.get_standardized_order_book(),
+            EXCHANGE_FETCH_DEADLINE,
+        )
         for exchange_order_book in exchange_order_books
     ]
-    try:
-        return await asyncio.gather(*tasks)
-    except ClientError as ce:
-        log.exception(f"Aiohttp Client Error occurred: {ce}")
-    except TimeoutError as te:
-        log.exception(f"Asyncio Request timed out: {te}")
-    except Exception as e:
-        log.exception(f"An unexpected error occurred: {e}")
-    return None
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    order_books = []
+    for exchange_order_book, result in zip(exchange_order_books, results):
+        exchange = exchange_order_book.exchange_name
+        if isinstance(result, ClientError):
+            log.error(f"Aiohttp Client Error occurred on {exchange}: {result}")
+        elif isinstance(result, TimeoutError):
+            log.error(f"Asyncio Request to {exchange} timed out")
+        elif isinstance(result, Exception):
+            log.error(f"An unexpected error occurred on {exchange}: {result!r}")
+        else:
+            order_books.append(result)
+    return order_books or None
 
 
 def main():
@@ -70,14 +99,17 @@ def main():
     try:
         order_books = asyncio.run(fetch_all_order_books("BTCUSD"))
         if order_books is not None:
-            merged_order_book = OrderBookMerger.merge_order_books(order_books)
-
+            # One-shot quotes only need the top of the book, merge lazily
             buy_price = PriceCalculator.calculate_price(
-                merged_order_book, Operation.BUY, quantity
+                OrderBookMerger.iter_merged_order_books(order_books),
+                Operation.BUY,
+                quantity,
             )
 
             sell_price = PriceCalculator.calculate_price(
-                merged_order_book, Operation.SELL, quantity
+                OrderBookMerger.iter_merged_order_books(order_books),
+                Operation.SELL,
+                quantity,
             )
 
             print(f"To BUY {quantity} BTC: ${buy_price * quantity:.4f}")
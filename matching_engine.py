@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+from itertools import count
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from data_types import Operation
+from order_book_snapshot import OrderBookSnapshot
+from order_repository import OrderRepository
+from log import LOGGER as log
+
+# (price key, arrival sequence, order): the sequence keeps time priority
+# among orders at the same price and is never equal, so orders are never
+# compared
+RestingOrder = Tuple[float, int, Dict[str, Any]]
+
+
+class MatchingEngine:
+    """
+    Rests limit orders until the merged book crosses their price, then fills
+    them in Redis.
+
+    Orders are indexed per (pair, side) in a heap keyed by price: BUY orders
+    by highest price, marketable once the best ask is at or below it, SELL
+    orders by lowest price, marketable once the best bid is at or above it.
+    A book update pops only the k orders that became marketable, in
+    O(k log n), and fills them in one Redis call. Orders whose fill fails
+    are put back and retried on the next update.
+
+    Usage:
+        matching_engine = MatchingEngine(order_repository)
+        await matching_engine.restore(pairs)
+        ...
+        await order_repository.rest_orders(orders)
+        for order in orders:
+            matching_engine.add(order)
+        matching_engine.match(app.get_app_order_book(pair))
+        ...
+        matching_engine.match(snapshot)  # on every installed book
+    """
+
+    def __init__(self, order_repository: OrderRepository) -> None:
+        self.order_repository = order_repository
+        self._orders: Dict[Tuple[str, Operation], List[RestingOrder]] = {}
+        self._sequence = count()
+        self._fills: Set[asyncio.Task] = set()
+        self._matched = 0
+        self._filled = 0
+        self._fill_errors = 0
+
+    def add(
+        self,
+        order: Dict[str, Any],
+        snapshot: Optional[OrderBookSnapshot] = None,
+    ) -> None:
+        """
+        Rest 'order', a LimitOrder dict, and match it against 'snapshot',
+        the current book of its pair, if there is one.
+        """
+        operation = Operation(order["operation"])
+        price = float(order["price"])
+        heapq.heappush(
+            self._orders.setdefault((order["currency_pair"], operation), []),
+            (-price if operation == Operation.BUY else price,
+             next(self._sequence), order),
+        )
+        if snapshot is not None:
+            self.match(snapshot)
+
+    def match(self, snapshot: OrderBookSnapshot) -> List[Dict[str, Any]]:
+        """
+        Take the resting orders 'snapshot' makes marketable and fill them.
+
+        Returns:
+            List[Dict[str, Any]]: The orders being filled.
+        """
+        pair = snapshot.pair
+        matched = []
+        bids, asks = snapshot.bid_index.prices, snapshot.ask_index.prices
+        if len(asks):
+            # A BUY at -key or more crosses the best ask
+            matched += self._pop_while(pair, Operation.BUY, -float(asks[0]))
+        if len(bids):
+            matched += self._pop_while(pair, Operation.SELL, float(bids[0]))
+        if matched:
+            self._matched += len(matched)
+            task = asyncio.create_task(self._fill(pair, matched))
+            self._fills.add(task)
+            task.add_done_callback(self._fills.discard)
+        return [order for _, _, order in matched]
+
+    def _pop_while(
+        self, pair: str, operation: Operation, max_key: float
+    ) -> List[RestingOrder]:
+        orders = self._orders.get((pair, operation))
+        popped = []
+        while orders and orders[0][0] <= max_key:
+            popped.append(heapq.heappop(orders))
+        return popped
+
+    async def _fill(self, pair: str, matched: List[RestingOrder]) -> None:
+        order_ids = [order["order_id"] for _, _, order in matched]
+        try:
+            self._filled += await self.order_repository.fill_orders(
+                pair, order_ids
+            )
+        except Exception as e:
+            self._fill_errors += 1
+            log.error(f"Filling {len(order_ids)} {pair} orders failed, "
+                      f"retrying on the next update: {e!r}")
+            for resting_order in matched:
+                order = resting_order[2]
+                heapq.heappush(
+                    self._orders[(pair, Operation(order["operation"]))],
+                    resting_order,
+                )
+
+    async def restore(self, pairs: List[str]) -> None:
+        """Rest the orders of 'pairs' left PENDING in Redis, e.g. by a restart."""
+        for pair in pairs:
+            try:
+                orders = await self.order_repository.get_resting_orders(pair)
+            except Exception as e:
+                log.error(f"Loading the resting {pair} orders failed: {e!r}")
+                continue
+            for order in orders:
+                self.add(order)
+            if orders:
+                log.info(f"Restored {len(orders)} resting {pair} orders")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "resting": {
+                f"{pair}:{operation.value}": len(orders)
+                for (pair, operation), orders in self._orders.items()
+            },
+            "matched": self._matched,
+            "filled": self._filled,
+            "fill_errors": self._fill_errors,
+        }
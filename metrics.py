@@ -0,0 +1,124 @@
+"""
+    Module: metrics
+    Description: Prometheus metrics of the order book hot paths, served by
+    the app on METRICS_ENDPOINT and by the Celery worker on
+    CELERY_METRICS_PORT.
+
+    Websocket connections resolve their labelled children once, so timing
+    a message is a single observe(). Book depth and age are read off the
+    served snapshots, and Redis pool usage off the order repository, when
+    scraped rather than tracked on every change.
+"""
+from typing import Iterable
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Seconds, from a cached quote (~50 us) to a slow exchange fetch
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0,
+)
+# Bytes, a capped book is ~10 KB to ~1 MB uncompressed
+PAYLOAD_BUCKETS = tuple(1024 * 4 ** power for power in range(8))
+
+EXCHANGE_FETCH_SECONDS = Histogram(
+    "exchange_fetch_seconds",
+    "Time to fetch an order book snapshot from an exchange",
+    ["exchange"],
+    buckets=LATENCY_BUCKETS,
+)
+EXCHANGE_FETCH_ERRORS = Counter(
+    "exchange_fetch_errors",
+    "Order book fetches that failed",
+    ["exchange"],
+)
+EXCHANGE_PAYLOAD_BYTES = Histogram(
+    "exchange_payload_bytes",
+    "Size of an exchange order book response body",
+    ["exchange"],
+    buckets=PAYLOAD_BUCKETS,
+)
+ORDER_BOOK_PARSE_SECONDS = Histogram(
+    "order_book_parse_seconds",
+    "Time to decode and standardize an exchange order book",
+    ["exchange"],
+    buckets=LATENCY_BUCKETS,
+)
+ORDER_BOOK_MERGE_SECONDS = Histogram(
+    "order_book_merge_seconds",
+    "Time to merge the exchange books of a pair",
+    ["pair"],
+    buckets=LATENCY_BUCKETS,
+)
+ORDER_BOOK_LEVELS = Gauge(
+    "order_book_levels",
+    "Levels of the served merged book",
+    ["pair", "side"],
+)
+ORDER_BOOK_AGE_SECONDS = Gauge(
+    "order_book_age_seconds",
+    "Seconds since the served merged book was built",
+    ["pair"],
+)
+WEBSOCKET_MESSAGE_SECONDS = Histogram(
+    "websocket_message_seconds",
+    "Time from receiving a websocket request to sending its response",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections",
+    "Open websocket connections",
+    ["endpoint"],
+)
+REDIS_PIPELINE_COMMANDS = Histogram(
+    "redis_pipeline_commands",
+    "Commands sent in one auto-pipelined Redis round trip",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+REDIS_PIPELINE_SECONDS = Histogram(
+    "redis_pipeline_seconds",
+    "Time of an auto-pipelined Redis round trip, including the wait for a "
+    "pooled connection",
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_PIPELINE_ERRORS = Counter(
+    "redis_pipeline_errors",
+    "Auto-pipelined Redis round trips that failed",
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Connections of the order repository's Redis pool",
+    ["state"],
+)
+CELERY_TASK_SECONDS = Histogram(
+    "celery_task_seconds",
+    "Celery task run time",
+    ["task", "state"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def update_order_book_metrics(snapshots: Iterable) -> None:
+    """
+    Set the book depth and age gauges from 'snapshots', the served
+    OrderBookSnapshots. Pairs without a served book are left out.
+    """
+    ORDER_BOOK_LEVELS.clear()
+    ORDER_BOOK_AGE_SECONDS.clear()
+    for snapshot in snapshots:
+        ORDER_BOOK_LEVELS.labels(snapshot.pair, "bids").set(
+            len(snapshot.bid_index.prices)
+        )
+        ORDER_BOOK_LEVELS.labels(snapshot.pair, "asks").set(
+            len(snapshot.ask_index.prices)
+        )
+        ORDER_BOOK_AGE_SECONDS.labels(snapshot.pair).set(snapshot.age())
+
+
+def update_order_repository_metrics(order_repository) -> None:
+    """Set the Redis pool gauges from 'order_repository' (OrderRepository)."""
+    stats = order_repository.get_stats()
+    REDIS_POOL_CONNECTIONS.labels("max").set(stats["max_connections"])
+    REDIS_POOL_CONNECTIONS.labels("open").set(stats["open_connections"])
+    REDIS_POOL_CONNECTIONS.labels("in_use").set(stats["connections_in_use"])
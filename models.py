@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter
 from data_types import Operation
 
 
@@ -13,6 +13,10 @@ class LimitOrder(BaseModel):
     currency_pair: str
 
 
+# Validates a whole batch of orders in one pass
+LimitOrderListAdapter = TypeAdapter(List[LimitOrder])
+
+
 class GetLimitOrdersRequest(BaseModel):
     currency_pair: str = Field(alias="currencyPair")
     quantity: float
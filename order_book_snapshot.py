@@ -0,0 +1,82 @@
+import time
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+
+from utils import IndexedOrderBook
+
+
+class OrderBookSnapshot(IndexedOrderBook):
+    """
+    Immutable, versioned merged order book of one currency pair.
+
+    A new snapshot is built for every merge and swapped in whole, so a
+    reader holding one always sees a consistent book. Versions increase
+    monotonically per pair, downstream caches can key on (pair, version).
+    Unpacks like a plain (bids, asks) tuple and carries the DepthIndex of
+    IndexedOrderBook.
+
+    Attributes:
+        pair (str): The currency pair, e.g. BTCUSD.
+        version (int): Build number of this pair's book, starting at 1.
+        build_started_at (float): Epoch time the merge started.
+        built_at (float): Epoch time the snapshot was built.
+        source_times (Mapping[str, float]): Epoch time each contributing
+                                            exchange's book was received.
+    """
+
+    def __new__(
+        cls,
+        bids,
+        asks,
+        pair: str,
+        version: int,
+        source_times: Mapping[str, float],
+        build_started_at: Optional[float] = None,
+        built_at: Optional[float] = None,
+    ) -> "OrderBookSnapshot":
+        snapshot = super().__new__(cls, bids, asks)
+        if built_at is None:
+            built_at = time.time()
+        object.__setattr__(snapshot, "pair", pair)
+        object.__setattr__(snapshot, "version", version)
+        object.__setattr__(
+            snapshot,
+            "build_started_at",
+            built_at if build_started_at is None else build_started_at,
+        )
+        object.__setattr__(snapshot, "source_times",
+                           MappingProxyType(dict(source_times)))
+        # Set last, the snapshot is read-only from here on
+        object.__setattr__(snapshot, "built_at", built_at)
+        return snapshot
+
+    def __setattr__(self, name, value):
+        if "built_at" in self.__dict__:
+            raise AttributeError("OrderBookSnapshot is immutable")
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("OrderBookSnapshot is immutable")
+
+    @property
+    def build_duration(self) -> float:
+        return self.built_at - self.build_started_at
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Seconds since the snapshot was built."""
+        return (time.time() if now is None else now) - self.built_at
+
+    def source_ages(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Seconds since each contributing exchange's book was received."""
+        now = time.time() if now is None else now
+        return {
+            exchange: now - received_at
+            for exchange, received_at in self.source_times.items()
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"OrderBookSnapshot(pair={self.pair!r}, version={self.version}, "
+            f"bids={len(self[0])}, asks={len(self[1])}, "
+            f"exchanges={list(self.source_times)})"
+        )
@@ -1,7 +1,31 @@
+import asyncio
+import time
+import orjson as json
 from abc import ABC, abstractmethod
-from typing import Tuple, List, Dict, Any
-from aiohttp import ClientSession
-from data_types import OrderData, ExchangePairs
+from typing import Tuple, List, Dict, Any, Callable, Optional, Union
+from aiohttp import ClientSession, ClientError, WSMsgType
+from data_types import OrderData, ExchangePairs, DepthLimit
+from local_order_book import BookUpdate, LocalOrderBook, SequenceGapError
+from columnar_order_book import ColumnarOrderBook
+from http_client import ExchangeHTTPSession
+from metrics import (
+    EXCHANGE_FETCH_SECONDS,
+    EXCHANGE_FETCH_ERRORS,
+    EXCHANGE_PAYLOAD_BYTES,
+    ORDER_BOOK_PARSE_SECONDS,
+)
+from config import (
+    COINBASE_REST_URL,
+    COINBASE_WS_URL,
+    KRAKEN_REST_URL,
+    KRAKEN_WS_URL,
+    GEMINI_REST_URL,
+    GEMINI_WS_URL,
+    STREAM_RECONNECT_DELAY,
+    STREAM_RECEIVE_TIMEOUT,
+    ORDER_BOOK_BACKEND,
+)
+from log import LOGGER as log
 
 
 class ExchangeOrderBook(ABC):
@@ -10,16 +34,31 @@ class ExchangeOrderBook(ABC):
 
     Attributes:
         pair (BTCUSDExchangePairs): The cryptocurrency pair for the order book.
+        http_session (Optional[ExchangeHTTPSession]): Shared pooled session,
+            a one-off session is opened per request if None.
+        depth_limit (DepthLimit): Caps on the levels kept per side.
         _url (str): The exchange-specific API endpoint URL.
+        exchange_name (str): Name tagged on every standardized order.
     """
 
     __slots__ = (
         "pair",
+        "http_session",
+        "depth_limit",
         "_url",
     )
 
-    def __init__(self, pair: ExchangePairs) -> None:
+    exchange_name = ""
+
+    def __init__(
+        self,
+        pair: ExchangePairs,
+        http_session: Optional[ExchangeHTTPSession] = None,
+        depth_limit: Optional[DepthLimit] = None,
+    ) -> None:
         self.pair = pair
+        self.http_session = http_session
+        self.depth_limit = depth_limit or DepthLimit()
         self._url = self._get_exchange_url()
 
     @abstractmethod
@@ -27,37 +66,170 @@ class ExchangeOrderBook(ABC):
         """Return the exchange-specific API endpoint URL."""
         raise NotImplementedError
 
+    async def get_standardized_order_book(
+        self,
+    ) -> Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
+        """Fetch and standardize order book data from the exchange API."""
+        raw = await self.get_raw_order_book_from_exchange(self._url)
+        started_at = time.perf_counter()
+        order_book = self.parse_order_book(raw)
+        ORDER_BOOK_PARSE_SECONDS.labels(self.exchange_name).observe(
+            time.perf_counter() - started_at
+        )
+        return order_book
+
     @abstractmethod
-    async def fetch_order_book(self):
-        """Fetch raw order book data from the exchange API."""
+    def parse_order_book(self, raw: bytes):
+        """Decode a raw order book response into the standardized format."""
         raise NotImplementedError
 
-    @abstractmethod
-    async def get_standardized_order_book(self):
-        """Fetch and standardize order book data from the exchange API."""
+    def _get_stream_url(self) -> str:
+        """Return the exchange-specific level-2 websocket URL."""
         raise NotImplementedError
 
-    @staticmethod
-    async def get_order_book_from_exchange(url: str) -> Dict[str, Any]:
+    def _get_subscribe_message(self) -> Optional[Dict[str, Any]]:
+        """Return the message subscribing to the level-2 channel, if any."""
+        return None
+
+    def _get_stream_max_levels(self) -> Optional[int]:
+        """
+        Levels per side to keep from the feed, if it does not remove the
+        levels pushed out of its subscribed depth.
+        """
+        return None
+
+    def _parse_stream_message(self, message: Any) -> Optional[BookUpdate]:
+        """
+        Convert a decoded websocket message into a BookUpdate.
+
+        Returns:
+            Optional[BookUpdate]: The update, or None for messages that do
+                                  not touch the book.
         """
-        Make a generic request to an exchange API and return order book data.
+        raise NotImplementedError
+
+    async def stream_order_book(
+        self, on_update: Callable[[LocalOrderBook], None]
+    ) -> None:
+        """
+        Maintain a local order book from the exchange's level-2 feed.
+
+        The feed's initial snapshot seeds the book and every following diff
+        is applied to it. A sequence gap, a disconnect, a silent feed or any
+        other error drops the book and resubscribes, which yields a fresh
+        snapshot.
+
+        Every message received, heartbeats included, refreshes the book's
+        received_at, so a quiet feed is not mistaken for a stale one.
+
+        Args:
+            on_update (Callable[[LocalOrderBook], None]): Called after every
+                update that changed the book.
+        """
+        local_book = LocalOrderBook(
+            self.exchange_name, self.depth_limit, self._get_stream_max_levels()
+        )
+        url = self._get_stream_url()
+        while True:
+            try:
+                async with ClientSession() as session:
+                    async with session.ws_connect(
+                        url, receive_timeout=STREAM_RECEIVE_TIMEOUT
+                    ) as ws:
+                        subscribe_message = self._get_subscribe_message()
+                        if subscribe_message is not None:
+                            await ws.send_json(subscribe_message)
+                        async for message in ws:
+                            if message.type != WSMsgType.TEXT:
+                                break
+                            update = self._parse_stream_message(
+                                message.json(loads=json.loads)
+                            )
+                            changed = update is not None and \
+                                local_book.apply(update)
+                            # After apply, a snapshot resets the book
+                            local_book.received_at = time.time()
+                            if changed:
+                                on_update(local_book)
+            except SequenceGapError as sge:
+                log.warning(f"Resyncing order book: {sge}")
+            except (ClientError, asyncio.TimeoutError) as e:
+                log.error(f"{self.exchange_name} stream error: {e!r}")
+            except Exception as e:
+                # A malformed or unexpected message, the book can no longer
+                # be trusted
+                log.exception(f"{self.exchange_name} stream failed: {e!r}")
+            local_book.reset()
+            on_update(local_book)
+            await asyncio.sleep(STREAM_RECONNECT_DELAY)
+
+    async def get_raw_order_book_from_exchange(self, url: str) -> bytes:
+        """
+        Make a generic request to an exchange API and return the raw body.
 
         Args:
             url (str): The API endpoint URL.
 
         Returns:
-            Dict[str, Any]: The raw order book data.
+            bytes: The undecoded order book response.
+        """
+        started_at = time.perf_counter()
+        try:
+            if self.http_session is not None:
+                raw = await self.http_session.get_bytes(url)
+            else:
+                headers = {"Accept-Encoding": "gzip"}
+                async with ClientSession() as session:
+                    async with session.get(url, headers=headers) as response:
+                        response.raise_for_status()
+                        raw = await response.read()
+        except Exception:
+            EXCHANGE_FETCH_ERRORS.labels(self.exchange_name).inc()
+            raise
+        EXCHANGE_FETCH_SECONDS.labels(self.exchange_name).observe(
+            time.perf_counter() - started_at
+        )
+        EXCHANGE_PAYLOAD_BYTES.labels(self.exchange_name).observe(len(raw))
+        return raw
+
+    def _build_order_book(
+        self,
+        bids: List[Any],
+        asks: List[Any],
+        parse_levels: Callable[[List[Any], str], List[OrderData]],
+    ) -> Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
+        """
+        Standardize decoded levels with an exchange-specific parser.
+
+        Levels past depth_limit.max_levels are dropped before parsing, the
+        notional cap is applied to the parsed levels.
         """
-        headers = {"Accept-Encoding": "gzip"}
-        async with ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                return await response.json()
+        max_levels = self.depth_limit.max_levels
+        max_notional = self.depth_limit.max_notional
+        if max_levels is not None:
+            bids, asks = bids[:max_levels], asks[:max_levels]
+        if ORDER_BOOK_BACKEND == "columnar":
+            order_book = ColumnarOrderBook.from_raw(bids, asks,
+                                                    self.exchange_name)
+            if max_notional is None:
+                return order_book
+            return ColumnarOrderBook(
+                order_book.bids.cap_notional(max_notional),
+                order_book.asks.cap_notional(max_notional),
+            )
+        standardized_bids = parse_levels(bids, self.exchange_name)
+        standardized_asks = parse_levels(asks, self.exchange_name)
+        if max_notional is None:
+            return standardized_bids, standardized_asks
+        return (
+            _cap_notional(standardized_bids, max_notional),
+            _cap_notional(standardized_asks, max_notional),
+        )
 
     @staticmethod
     def _standardize_order_book(
         bids: List[Any], asks: List[Any], exchange: str
-    ) -> Tuple[List[OrderData], List[OrderData]]:
+    ) -> Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
         """
         Standardize raw order book data.
 
@@ -66,9 +238,12 @@ class ExchangeOrderBook(ABC):
             asks (List[Any]): Raw ask data from the exchange.
 
         Returns:
-            Tuple[List[OrderData], List[OrderData]]: Standardized bid and ask
-                                                     data.
+            Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
+                Standardized bid and ask data, columnar if ORDER_BOOK_BACKEND
+                is "columnar".
         """
+        if ORDER_BOOK_BACKEND == "columnar":
+            return ColumnarOrderBook.from_raw(bids, asks, exchange)
         standardized_bids = [
             OrderData.from_order(order, exchange) for order in bids
         ]  # noqa
@@ -78,39 +253,131 @@ class ExchangeOrderBook(ABC):
         return standardized_bids, standardized_asks
 
 
+def _cap_notional(
+    orders: List[OrderData], max_notional: float
+) -> List[OrderData]:
+    """Keep orders up to and including the one crossing 'max_notional'."""
+    notional = 0.0
+    for count, order in enumerate(orders, 1):
+        notional += order.price * order.amount
+        if notional >= max_notional:
+            return orders[:count]
+    return orders
+
+
+def _parse_list_levels(levels: List[Any], exchange: str) -> List[OrderData]:
+    """
+    Fast path for [price, amount, timestamp] levels (Coinbase, Kraken).
+
+    Same result as OrderData.from_order, without its per-level type dispatch.
+    """
+    return [
+        OrderData(float(price), float(amount), int(timestamp), exchange)
+        for price, amount, timestamp in levels
+    ]
+
+
+def _parse_dict_levels(levels: List[Any], exchange: str) -> List[OrderData]:
+    """Fast path for {"price", "amount", "timestamp", ...} levels (Gemini)."""
+    return [
+        OrderData(
+            float(level["price"]),
+            float(level["amount"]),
+            int(level["timestamp"]),
+            exchange,
+        )
+        for level in levels
+    ]
+
+
 class CoinbaseOrderBook(ExchangeOrderBook):
-    def _get_exchange_url(self) -> str:
-        return f"https://api.pro.coinbase.com/products/{self.pair}/book?level=2"  # noqa
+    exchange_name = "COINBASE"
 
-    async def fetch_order_book(self) -> Tuple[List, List]:
-        order_book = await self.get_order_book_from_exchange(self._url)
-        return order_book["bids"], order_book["asks"]
+    def _get_exchange_url(self) -> str:
+        return f"{COINBASE_REST_URL}/products/{self.pair}/book?level=2"  # noqa
 
-    async def get_standardized_order_book(
-        self,
+    def parse_order_book(
+        self, raw: bytes
     ) -> Tuple[List[OrderData], List[OrderData]]:
-        bids, asks = await self.fetch_order_book()
-        return self._standardize_order_book(bids, asks, exchange="COINBASE")
+        order_book = json.loads(raw)
+        return self._build_order_book(
+            order_book["bids"], order_book["asks"], _parse_list_levels
+        )
+
+    def _get_stream_url(self) -> str:
+        return COINBASE_WS_URL
+
+    def _get_subscribe_message(self) -> Dict[str, Any]:
+        return {
+            "type": "subscribe",
+            "product_ids": [str(self.pair)],
+            # Heartbeats keep a quiet product's feed visibly alive
+            "channels": ["level2_batch", "heartbeat"],
+        }
+
+    def _parse_stream_message(self, message: Any) -> Optional[BookUpdate]:
+        # The level2 channel carries no sequence numbers
+        message_type = message.get("type")
+        if message_type == "snapshot":
+            return BookUpdate(
+                snapshot=True,
+                bids=[(float(p), float(a)) for p, a, *_ in message["bids"]],
+                asks=[(float(p), float(a)) for p, a, *_ in message["asks"]],
+            )
+        if message_type == "l2update":
+            update = BookUpdate()
+            for side, price, amount in message["changes"]:
+                levels = update.bids if side == "buy" else update.asks
+                levels.append((float(price), float(amount)))
+            return update
+        return None
 
 
 class GeminiOrderBook(ExchangeOrderBook):
-    def _get_exchange_url(self) -> str:
-        return f"https://api.gemini.com/v1/book/{self.pair}"
+    exchange_name = "GEMINI"
 
-    async def fetch_order_book(self) -> Tuple[List, List]:
-        order_book = await self.get_order_book_from_exchange(self._url)
-        return order_book["bids"], order_book["asks"]
+    def _get_exchange_url(self) -> str:
+        url = f"{GEMINI_REST_URL}/v1/book/{self.pair}"
+        max_levels = self.depth_limit.max_levels
+        if max_levels is not None:
+            url += f"?limit_bids={max_levels}&limit_asks={max_levels}"
+        return url
 
-    async def get_standardized_order_book(
-        self,
+    def parse_order_book(
+        self, raw: bytes
     ) -> Tuple[List[OrderData], List[OrderData]]:
-        bids, asks = await self.fetch_order_book()
-        return self._standardize_order_book(bids, asks, exchange="GEMINI")
+        order_book = json.loads(raw)
+        return self._build_order_book(
+            order_book["bids"], order_book["asks"], _parse_dict_levels
+        )
+
+    def _get_stream_url(self) -> str:
+        return (
+            f"{GEMINI_WS_URL}/v1/marketdata/{self.pair}"
+            "?heartbeat=true&trades=false&auctions=false"
+        )
+
+    def _parse_stream_message(self, message: Any) -> Optional[BookUpdate]:
+        # Every message, heartbeats included, carries a socket_sequence
+        update = BookUpdate(sequence=message.get("socket_sequence"))
+        for event in message.get("events", ()):
+            if event.get("type") != "change":
+                continue
+            if event.get("reason") == "initial":
+                update.snapshot = True
+            levels = update.bids if event["side"] == "bid" else update.asks
+            levels.append((float(event["price"]), float(event["remaining"])))
+        return update
 
 
 class KrakenOrderBook(ExchangeOrderBook):
+    exchange_name = "KRAKEN"
+
     def _get_exchange_url(self) -> str:
-        return f"https://api.kraken.com/0/public/Depth?pair={self.pair}"
+        url = f"{KRAKEN_REST_URL}/0/public/Depth?pair={self.pair}"
+        if self.depth_limit.max_levels is not None:
+            url += f"&count={self.depth_limit.max_levels}"
+        return url
 
     def _get_result_key(self) -> str:
         if self.pair == "XBTUSD":
@@ -119,14 +386,58 @@ class KrakenOrderBook(ExchangeOrderBook):
             return "XETHZUSD"
         return ""
 
-    async def fetch_order_book(self) -> Tuple[List, List]:
-        order_book = await self.get_order_book_from_exchange(self._url)
-        result_key = self._get_result_key()
-        order_book_result = order_book["result"].get(result_key)
-        return order_book_result["bids"], order_book_result["asks"]
-
-    async def get_standardized_order_book(
-        self,
+    def parse_order_book(
+        self, raw: bytes
     ) -> Tuple[List[OrderData], List[OrderData]]:
-        bids, asks = await self.fetch_order_book()
-        return self._standardize_order_book(bids, asks, exchange="KRAKEN")
+        order_book = json.loads(raw)
+        order_book_result = order_book["result"].get(self._get_result_key())
+        return self._build_order_book(
+            order_book_result["bids"],
+            order_book_result["asks"],
+            _parse_list_levels,
+        )
+
+    def _get_stream_url(self) -> str:
+        return KRAKEN_WS_URL
+
+    def _get_subscribe_message(self) -> Dict[str, Any]:
+        return {
+            "event": "subscribe",
+            "pair": [f"{self.pair[:3]}/{self.pair[3:]}"],
+            "subscription": {
+                "name": "book",
+                "depth": self._get_stream_depth(),
+            },
+        }
+
+    def _get_stream_max_levels(self) -> int:
+        # Levels moving out of the subscribed depth are not deleted by the
+        # feed, the book has to be truncated to it
+        return self._get_stream_depth()
+
+    def _get_stream_depth(self) -> int:
+        # Smallest depth the book channel supports that covers max_levels
+        max_levels = self.depth_limit.max_levels or 1000
+        for depth in (10, 25, 100, 500):
+            if max_levels <= depth:
+                return depth
+        return 1000
+
+    def _parse_stream_message(self, message: Any) -> Optional[BookUpdate]:
+        # Book messages are [channel_id, {...}, ({...},) channel_name, pair],
+        # events (heartbeats, status) are dicts. No sequence numbers.
+        if not isinstance(message, list):
+            return None
+        update = BookUpdate()
+        for payload in message[1:-2]:
+            if "as" in payload or "bs" in payload:
+                update.snapshot = True
+            for key in ("as", "a"):
+                update.asks.extend(
+                    (float(p), float(a)) for p, a, *_ in payload.get(key, ())
+                )
+            for key in ("bs", "b"):
+                update.bids.extend(
+                    (float(p), float(a)) for p, a, *_ in payload.get(key, ())
+                )
+        return update
@@ -0,0 +1,338 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson as json
+from redis import asyncio as aioredis
+
+from data_types import OrderStatus
+from metrics import (
+    REDIS_PIPELINE_COMMANDS,
+    REDIS_PIPELINE_SECONDS,
+    REDIS_PIPELINE_ERRORS,
+)
+from log import LOGGER as log
+from config import (
+    REDIS_URL_LOCALHOST,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_MAX_PIPELINE,
+    ORDER_KEY,
+    TASK_ID_KEY,
+    EXECUTED_ORDERS_KEY,
+    ORDER_STATUS_KEY,
+    ORDER_STATUS_CHANNEL,
+    RESTING_ORDERS_KEY,
+    EXECUTED_ORDERS_MAX_LEN,
+)
+
+# Stores a new order and its PENDING status, adds it to the resting orders
+# of its pair and publishes the transition, atomically.
+# KEYS: order, status, resting orders. ARGV: order, PENDING, channel,
+# status message, order id.
+REST_ORDER_SCRIPT = """
+redis.call("SET", KEYS[1], ARGV[1])
+redis.call("SET", KEYS[2], ARGV[2])
+redis.call("SADD", KEYS[3], ARGV[5])
+redis.call("PUBLISH", ARGV[3], ARGV[4])
+return 1
+"""
+
+# Fills the given orders that are still PENDING: sets their status, records
+# them as executed and publishes the transitions. Every given order leaves
+# the resting orders. Returns the number filled.
+# KEYS: executed orders, resting orders, then order and status of each
+# order. ARGV: new status, PENDING, channel, timestamp, executed orders max
+# length, then the order ids.
+FILL_ORDERS_SCRIPT = """
+local filled = 0
+for i = 6, #ARGV do
+    local order = redis.call("GET", KEYS[2 * i - 9])
+    local status_key = KEYS[2 * i - 8]
+    if order and redis.call("GET", status_key) == ARGV[2] then
+        redis.call("SET", status_key, ARGV[1])
+        redis.call("XADD", KEYS[1], "MAXLEN", "~", ARGV[5], "*",
+                   "order", order)
+        redis.call("PUBLISH", ARGV[3], cjson.encode({
+            orderId = ARGV[i],
+            status = ARGV[1],
+            timestamp = tonumber(ARGV[4]),
+        }))
+        filled = filled + 1
+    end
+    redis.call("SREM", KEYS[2], ARGV[i])
+end
+return filled
+"""
+
+
+class PipelineStats:
+    """
+    Counters of the auto-pipeline.
+
+    Attributes:
+        commands (int): Commands sent.
+        pipelines (int): Round trips the commands were sent in.
+        errors (int): Round trips that failed.
+    """
+
+    __slots__ = ("commands", "pipelines", "errors")
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.pipelines = 0
+        self.errors = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "commands": self.commands,
+            "pipelines": self.pipelines,
+            "errors": self.errors,
+            "mean_pipeline_size": round(self.commands / self.pipelines, 2)
+            if self.pipelines else 0.0,
+        }
+
+
+class OrderRepository:
+    """
+    Async access to the order data in Redis, shared by all websocket
+    handlers of a process.
+
+    Commands go through a bounded, blocking connection pool: past
+    REDIS_MAX_CONNECTIONS callers wait up to REDIS_POOL_TIMEOUT for a free
+    connection instead of opening more. Reads issued in the same event loop
+    iteration, e.g. by concurrent handlers, are sent together in one
+    pipeline of up to REDIS_MAX_PIPELINE commands.
+
+    Usage:
+        order_repository = OrderRepository()
+        status = await order_repository.get_order_status(order_id)
+        ...
+        await order_repository.close()
+    """
+
+    def __init__(
+        self,
+        redis_url: str = REDIS_URL_LOCALHOST,
+        max_connections: int = REDIS_MAX_CONNECTIONS,
+    ) -> None:
+        self.pool = aioredis.BlockingConnectionPool.from_url(
+            redis_url, max_connections=max_connections,
+            timeout=REDIS_POOL_TIMEOUT,
+        )
+        self.redis = aioredis.Redis(connection_pool=self.pool)
+        self.stats = PipelineStats()
+        self._pending: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._flush_scheduled = False
+        self._rest_order_script = self.redis.register_script(REST_ORDER_SCRIPT)
+        self._fill_orders_script = self.redis.register_script(
+            FILL_ORDERS_SCRIPT
+        )
+
+    async def execute(self, command: str, *args) -> Any:
+        """Queue 'command' for the next auto-pipeline and return its reply."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((command, args, future))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # Runs once every handler ready in this iteration has queued
+            asyncio.get_running_loop().call_soon(self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        while self._pending:
+            batch = self._pending[:REDIS_MAX_PIPELINE]
+            del self._pending[:REDIS_MAX_PIPELINE]
+            asyncio.create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[str, tuple, asyncio.Future]]) -> None:
+        self.stats.commands += len(batch)
+        self.stats.pipelines += 1
+        REDIS_PIPELINE_COMMANDS.observe(len(batch))
+        started_at = time.perf_counter()
+        try:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for command, args, _ in batch:
+                    pipeline.execute_command(command, *args)
+                replies = await pipeline.execute(raise_on_error=False)
+        except Exception as e:
+            self.stats.errors += 1
+            REDIS_PIPELINE_ERRORS.inc()
+            log.error(f"Redis pipeline of {len(batch)} commands failed: {e!r}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        REDIS_PIPELINE_SECONDS.observe(time.perf_counter() - started_at)
+        for (_, _, future), reply in zip(batch, replies):
+            if future.done():
+                continue
+            if isinstance(reply, Exception):
+                future.set_exception(reply)
+            else:
+                future.set_result(reply)
+
+    async def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
+        order = await self.execute("GET", ORDER_KEY.format(order_id))
+        return json.loads(order) if order is not None else None
+
+    async def get_order_status(self, order_id: str) -> Optional[OrderStatus]:
+        status = await self.execute("GET", ORDER_STATUS_KEY.format(order_id))
+        return OrderStatus(status.decode()) if status is not None else None
+
+    async def get_task_id(self, order_id: str) -> Optional[str]:
+        task_id = await self.execute("GET", TASK_ID_KEY.format(order_id))
+        return task_id.decode() if task_id is not None else None
+
+    async def get_order_statuses(
+        self, order_ids: List[str]
+    ) -> List[Tuple[Optional[OrderStatus], Optional[str]]]:
+        """
+        Read the status and task id of every order in 'order_ids' in one
+        round trip.
+
+        Returns:
+            List[Tuple[Optional[OrderStatus], Optional[str]]]: (status,
+            task id) of each order, in the order of 'order_ids'.
+        """
+        if not order_ids:
+            # MGET takes at least one key
+            return []
+        statuses, task_ids = await asyncio.gather(
+            self.execute("MGET", *(ORDER_STATUS_KEY.format(order_id)
+                                   for order_id in order_ids)),
+            self.execute("MGET", *(TASK_ID_KEY.format(order_id)
+                                   for order_id in order_ids)),
+        )
+        return [
+            (OrderStatus(status.decode()) if status is not None else None,
+             task_id.decode() if task_id is not None else None)
+            for status, task_id in zip(statuses, task_ids)
+        ]
+
+    async def set_task_ids(self, task_ids: Dict[str, str]) -> None:
+        """Record the Celery task submitting each order, by order id."""
+        await self.execute("MSET", *(
+            item
+            for order_id, task_id in task_ids.items()
+            for item in (TASK_ID_KEY.format(order_id), task_id)
+        ))
+
+    async def get_executed_orders(
+        self,
+        client_id: str,
+        count: int,
+        cursor: Optional[str] = None,
+        start: str = "-",
+        end: str = "+",
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Read up to 'count' executed orders of 'client_id', newest first.
+
+        Args:
+            client_id (str): The client whose history to read.
+            count (int): The maximum number of orders to return.
+            cursor (Optional[str]): Id of the last order already read,
+                reading resumes with the next older one.
+            start (str): Oldest stream id (or epoch ms) to include.
+            end (str): Newest stream id (or epoch ms) to include.
+
+        Returns:
+            List[Tuple[str, Dict[str, Any]]]: (stream id, order) pairs.
+        """
+        entries = await self.execute(
+            "XREVRANGE", EXECUTED_ORDERS_KEY.format(client_id),
+            end if cursor is None else f"({cursor}", start, "COUNT", count,
+        )
+        return [(entry_id.decode(), json.loads(fields[b"order"]))
+                for entry_id, fields in entries]
+
+    async def rest_orders(self, orders: List[Dict[str, Any]]) -> None:
+        """
+        Store PENDING orders as resting until they are matched, in one
+        round trip.
+        """
+        timestamp = int(time.time() * 1000)
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            for order in orders:
+                order_id = order["order_id"]
+                await self._rest_order_script(
+                    keys=[
+                        ORDER_KEY.format(order_id),
+                        ORDER_STATUS_KEY.format(order_id),
+                        RESTING_ORDERS_KEY.format(order["currency_pair"]),
+                    ],
+                    args=[
+                        json.dumps(order),
+                        OrderStatus.PENDING.value,
+                        ORDER_STATUS_CHANNEL,
+                        json.dumps({
+                            "orderId": order_id,
+                            "status": OrderStatus.PENDING.value,
+                            "timestamp": timestamp,
+                        }),
+                        order_id,
+                    ],
+                    client=pipeline,
+                )
+            await pipeline.execute()
+
+    async def fill_orders(self, pair: str, order_ids: List[str]) -> int:
+        """
+        Fill the resting orders of 'pair' in 'order_ids' that are still
+        PENDING.
+
+        Returns:
+            int: The number of orders filled.
+        """
+        keys = [EXECUTED_ORDERS_KEY.format("ABCD"),
+                RESTING_ORDERS_KEY.format(pair)]
+        for order_id in order_ids:
+            keys += [ORDER_KEY.format(order_id),
+                     ORDER_STATUS_KEY.format(order_id)]
+        return await self._fill_orders_script(
+            keys=keys,
+            args=[
+                OrderStatus.FILLED.value,
+                OrderStatus.PENDING.value,
+                ORDER_STATUS_CHANNEL,
+                int(time.time() * 1000),
+                EXECUTED_ORDERS_MAX_LEN,
+                *order_ids,
+            ],
+        )
+
+    async def get_resting_orders(self, pair: str) -> List[Dict[str, Any]]:
+        """The PENDING orders of 'pair' waiting to be matched."""
+        order_ids = await self.execute(
+            "SMEMBERS", RESTING_ORDERS_KEY.format(pair)
+        )
+        orders = await asyncio.gather(*(
+            self.get_order(order_id.decode()) for order_id in order_ids
+        ))
+        statuses = await asyncio.gather(*(
+            self.get_order_status(order_id.decode()) for order_id in order_ids
+        ))
+        return [
+            order for order, status in zip(orders, statuses)
+            if order is not None and status == OrderStatus.PENDING
+        ]
+
+    def pubsub(self) -> aioredis.client.PubSub:
+        """PubSub holding one of the pool's connections while subscribed."""
+        return self.redis.pubsub()
+
+    def get_stats(self) -> Dict[str, Any]:
+        in_use = self.pool.max_connections - self.pool.pool.qsize()
+        return {
+            "max_connections": self.pool.max_connections,
+            "open_connections": len(self.pool._connections),
+            "connections_in_use": in_use,
+            "utilisation": round(in_use / self.pool.max_connections, 4),
+            **self.stats.to_dict(),
+        }
+
+    async def close(self) -> None:
+        await self.redis.close()
+        await self.pool.disconnect()
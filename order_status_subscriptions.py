@@ -0,0 +1,146 @@
+import asyncio
+from typing import Dict, List, Set
+
+import orjson as json
+
+from data_types import OrderStatus
+from order_repository import OrderRepository
+from quote_subscriptions import ConflatingSender
+from log import LOGGER as log
+from config import (
+    ORDER_STATUS_CHANNEL,
+    ORDER_STATUS_MAX_SUBSCRIPTIONS,
+    REDIS_RECONNECT_DELAY,
+)
+
+# No transition follows these, their subscriptions end with them
+TERMINAL_STATUSES = {OrderStatus.FILLED.value, OrderStatus.CANCELLED.value}
+
+
+class OrderStatusHub:
+    """
+    Pushes the order status transitions the Celery tasks publish on
+    ORDER_STATUS_CHANNEL to the websocket clients registered for them.
+
+    One Redis subscription serves every client of the process. Messages are
+    forwarded as published, through each client's ConflatingSender, so a
+    slow client gets the latest status of each order rather than a backlog.
+    A subscription ends after a terminal status has been pushed. A client
+    holds at most ORDER_STATUS_MAX_SUBSCRIPTIONS of them, and orders that
+    have neither a status nor a queued task are refused, they would never
+    reach a terminal status.
+
+    Usage:
+        order_status_hub = OrderStatusHub(order_repository)
+        asyncio.create_task(order_status_hub.run())
+        ...
+        unknown_order_ids = await order_status_hub.subscribe(sender, order_ids)
+    """
+
+    def __init__(self, order_repository: OrderRepository) -> None:
+        self.order_repository = order_repository
+        self._subscriptions: Dict[str, Set[ConflatingSender]] = {}
+        self._sender_orders: Dict[ConflatingSender, Set[str]] = {}
+
+    async def subscribe(
+        self, sender: ConflatingSender, order_ids: List[str]
+    ) -> List[str]:
+        """
+        Push the status transitions of 'order_ids' to 'sender', starting
+        with the current status of those that already have one, read in one
+        round trip.
+
+        Returns:
+            List[str]: The ids refused as unknown.
+
+        Raises:
+            ValueError: If 'sender' would hold more than
+                ORDER_STATUS_MAX_SUBSCRIPTIONS subscriptions.
+        """
+        if not order_ids:
+            return []
+        sender_orders = self._sender_orders.get(sender, set())
+        added = len(set(order_ids) - sender_orders)
+        if len(sender_orders) + added > ORDER_STATUS_MAX_SUBSCRIPTIONS:
+            raise ValueError(f"At most {ORDER_STATUS_MAX_SUBSCRIPTIONS} order "
+                             f"subscriptions per connection")
+        # Registered before reading, so no transition is missed in between
+        for order_id in order_ids:
+            self._add(sender, order_id)
+        stored = await self.order_repository.get_order_statuses(order_ids)
+        unknown_order_ids = []
+        for order_id, (status, task_id) in zip(order_ids, stored):
+            # Skip if a terminal transition was pushed while reading
+            if sender not in self._subscriptions.get(order_id, ()):
+                continue
+            if status is not None:
+                self._deliver(order_id, json.dumps({
+                    "orderId": order_id,
+                    "status": status.value,
+                }).decode(), status.value, {sender})
+            elif task_id is None:
+                self.unsubscribe(sender, order_id)
+                unknown_order_ids.append(order_id)
+        return unknown_order_ids
+
+    def _add(self, sender: ConflatingSender, order_id: str) -> None:
+        self._subscriptions.setdefault(order_id, set()).add(sender)
+        self._sender_orders.setdefault(sender, set()).add(order_id)
+
+    def unsubscribe(self, sender: ConflatingSender, order_id: str) -> None:
+        senders = self._subscriptions.get(order_id)
+        if senders is None:
+            return
+        senders.discard(sender)
+        if not senders:
+            del self._subscriptions[order_id]
+        sender_orders = self._sender_orders.get(sender)
+        if sender_orders is not None:
+            sender_orders.discard(order_id)
+            if not sender_orders:
+                del self._sender_orders[sender]
+
+    def remove(self, sender: ConflatingSender) -> None:
+        """Drop every subscription of 'sender'."""
+        for order_id in list(self._sender_orders.get(sender, ())):
+            self.unsubscribe(sender, order_id)
+
+    def _deliver(self, order_id: str, message: str, status: str,
+                 senders: Set[ConflatingSender]) -> None:
+        for sender in senders:
+            sender.offer(("order_status", order_id), message)
+        if status in TERMINAL_STATUSES:
+            for sender in list(senders):
+                self.unsubscribe(sender, order_id)
+
+    def _on_message(self, data: bytes) -> None:
+        update = json.loads(data)
+        order_id = update["orderId"]
+        senders = self._subscriptions.get(order_id)
+        if senders:
+            self._deliver(order_id, data.decode(), update["status"], senders)
+
+    async def run(self) -> None:
+        """Follow ORDER_STATUS_CHANNEL forever, reconnecting on errors."""
+        while True:
+            pubsub = self.order_repository.pubsub()
+            try:
+                await pubsub.subscribe(ORDER_STATUS_CHANNEL)
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is None:
+                        continue
+                    try:
+                        self._on_message(message["data"])
+                    except (ValueError, KeyError) as e:
+                        log.error(f"Invalid order status update: {e!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Order status subscription failed, reconnecting: "
+                          f"{e!r}")
+                await asyncio.sleep(REDIS_RECONNECT_DELAY)
+            finally:
+                await pubsub.reset()
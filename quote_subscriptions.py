@@ -0,0 +1,227 @@
+import asyncio
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+import orjson as json
+from fastapi import WebSocket
+
+from data_types import Operation
+from log import LOGGER as log
+from order_book_snapshot import OrderBookSnapshot
+from utils import PriceCalculator
+from config import QUOTE_MAX_SUBSCRIPTIONS
+
+SubscriptionKey = Tuple[float, Optional[Operation]]  # (quantity, side)
+
+
+class ConflatingSender:
+    """
+    Outbound queue of one websocket connection that keeps only the latest
+    message per subscription.
+
+    A slow client therefore holds at most one pending message per
+    subscription instead of an ever growing backlog, and it never delays
+    the publisher or other clients. Messages are pre-serialised text.
+    """
+
+    __slots__ = ("websocket", "_pending", "_ready", "_task")
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.websocket = websocket
+        self._pending: Dict[Hashable, str] = {}
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def offer(self, key: Hashable, message: str) -> None:
+        """Queue 'message', replacing any unsent message for 'key'."""
+        self._pending.pop(key, None)
+        self._pending[key] = message
+        self._ready.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending:
+                key = next(iter(self._pending))
+                message = self._pending.pop(key)
+                try:
+                    await self.websocket.send_text(message)
+                except Exception as e:
+                    log.error(f"Quote push failed: {e}")
+                    return
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+class FanOutStats:
+    """
+    Counters showing how much work grouping subscriptions saves.
+
+    Attributes:
+        updates (int): Books published to at least one subscriber.
+        messages (int): Quotes offered to subscribers.
+        serialisations (int): Quote messages serialised, one per group.
+        price_computations (int): PriceCalculator calls made.
+        saved_computations (int): PriceCalculator calls a per-subscriber
+                                  computation would have made on top.
+    """
+
+    __slots__ = (
+        "updates",
+        "messages",
+        "serialisations",
+        "price_computations",
+        "saved_computations",
+    )
+
+    def __init__(self) -> None:
+        self.updates = 0
+        self.messages = 0
+        self.serialisations = 0
+        self.price_computations = 0
+        self.saved_computations = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class QuoteSubscriptionHub:
+    """
+    Registry of push subscriptions to quotes, grouped by
+    (currency pair, quantity, side).
+
+    publish() is called whenever a new merged book is installed. Each
+    group's quote is computed and serialised once, each price once per
+    (quantity, side) across groups, and the same text is offered to every
+    subscriber of the group. A client holds at most QUOTE_MAX_SUBSCRIPTIONS
+    subscriptions.
+    """
+
+    def __init__(self) -> None:
+        self._subscriptions: Dict[
+            str, Dict[SubscriptionKey, Set[ConflatingSender]]
+        ] = {}
+        # (currency pair, quantity, side) subscribed by each sender
+        self._sender_subscriptions: Dict[
+            ConflatingSender, Set[Tuple[str, float, Optional[Operation]]]
+        ] = {}
+        self.stats = FanOutStats()
+
+    def subscribe(
+        self,
+        sender: ConflatingSender,
+        currency_pair: str,
+        quantity: float,
+        operation: Optional[Operation] = None,
+    ) -> None:
+        """
+        Raises:
+            ValueError: If 'sender' would hold more than
+                QUOTE_MAX_SUBSCRIPTIONS subscriptions.
+        """
+        sender_subscriptions = self._sender_subscriptions.setdefault(
+            sender, set()
+        )
+        key = (currency_pair, quantity, operation)
+        if key not in sender_subscriptions and \
+                len(sender_subscriptions) >= QUOTE_MAX_SUBSCRIPTIONS:
+            raise ValueError(f"At most {QUOTE_MAX_SUBSCRIPTIONS} quote "
+                             f"subscriptions per connection")
+        sender_subscriptions.add(key)
+        groups = self._subscriptions.setdefault(currency_pair, {})
+        groups.setdefault((quantity, operation), set()).add(sender)
+
+    def unsubscribe(
+        self,
+        sender: ConflatingSender,
+        currency_pair: str,
+        quantity: float,
+        operation: Optional[Operation] = None,
+    ) -> None:
+        sender_subscriptions = self._sender_subscriptions.get(sender)
+        if sender_subscriptions is not None:
+            sender_subscriptions.discard((currency_pair, quantity, operation))
+            if not sender_subscriptions:
+                del self._sender_subscriptions[sender]
+        groups = self._subscriptions.get(currency_pair, {})
+        senders = groups.get((quantity, operation))
+        if senders is None:
+            return
+        senders.discard(sender)
+        if not senders:
+            del groups[(quantity, operation)]
+
+    def remove(self, sender: ConflatingSender) -> None:
+        """Drop every subscription of 'sender'."""
+        for key in list(self._sender_subscriptions.get(sender, ())):
+            self.unsubscribe(sender, *key)
+
+    def publish(self, currency_pair: str, order_books: OrderBookSnapshot) -> None:
+        """Offer the quotes on a newly installed book to its subscribers."""
+        groups = self._subscriptions.get(currency_pair)
+        if not groups:
+            return
+        prices: Dict[Tuple[float, Operation], float] = {}
+        requested_prices = 0
+        for (quantity, operation), senders in groups.items():
+            message = get_quote_message(order_books, currency_pair, quantity,
+                                        operation, prices)
+            for sender in senders:
+                sender.offer((currency_pair, quantity, operation), message)
+            requested_prices += len(senders) * (1 if operation else 2)
+            self.stats.messages += len(senders)
+            self.stats.serialisations += 1
+        self.stats.updates += 1
+        self.stats.price_computations += len(prices)
+        self.stats.saved_computations += requested_prices - len(prices)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = self.stats.to_dict()
+        stats["subscriptions"] = sum(
+            len(senders)
+            for groups in self._subscriptions.values()
+            for senders in groups.values()
+        )
+        return stats
+
+
+def get_quote_message(
+    order_books: OrderBookSnapshot,
+    currency_pair: str,
+    quantity: float,
+    operation: Optional[Operation] = None,
+    prices: Optional[Dict[Tuple[float, Operation], float]] = None,
+) -> str:
+    """
+    Serialise the pushed quote for 'quantity' of 'currency_pair'.
+
+    Args:
+        order_books (OrderBookSnapshot): The merged book to quote from.
+        currency_pair (str): The currency pair of the book.
+        quantity (float): The quantity to quote.
+        operation (Optional[Operation]): Quote only this side, both if None.
+        prices (Optional[Dict[Tuple[float, Operation], float]]): Unit prices
+            already computed on this book, filled with the new ones.
+
+    Returns:
+        str: The JSON quote message.
+    """
+    if prices is None:
+        prices = {}
+    message: Dict[str, Any] = {
+        "currencyPair": currency_pair,
+        "quantity": quantity,
+        "book_version": order_books.version,
+    }
+    for side, field in ((Operation.BUY, "buy_price"),
+                        (Operation.SELL, "sell_price")):
+        if operation is not None and operation != side:
+            continue
+        price = prices.get((quantity, side))
+        if price is None:
+            price = prices[(quantity, side)] = PriceCalculator.calculate_price(
+                order_books, side, quantity
+            )
+        message[field] = price * quantity
+    return json.dumps(message).decode()
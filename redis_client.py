@@ -1,82 +1,211 @@
-# from typing import List, Tuple
-# from order_books import OrderData
-# from redis import asyncio as aioredis
-# import orjson as json
-# from utils import OrderBookMerger
-
-
-# class RedisOrderBookStorage:
-#     def __init__(self) -> None:
-#         self.redis_url = "redis://localhost:6379"
-
-#     @staticmethod
-#     def get_serialized_order_book(order_book: List[OrderData]) -> bytes:
-#         serialized_order_book = [order.__dict__ for order in order_book]
-#         return json.dumps(serialized_order_book)
-
-#     @staticmethod
-#     def get_deserialized_order_book(order_book_bytes:
-#                                     bytes) -> List[OrderData]:
-#         deserialized_order_book = json.loads(order_book_bytes)
-#         return [OrderData.from_order(data)
-#                 for data in deserialized_order_book]
-
-#     async def store_order_book(self, pair: str,
-#                                order_books: Tuple[List[OrderData],
-#                                                   List[OrderData]]):
-#         """
-#         Store the order book data in Redis asynchronously.
-
-#         Args:
-#             pair (str): The currency pair identifier.
-#             bids (List[OrderData]): List of bid orders.
-#             asks (List[OrderData]): List of ask orders.
-#         """
-#         bids, asks = order_books
-#         async with aioredis.from_url(self.redis_url) as redis_client:
-#             # Store bid orders in a Sorted Set with price as score
-#             await redis_client.set(f"{pair}:bids",
-#                                    self.get_serialized_order_book(bids))
-#             await redis_client.set(f"{pair}:asks",
-#                                    self.get_serialized_order_book(asks))
-
-#     async def update_order_book(self, pair: str,
-#                                 order_books: Tuple[List[OrderData],
-#                                                    List[OrderData]]):
-#         """
-#         Update the order book data in Redis asynchronously.
-
-#         Args:
-#             pair (str): The currency pair identifier.
-#             bids (List[OrderData]): List of bid orders to update.
-#             asks (List[OrderData]): List of ask orders to update.
-#         """
-#         existing_order_book = await self.get_order_book(pair)
-#         if existing_order_book:
-#             merged_order_books = OrderBookMerger.merge_order_books(
-#              [existing_order_book, order_books])
-#             await self.store_order_book(pair, merged_order_books)
-#         else:
-#             await self.store_order_book(pair, order_books)
-
-#     async def get_order_book(self, pair: str) -> Tuple[List[OrderData],
-#                                                        List[OrderData]]:
-#         """
-#         Retrieve the order book data from Redis asynchronously.
-
-#         Args:
-#             pair (str): The currency pair identifier.
-
-#         Returns:
-#             Tuple[List[OrderData], List[OrderData]]: A tuple containing bid
-#             and ask orders.
-#         """
-#         async with aioredis.from_url(self.redis_url) as redis_client:
-#             # Retrieve bid and ask orders from Sorted Sets
-#             bids_bytes = await redis_client.get(f"{pair}:bids")
-#             asks_bytes = await redis_client.get(f"{pair}:asks")
-#             if bids_bytes and asks_bytes:
-#                 bids = self.get_deserialized_order_book(bids_bytes)
-#                 asks = self.get_deserialized_order_book(asks_bytes)
-#                 return bids, asks
-#             return [], []
+import asyncio
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+import orjson as json
+from redis import asyncio as aioredis
+
+from columnar_order_book import ColumnarOrderSide
+from order_book_snapshot import OrderBookSnapshot
+from shared_book import SIDE_COLUMNS
+from log import LOGGER as log
+from config import (
+    BOOK_REDIS_URL,
+    ORDER_BOOK_SNAPSHOT_KEY,
+    ORDER_BOOK_CHANNEL,
+    REDIS_RECONNECT_DELAY,
+)
+
+
+def serialize_snapshot(snapshot: OrderBookSnapshot, producer: str) -> bytes:
+    """
+    Encode a snapshot as a JSON header line followed by the raw columns.
+
+    The columns are written in SIDE_COLUMNS order, bids then asks, so a
+    consumer maps them with np.frombuffer instead of parsing levels.
+    """
+    sides = [
+        side if isinstance(side, ColumnarOrderSide)
+        else ColumnarOrderSide.from_orders(side)
+        for side in snapshot
+    ]
+    header = json.dumps({
+        "producer": producer,
+        "pair": snapshot.pair,
+        "version": snapshot.version,
+        "build_started_at": snapshot.build_started_at,
+        "built_at": snapshot.built_at,
+        "source_times": dict(snapshot.source_times),
+        "bids": len(sides[0]),
+        "asks": len(sides[1]),
+    })
+    columns = [
+        np.ascontiguousarray(getattr(side, name), dtype=dtype).tobytes()
+        for side in sides
+        for name, dtype in SIDE_COLUMNS
+    ]
+    return b"\n".join([header, b"".join(columns)])
+
+
+def deserialize_snapshot(payload: bytes) -> Tuple[str, OrderBookSnapshot]:
+    """
+    Decode a serialize_snapshot() payload.
+
+    Returns:
+        Tuple[str, OrderBookSnapshot]: The producer id and the snapshot.
+    """
+    header_end = payload.index(b"\n")
+    header = json.loads(payload[:header_end])
+    offset = header_end + 1
+    sides = []
+    for count in (header["bids"], header["asks"]):
+        columns = []
+        for _, dtype in SIDE_COLUMNS:
+            columns.append(np.frombuffer(payload, dtype, count, offset))
+            offset += count * np.dtype(dtype).itemsize
+        sides.append(ColumnarOrderSide(*columns))
+    return header["producer"], OrderBookSnapshot(
+        *sides,
+        pair=header["pair"],
+        version=header["version"],
+        source_times=header["source_times"],
+        build_started_at=header["build_started_at"],
+        built_at=header["built_at"],
+    )
+
+
+class RedisOrderBookStorage:
+    """
+    Distributes merged order book snapshots between nodes through Redis.
+
+    A producer stores the latest snapshot of every pair under
+    ORDER_BOOK_SNAPSHOT_KEY and announces it on ORDER_BOOK_CHANNEL.
+    Consumers load the stored snapshots, then follow the channel and keep
+    a local replica.
+
+    Usage:
+        storage = RedisOrderBookStorage()
+        storage.publish(snapshot)  # producer, from the install path
+        ...
+        await storage.subscribe(pairs, on_snapshot)  # consumer
+        ...
+        await storage.close()
+    """
+
+    def __init__(self, redis_url: str = BOOK_REDIS_URL) -> None:
+        self.redis_url = redis_url
+        self.producer = uuid4().hex
+        self._redis: Optional[aioredis.Redis] = None
+        self._pending: Dict[str, OrderBookSnapshot] = {}
+        self._ready: Optional[asyncio.Event] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    def _get_redis(self) -> aioredis.Redis:
+        if self._redis is None:
+            self._redis = aioredis.from_url(self.redis_url)
+        return self._redis
+
+    def publish(self, snapshot: OrderBookSnapshot) -> None:
+        """
+        Queue 'snapshot' for publication without blocking the caller.
+
+        Only the latest unsent snapshot of each pair is kept, a slow Redis
+        delays the replicas rather than the book builder.
+        """
+        if self._sender is None:
+            self._ready = asyncio.Event()
+            self._sender = asyncio.create_task(self._send_snapshots())
+        self._pending[snapshot.pair] = snapshot
+        self._ready.set()
+
+    async def _send_snapshots(self) -> None:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._pending:
+                pair = next(iter(self._pending))
+                snapshot = self._pending.pop(pair)
+                payload = serialize_snapshot(snapshot, self.producer)
+                try:
+                    async with self._get_redis().pipeline(
+                        transaction=False
+                    ) as pipeline:
+                        pipeline.set(ORDER_BOOK_SNAPSHOT_KEY.format(pair),
+                                     payload)
+                        pipeline.publish(ORDER_BOOK_CHANNEL.format(pair),
+                                         payload)
+                        await pipeline.execute()
+                except Exception as e:
+                    log.error(f"Publishing the {pair} book to Redis failed: "
+                              f"{e!r}")
+
+    async def get_order_book(self, pair: str) -> Optional[OrderBookSnapshot]:
+        """Load the latest stored snapshot of 'pair', None if there is none."""
+        payload = await self._get_redis().get(
+            ORDER_BOOK_SNAPSHOT_KEY.format(pair)
+        )
+        if payload is None:
+            return None
+        return deserialize_snapshot(payload)[1]
+
+    async def subscribe(
+        self,
+        pairs: List[str],
+        on_snapshot: Callable[[OrderBookSnapshot], None],
+    ) -> None:
+        """
+        Call 'on_snapshot' with every newer snapshot of 'pairs', forever.
+
+        Snapshots arriving out of order are skipped, a new producer (e.g.
+        after a restart) is followed from its first version. Reconnects
+        after REDIS_RECONNECT_DELAY when the connection drops.
+        """
+        latest: Dict[str, Tuple[str, int]] = {}
+
+        def deliver(payload: bytes) -> None:
+            producer, snapshot = deserialize_snapshot(payload)
+            previous = latest.get(snapshot.pair)
+            if previous is not None and previous[0] == producer and \
+                    previous[1] >= snapshot.version:
+                return
+            latest[snapshot.pair] = (producer, snapshot.version)
+            on_snapshot(snapshot)
+
+        channels = [ORDER_BOOK_CHANNEL.format(pair) for pair in pairs]
+        while True:
+            pubsub = self._get_redis().pubsub()
+            try:
+                # Subscribe before loading so no update in between is lost
+                await pubsub.subscribe(*channels)
+                for pair in pairs:
+                    payload = await self._get_redis().get(
+                        ORDER_BOOK_SNAPSHOT_KEY.format(pair)
+                    )
+                    if payload is not None:
+                        deliver(payload)
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is not None:
+                        deliver(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Redis book subscription failed, reconnecting: "
+                          f"{e!r}")
+                await asyncio.sleep(REDIS_RECONNECT_DELAY)
+            finally:
+                await pubsub.reset()
+
+    async def close(self) -> None:
+        if self._sender is not None:
+            self._sender.cancel()
+            # Let it unwind before its Redis client is closed below
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender = None
+        if self._redis is not None:
+            await self._redis.close()
+            await self._redis.connection_pool.disconnect()
+            self._redis = None
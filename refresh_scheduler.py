@@ -0,0 +1,216 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from order_books import ExchangeOrderBook
+from log import LOGGER as log
+from config import (
+    REFRESH_INTERVALS,
+    REFRESH_JITTER,
+    EXCHANGE_RATE_LIMITS,
+    REFRESH_BACKOFF_INITIAL,
+    REFRESH_BACKOFF_MAX,
+    EXCHANGE_FETCH_DEADLINE,
+)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing 'rate' requests per 'period' seconds.
+
+    Shared by every job of one exchange, so adding pairs does not multiply
+    the traffic sent to it.
+    """
+
+    __slots__ = ("rate", "period", "_tokens", "_updated_at", "_lock")
+
+    def __init__(self, rate: int, period: float) -> None:
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate,
+                    self._tokens
+                    + (now - self._updated_at) * self.rate / self.period,
+                )
+                self._updated_at = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep(
+                    (1.0 - self._tokens) * self.period / self.rate
+                )
+
+
+class RefreshJob:
+    """
+    Periodic refresh of one exchange's order book for one pair.
+
+    Attributes:
+        pair (str): The currency pair, e.g. BTCUSD.
+        exchange_order_book (ExchangeOrderBook): Fetches the book.
+        interval (float): Target seconds between refreshes.
+        refreshed_at (float): Epoch time of the last successful refresh.
+        refreshes (int): Successful refreshes.
+        errors (int): Failed refreshes.
+        consecutive_errors (int): Failures since the last success.
+        started_at (float): Monotonic time the job started.
+    """
+
+    __slots__ = (
+        "pair",
+        "exchange_order_book",
+        "interval",
+        "refreshed_at",
+        "refreshes",
+        "errors",
+        "consecutive_errors",
+        "started_at",
+    )
+
+    def __init__(
+        self, pair: str, exchange_order_book: ExchangeOrderBook, interval: float
+    ) -> None:
+        self.pair = pair
+        self.exchange_order_book = exchange_order_book
+        self.interval = interval
+        self.refreshed_at = 0.0
+        self.refreshes = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def exchange(self) -> str:
+        return self.exchange_order_book.exchange_name
+
+    def get_stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "target_rate": round(1.0 / self.interval, 3),
+            "achieved_rate": round(self.refreshes / elapsed, 3)
+            if elapsed else 0.0,
+            "book_age": round(time.time() - self.refreshed_at, 3)
+            if self.refreshed_at else None,
+        }
+
+
+class RefreshScheduler:
+    """
+    Owns one RefreshJob per (pair, exchange) and runs each on its own
+    cadence.
+
+    A job runs in a single task, so a book is never fetched twice at once.
+    Each refresh waits for the exchange's RateLimiter, the next one is
+    scheduled 'interval' (+/- REFRESH_JITTER) after the previous started,
+    a fetch running past EXCHANGE_FETCH_DEADLINE counts as a failure, and
+    failures back off exponentially from REFRESH_BACKOFF_INITIAL up to
+    REFRESH_BACKOFF_MAX. 'on_refresh' is called with the job and the
+    standardized book after every successful refresh.
+
+    Usage:
+        scheduler = RefreshScheduler(on_refresh)
+        scheduler.add_job("BTCUSD", exchange_order_book)
+        scheduler.start()
+        ...
+        await scheduler.stop()
+    """
+
+    def __init__(self, on_refresh: Callable[[RefreshJob, Any], None]) -> None:
+        self.on_refresh = on_refresh
+        self.jobs: Dict[Tuple[str, str], RefreshJob] = {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(
+        self,
+        pair: str,
+        exchange_order_book: ExchangeOrderBook,
+        interval: Optional[float] = None,
+    ) -> RefreshJob:
+        exchange = exchange_order_book.exchange_name
+        if (pair, exchange) in self.jobs:
+            raise ValueError(f"Refresh job {pair} {exchange} already exists")
+        job = RefreshJob(
+            pair,
+            exchange_order_book,
+            interval or REFRESH_INTERVALS.get(exchange, 1.0),
+        )
+        self.jobs[(pair, exchange)] = job
+        if exchange not in self._rate_limiters and \
+                exchange in EXCHANGE_RATE_LIMITS:
+            self._rate_limiters[exchange] = RateLimiter(
+                *EXCHANGE_RATE_LIMITS[exchange]
+            )
+        return job
+
+    def start(self) -> None:
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._run(job)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, job: RefreshJob) -> None:
+        rate_limiter = self._rate_limiters.get(job.exchange)
+        job.started_at = time.monotonic()
+        # Start jobs at random offsets so they do not fire in lock step
+        await asyncio.sleep(random.uniform(0.0, job.interval))
+        while True:
+            started_at = time.monotonic()
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            try:
+                order_book = await asyncio.wait_for(
+                    job.exchange_order_book.get_standardized_order_book(),
+                    EXCHANGE_FETCH_DEADLINE,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.errors += 1
+                job.consecutive_errors += 1
+                delay = min(
+                    REFRESH_BACKOFF_INITIAL * 2 ** (job.consecutive_errors - 1),
+                    REFRESH_BACKOFF_MAX,
+                )
+                log.error(
+                    f"Refreshing {job.pair} {job.exchange} failed "
+                    f"({job.consecutive_errors} in a row), retrying in "
+                    f"{delay:.1f}s: {e!r}"
+                )
+                await asyncio.sleep(delay)
+                continue
+            job.refreshed_at = time.time()
+            job.refreshes += 1
+            job.consecutive_errors = 0
+            try:
+                self.on_refresh(job, order_book)
+            except Exception as e:
+                log.exception(
+                    f"Installing {job.pair} {job.exchange} refresh failed: {e}"
+                )
+            jitter = random.uniform(-REFRESH_JITTER, REFRESH_JITTER)
+            next_at = started_at + job.interval * (1.0 + jitter)
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            f"{pair}:{exchange}": job.get_stats()
+            for (pair, exchange), job in self.jobs.items()
+        }
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from config import STATS_PREFIX, EVENT_LOOP_STATS_ENDPOINT, METRICS_ENDPOINT
+from metrics import update_order_book_metrics, update_order_repository_metrics
+
+
+stats_router = APIRouter(prefix=STATS_PREFIX)
+metrics_router = APIRouter()
+
+
+@stats_router.get(EVENT_LOOP_STATS_ENDPOINT)
+async def get_event_loop_stats(request: Request, reset: bool = False):
+    """
+    Event loop lag percentiles of this process. With ?reset=true the
+    samples are cleared after reading, to start a measurement window.
+    """
+    event_loop_monitor = request.app.extra["event_loop_monitor"]
+    stats = event_loop_monitor.get_stats()
+    if reset:
+        event_loop_monitor.reset()
+    return stats
+
+
+@metrics_router.get(METRICS_ENDPOINT)
+async def get_metrics(request: Request):
+    """Prometheus metrics of this process."""
+    update_order_book_metrics(request.app.extra.get("order_book", {}).values())
+    update_order_repository_metrics(request.app.extra["order_repository"])
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,21 +1,28 @@
+import asyncio
+import time
 from fastapi import WebSocket, APIRouter, WebSocketDisconnect
 import orjson as json
-from typing import Optional
-from utils import (PriceCalculator, ExchangeLimitOrderCalculator,
-                   measure_latency)
-from data_types import Operation
-from models import LimitOrder
+from typing import Any, Dict, List, Optional, Tuple
+from utils import PriceCalculator, ExchangeLimitOrderCalculator
+from data_types import Operation, OrderStatus
+from models import LimitOrder, LimitOrderListAdapter
+from order_book_snapshot import OrderBookSnapshot
+from quote_subscriptions import ConflatingSender, get_quote_message
+from metrics import WEBSOCKET_MESSAGE_SECONDS, WEBSOCKET_CONNECTIONS
 
 # from log import LOGGER as log
-from redis import asyncio as aioredis
-from tasks.orders import send_limit_order, celery_worker
+from tasks.orders import (send_limit_order, send_limit_order_batch,
+                          celery_worker)
 from log import LOGGER as log
 from uuid import uuid4
-from config import (REDIS_URL_LOCALHOST, TASK_ID_KEY, EXECUTED_ORDERS_KEY,
-                    WS_PREFIX, ORDER_BOOK_ENDPOINT, LIMIT_ORDER_ENDPOINT,
+from config import (WS_PREFIX, ORDER_BOOK_ENDPOINT, LIMIT_ORDER_ENDPOINT,
                     EXECUTE_LIMIT_ORDER_ENDPOINT,
                     GET_LIMIT_ORDER_STATUS_ENDPOINT,
-                    GET_EXECUTED_ORDERS_ENDPOINT)
+                    GET_EXECUTED_ORDERS_ENDPOINT, SUBSCRIBE_ACTION,
+                    UNSUBSCRIBE_ACTION, ORDER_BATCH_MAX_SIZE,
+                    EXECUTED_ORDERS_PAGE_SIZE, EXECUTED_ORDERS_MAX_PAGE_SIZE,
+                    EXECUTED_ORDERS_CHUNK_SIZE, ORDER_BATCH_CHUNK_SIZE,
+                    ORDER_STATUS_MAX_BATCH_SIZE, CURRENCY_PAIRS)
 from celery.result import AsyncResult
 from pydantic import ValidationError
 
@@ -25,7 +32,7 @@ ws_router = APIRouter(prefix=WS_PREFIX)
 
 async def get_order_book_prices(
     websocket: WebSocket, currency_pair: str, quantity: float
-) -> tuple[float, float]:
+) -> tuple[float, float, OrderBookSnapshot]:
     order_books = websocket.app.get_app_order_book(currency_pair)
     if order_books is None:
         log.error("Order book not found")
@@ -34,7 +41,45 @@ async def get_order_book_prices(
                                                 quantity)
     sell_price = PriceCalculator.calculate_price(order_books, Operation.SELL,
                                                  quantity)
-    return buy_price * quantity, sell_price * quantity
+    return buy_price * quantity, sell_price * quantity, order_books
+
+
+async def get_order_statuses(
+    websocket: WebSocket, order_ids: List[str]
+) -> List[Dict[str, Any]]:
+    """
+    Status of each order in 'order_ids', read from Redis in one round trip.
+
+    Orders not stored yet report the state of the Celery task submitting
+    them, if it is known, else PENDING.
+    """
+    stored = await websocket.app.extra[
+        "order_repository"
+    ].get_order_statuses(order_ids)
+    task_ids = {task_id for status, task_id in stored
+                if status is None and task_id is not None}
+    task_states: Dict[str, Tuple[str, str]] = {}
+    if task_ids:
+        def get_task_states():
+            # The result backend client blocks, keep it off the event loop
+            for task_id in task_ids:
+                result = AsyncResult(id=task_id, app=celery_worker)
+                task_states[task_id] = (
+                    result.status,
+                    str(result.result) if result.failed() else "",
+                )
+        await asyncio.to_thread(get_task_states)
+    statuses = []
+    for order_id, (status, task_id) in zip(order_ids, stored):
+        if status is not None:
+            state, result = status.value, ""
+        else:
+            state, result = task_states.get(
+                task_id, (OrderStatus.PENDING.value, "")
+            )
+        statuses.append({"status": state, "result": result,
+                         "orderId": order_id})
+    return statuses
 
 
 async def receive_json(websocket: WebSocket) -> Optional[dict]:
@@ -49,17 +94,29 @@ async def receive_json(websocket: WebSocket) -> Optional[dict]:
 
 
 async def handle_websocket(websocket: WebSocket, handler):
+    """
+    Serve requests on 'websocket' with 'handler' until it closes, recording
+    the time each request takes to handle and the open connections per
+    endpoint.
+    """
+    endpoint = websocket.url.path
+    message_seconds = WEBSOCKET_MESSAGE_SECONDS.labels(endpoint)
+    connections = WEBSOCKET_CONNECTIONS.labels(endpoint)
     await websocket.accept()
+    connections.inc()
     try:
         while True:
             json_data = await receive_json(websocket)
             if json_data is None:
                 break
+            received_at = time.perf_counter()
             await handler(websocket, json_data)
+            message_seconds.observe(time.perf_counter() - received_at)
     except Exception as e:
         log.error(f"An error occurred: {e}")
         await websocket.send_text(f"Error: {e}")
     finally:
+        connections.dec()
         try:
             await websocket.close()
         except RuntimeError:
@@ -67,26 +124,72 @@ async def handle_websocket(websocket: WebSocket, handler):
 
 
 @ws_router.websocket(ORDER_BOOK_ENDPOINT)
-@measure_latency
 async def order_book_websocket_endpoint(websocket: WebSocket):
+    """
+    Quote buy and sell prices for a quantity of a currency pair.
+
+    {"currencyPair", "quantity"} is answered once. With "action": "subscribe"
+    the quote is pushed again on every order book update, until a matching
+    "action": "unsubscribe" or the connection closes. An optional
+    "operation" (BUY or SELL) restricts a subscription to one side. Only
+    CURRENCY_PAIRS can be subscribed to, at most QUOTE_MAX_SUBSCRIPTIONS
+    per connection.
+    """
+    quote_hub = websocket.app.extra["quote_hub"]
+    sender: Optional[ConflatingSender] = None
+
     async def handler(websocket: WebSocket, json_data):
+        nonlocal sender
         try:
             currency_pair = json_data["currencyPair"]
             quantity = float(json_data["quantity"])
-            buy_price, sell_price = await get_order_book_prices(
+            action = json_data.get("action")
+            if action in (SUBSCRIBE_ACTION, UNSUBSCRIBE_ACTION):
+                operation = json_data.get("operation")
+                if operation is not None:
+                    operation = Operation(operation)
+                if sender is None:
+                    sender = ConflatingSender(websocket)
+                if action == UNSUBSCRIBE_ACTION:
+                    quote_hub.unsubscribe(sender, currency_pair, quantity,
+                                          operation)
+                    return
+                if currency_pair not in CURRENCY_PAIRS:
+                    raise ValueError(f"Unsupported currency pair "
+                                     f"{currency_pair}")
+                quote_hub.subscribe(sender, currency_pair, quantity,
+                                    operation)
+                order_books = websocket.app.get_app_order_book(currency_pair)
+                if order_books is not None:
+                    sender.offer(
+                        (currency_pair, quantity, operation),
+                        get_quote_message(order_books, currency_pair,
+                                          quantity, operation),
+                    )
+                return
+            buy_price, sell_price, snapshot = await get_order_book_prices(
                 websocket, currency_pair, quantity
             )
-            data = {"buy_price": buy_price, "sell_price": sell_price}
+            data = {
+                "buy_price": buy_price,
+                "sell_price": sell_price,
+                "book_version": snapshot.version,
+                "book_age": round(snapshot.age(), 3),
+            }
             await websocket.send_json(data)
         except (ValueError, Exception) as e:
             log.error(f"Error: {e}")
             await websocket.send_text(f"Error: {e}")
 
-    await handle_websocket(websocket, handler)
+    try:
+        await handle_websocket(websocket, handler)
+    finally:
+        if sender is not None:
+            quote_hub.remove(sender)
+            sender.close()
 
 
 @ws_router.websocket(LIMIT_ORDER_ENDPOINT)
-@measure_latency
 async def limit_order_websocket_endpoint(websocket: WebSocket):
     async def handler(websocket: WebSocket, json_data):
         try:
@@ -114,15 +217,84 @@ async def limit_order_websocket_endpoint(websocket: WebSocket):
 
 
 @ws_router.websocket(EXECUTE_LIMIT_ORDER_ENDPOINT)
-@measure_latency
 async def execute_limit_order_websocket_endpoint(websocket: WebSocket):
+    """
+    Submit limit orders.
+
+    A single order is answered with {"status", "order_id"}. A batch
+    {"orders": [...]} of up to ORDER_BATCH_MAX_SIZE orders is validated as a
+    whole, rejected as a whole if any order is invalid, and answered with
+    {"status", "order_ids"} in the order submitted. Orders are stored as
+    validated, and only for the CURRENCY_PAIRS that have a book.
+    """
+    async def submit_orders(orders):
+        order_repository = websocket.app.extra["order_repository"]
+        matching_engine = websocket.app.extra.get("matching_engine")
+        if matching_engine is None:
+            if len(orders) == 1:
+                task_ids = {orders[0]["order_id"]:
+                            send_limit_order.delay(orders[0]).id}
+            else:
+                chunk_results = send_limit_order_batch(
+                    orders, ORDER_BATCH_CHUNK_SIZE
+                ).results
+                task_ids = {
+                    order["order_id"]: chunk_results[
+                        index // ORDER_BATCH_CHUNK_SIZE
+                    ].id
+                    for index, order in enumerate(orders)
+                }
+            # Lets a status query tell queued submissions from unknown ones.
+            # The orders are queued whatever happens here, failing them
+            # would make a retrying client submit them twice
+            try:
+                await order_repository.set_task_ids(task_ids)
+            except Exception as e:
+                log.error(f"Storing the task ids of {len(task_ids)} queued "
+                          f"orders failed: {e!r}")
+            return
+        await order_repository.rest_orders(orders)
+        for order in orders:
+            matching_engine.add(order)
+        for pair in {order["currency_pair"] for order in orders}:
+            snapshot = websocket.app.get_app_order_book(pair)
+            if snapshot is not None:
+                matching_engine.match(snapshot)
+
+    def get_order(limit_order: LimitOrder) -> Dict[str, Any]:
+        """The normalised order to store, for a pair with a book."""
+        if limit_order.currency_pair not in CURRENCY_PAIRS:
+            raise ValueError(f"Unsupported currency pair "
+                             f"{limit_order.currency_pair}")
+        return limit_order.model_dump(mode="json")
+
     async def handler(websocket: WebSocket, json_data):
         try:
-            order_id = uuid4().hex
-            json_data["order_id"] = order_id
-            LimitOrder(**json_data)  # Validate limit order
-            send_limit_order.delay(json_data)
-            response = {"status": "SUCCESS", "order_id": order_id}
+            if "orders" in json_data:
+                orders = json_data["orders"]
+                if not isinstance(orders, list) or not orders or \
+                        not all(isinstance(order, dict) for order in orders):
+                    raise ValueError("orders must be a non-empty list of "
+                                     "objects")
+                if len(orders) > ORDER_BATCH_MAX_SIZE:
+                    raise ValueError(f"At most {ORDER_BATCH_MAX_SIZE} orders "
+                                     f"per batch")
+                for order in orders:
+                    order["order_id"] = uuid4().hex
+                orders = [
+                    get_order(limit_order) for limit_order in
+                    LimitOrderListAdapter.validate_python(orders)
+                ]
+                await submit_orders(orders)
+                response = {
+                    "status": "SUCCESS",
+                    "order_ids": [order["order_id"] for order in orders],
+                }
+            else:
+                order_id = uuid4().hex
+                json_data["order_id"] = order_id
+                await submit_orders([get_order(LimitOrder(**json_data))])
+                response = {"status": "SUCCESS", "order_id": order_id}
             await websocket.send_json(response)
         except (ValueError, ValidationError, Exception) as ve:
             log.error(f"Error: {ve}")
@@ -133,41 +305,118 @@ async def execute_limit_order_websocket_endpoint(websocket: WebSocket):
 
 
 @ws_router.websocket(GET_LIMIT_ORDER_STATUS_ENDPOINT)
-@measure_latency
 async def get_limit_order_websocket_endpoint(websocket: WebSocket):
+    """
+    Report the status of limit orders.
+
+    {"orderId"} is answered once with the order status, {"orderIds"} with
+    the statuses of all of them in one {"statuses"} message, empty for an
+    empty list. With
+    "action": "subscribe" and "orderIds" (or "orderId"), every status
+    transition of those orders is pushed as {"orderId", "status",
+    "timestamp"} until it reaches FILLED or CANCELLED, a matching
+    "action": "unsubscribe" arrives or the connection closes. A connection
+    holds at most ORDER_STATUS_MAX_SUBSCRIPTIONS subscriptions; orders that
+    are not known are refused with {"status": "FAILED", "orderIds"}.
+    """
+    order_status_hub = websocket.app.extra["order_status_hub"]
+    sender: Optional[ConflatingSender] = None
+
     async def handler(websocket: WebSocket, json_data):
+        nonlocal sender
         try:
-            order_id = json_data["orderId"]
-            async with aioredis.from_url(REDIS_URL_LOCALHOST) as redis_client:
-                task_id = await redis_client.get(TASK_ID_KEY.format(order_id))
-            result = AsyncResult(id=task_id, app=celery_worker)
-            data = {
-                "status": result.status,
-                "result": result.result if result.result else "",
-                "orderId": order_id,
-            }
+            action = json_data.get("action")
+            if "orderIds" in json_data:
+                order_ids = json_data["orderIds"]
+                if not isinstance(order_ids, list) or \
+                        len(order_ids) > ORDER_STATUS_MAX_BATCH_SIZE:
+                    raise ValueError(f"orderIds must be a list of at most "
+                                     f"{ORDER_STATUS_MAX_BATCH_SIZE} ids")
+                order_ids = [str(order_id) for order_id in order_ids]
+            else:
+                order_ids = [json_data["orderId"]]
+            if action in (SUBSCRIBE_ACTION, UNSUBSCRIBE_ACTION):
+                if sender is None:
+                    sender = ConflatingSender(websocket)
+                if action == SUBSCRIBE_ACTION:
+                    unknown_order_ids = await order_status_hub.subscribe(
+                        sender, order_ids
+                    )
+                    if unknown_order_ids:
+                        await websocket.send_json({
+                            "status": "FAILED",
+                            "error": "Unknown orders",
+                            "orderIds": unknown_order_ids,
+                        })
+                else:
+                    for order_id in order_ids:
+                        order_status_hub.unsubscribe(sender, order_id)
+                return
+            if "orderIds" in json_data:
+                data = {"statuses": await get_order_statuses(
+                    websocket, order_ids
+                )}
+            else:
+                data = (await get_order_statuses(
+                    websocket, [json_data["orderId"]]
+                ))[0]
             await websocket.send_json(data)
         except (ValueError, Exception) as e:
             log.error(f"Error: {e}")
             resp = {"status": "FAILED", "error": str(e)}
             await websocket.send_json(resp)
 
-    await handle_websocket(websocket, handler)
+    try:
+        await handle_websocket(websocket, handler)
+    finally:
+        if sender is not None:
+            order_status_hub.remove(sender)
+            sender.close()
 
 
 @ws_router.websocket(GET_EXECUTED_ORDERS_ENDPOINT)
-@measure_latency
 async def get_executed_orders(websocket: WebSocket):
+    """
+    Page through the executed orders of a client, newest first.
+
+    {"clientId", "pageSize", "cursor", "start", "end"} returns up to
+    "pageSize" orders older than "cursor" (the "next_cursor" of a previous
+    page) and between the "start" and "end" stream ids or epoch ms. A page is
+    streamed as frames of at most EXECUTED_ORDERS_CHUNK_SIZE orders,
+    {"executed_orders", "next_cursor", "done"}; "next_cursor" is null once
+    the history is exhausted.
+    """
     async def handler(websocket: WebSocket, json_data):
         try:
             client_id = json_data["clientId"]
             client_id = "ABCD"
-            async with aioredis.from_url(REDIS_URL_LOCALHOST) as redis_client:
-                orders = await redis_client.lrange(
-                    EXECUTED_ORDERS_KEY.format(client_id), 0, -1
+            page_size = int(json_data.get("pageSize",
+                                          EXECUTED_ORDERS_PAGE_SIZE))
+            if not 0 < page_size <= EXECUTED_ORDERS_MAX_PAGE_SIZE:
+                raise ValueError(f"pageSize must be between 1 and "
+                                 f"{EXECUTED_ORDERS_MAX_PAGE_SIZE}")
+            cursor = json_data.get("cursor")
+            start = str(json_data.get("start", "-"))
+            end = str(json_data.get("end", "+"))
+            order_repository = websocket.app.extra["order_repository"]
+            remaining = page_size
+            while True:
+                count = min(remaining, EXECUTED_ORDERS_CHUNK_SIZE)
+                entries = await order_repository.get_executed_orders(
+                    client_id, count, cursor, start, end
                 )
-            data = {"executed_orders": orders}
-            await websocket.send_json(data)
+                remaining -= len(entries)
+                exhausted = len(entries) < count
+                if entries:
+                    cursor = entries[-1][0]
+                done = exhausted or remaining == 0
+                await websocket.send_json({
+                    "executed_orders": [order for _, order in entries],
+                    "next_cursor": None if exhausted else cursor,
+                    "done": done,
+                })
+                if done:
+                    break
         except (ValueError, Exception) as e:
             log.error(f"Error: {e}")
             resp = {"status": "FAILED", "error": str(e)}
@@ -0,0 +1,207 @@
+import math
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from columnar_order_book import EXCHANGES, ColumnarOrderSide
+from order_book_snapshot import OrderBookSnapshot
+from log import LOGGER as log
+from config import SHARED_BOOK_NAME, SHARED_BOOK_CAPACITY
+
+# Segment layout, native little-endian:
+#   header: sequence u64, version u64, build_started_at f64, built_at f64,
+#           bid count u32, ask count u32, source time f64 per EXCHANGES
+#           (NaN if the exchange did not contribute)
+#   bids, then asks: price f64[capacity], amount f64[capacity],
+#                    timestamp i64[capacity], exchange u8[capacity]
+# The sequence is a seqlock: odd while the writer is updating the segment.
+HEADER = struct.Struct(f"<QQddII{len(EXCHANGES)}d")
+HEADER_SIZE = (HEADER.size + 63) // 64 * 64
+SIDE_COLUMNS = (
+    ("price", np.float64),
+    ("amount", np.float64),
+    ("timestamp", np.int64),
+    ("exchange", np.uint8),
+)
+SEQUENCE = struct.Struct("<Q")
+MAX_READ_ATTEMPTS = 100
+
+
+def _segment_size(capacity: int) -> int:
+    side_size = sum(np.dtype(dtype).itemsize for _, dtype in SIDE_COLUMNS)
+    return HEADER_SIZE + 2 * capacity * side_size
+
+
+def _map_sides(
+    buffer: memoryview, capacity: int
+) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Map the bid and ask columns of a segment as NumPy arrays."""
+    offset = HEADER_SIZE
+    sides = []
+    for _ in range(2):
+        columns = {}
+        for name, dtype in SIDE_COLUMNS:
+            columns[name] = np.ndarray(
+                (capacity,), dtype=dtype, buffer=buffer, offset=offset
+            )
+            offset += capacity * np.dtype(dtype).itemsize
+        sides.append(columns)
+    return sides[0], sides[1]
+
+
+def _to_columnar_side(orders) -> ColumnarOrderSide:
+    if isinstance(orders, ColumnarOrderSide):
+        return orders
+    return ColumnarOrderSide.from_orders(orders)
+
+
+class SharedBookWriter:
+    """
+    Publishes the snapshots of one pair into a shared memory segment.
+
+    Only one writer may exist per pair. Levels beyond 'capacity' per side
+    are not published.
+    """
+
+    def __init__(self, pair: str, capacity: int = SHARED_BOOK_CAPACITY) -> None:
+        self.pair = pair
+        self.capacity = capacity
+        name = SHARED_BOOK_NAME.format(pair)
+        try:
+            # Left behind by a builder that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = shared_memory.SharedMemory(
+            name, create=True, size=_segment_size(capacity)
+        )
+        self._bids, self._asks = _map_sides(self._shm.buf, capacity)
+        self._sequence = 0
+        SEQUENCE.pack_into(self._shm.buf, 0, self._sequence)
+
+    def publish(self, snapshot: OrderBookSnapshot) -> None:
+        bids, asks = (_to_columnar_side(side) for side in snapshot)
+        bid_count = min(len(bids), self.capacity)
+        ask_count = min(len(asks), self.capacity)
+        buffer = self._shm.buf
+        self._sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self._sequence)  # odd, update begins
+        for columns, side, count in ((self._bids, bids, bid_count),
+                                     (self._asks, asks, ask_count)):
+            for name, _ in SIDE_COLUMNS:
+                columns[name][:count] = getattr(side, name)[:count]
+        HEADER.pack_into(
+            buffer,
+            0,
+            self._sequence,
+            snapshot.version,
+            snapshot.build_started_at,
+            snapshot.built_at,
+            bid_count,
+            ask_count,
+            *(snapshot.source_times.get(exchange, math.nan)
+              for exchange in EXCHANGES),
+        )
+        self._sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self._sequence)  # even, update done
+
+    def close(self) -> None:
+        self._bids = self._asks = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedBookReader:
+    """
+    Reads the snapshots a SharedBookWriter publishes for one pair.
+
+    Raises:
+        FileNotFoundError: If no writer has created the pair's segment yet.
+    """
+
+    def __init__(self, pair: str, capacity: int = SHARED_BOOK_CAPACITY) -> None:
+        self.pair = pair
+        self._shm = shared_memory.SharedMemory(SHARED_BOOK_NAME.format(pair))
+        # Attaching registers the segment with this process's resource
+        # tracker, which would unlink it on exit, the writer owns it
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._bids, self._asks = _map_sides(self._shm.buf, capacity)
+
+    @property
+    def version(self) -> int:
+        """Version of the latest published snapshot, 0 before the first."""
+        return HEADER.unpack_from(self._shm.buf, 0)[1]
+
+    def read(self) -> Optional[OrderBookSnapshot]:
+        """
+        Copy the latest published snapshot out of shared memory.
+
+        Retries while the writer is mid-update, the copied arrays stay valid
+        however often the writer publishes afterwards.
+
+        Returns:
+            Optional[OrderBookSnapshot]: The snapshot, None if none has been
+            published or no consistent copy could be made.
+        """
+        buffer = self._shm.buf
+        for _ in range(MAX_READ_ATTEMPTS):
+            header = HEADER.unpack_from(buffer, 0)
+            sequence, version = header[0], header[1]
+            if sequence % 2:
+                continue
+            if version == 0:
+                return None
+            build_started_at, built_at, bid_count, ask_count = header[2:6]
+            bids, asks = (
+                ColumnarOrderSide(
+                    *(columns[name][:count].copy() for name, _ in SIDE_COLUMNS)
+                )
+                for columns, count in ((self._bids, bid_count),
+                                       (self._asks, ask_count))
+            )
+            if SEQUENCE.unpack_from(buffer, 0)[0] != sequence:
+                continue  # Overwritten while copying
+            source_times = {
+                exchange: source_time
+                for exchange, source_time in zip(EXCHANGES, header[6:])
+                if not math.isnan(source_time)
+            }
+            return OrderBookSnapshot(
+                bids,
+                asks,
+                pair=self.pair,
+                version=version,
+                source_times=source_times,
+                build_started_at=build_started_at,
+                built_at=built_at,
+            )
+        log.warning(f"No consistent read of the shared {self.pair} book")
+        return None
+
+    def close(self) -> None:
+        self._bids = self._asks = None
+        self._shm.close()
+
+
+class SharedBookPublisher:
+    """Book publisher writing every pair's snapshots to shared memory."""
+
+    def __init__(self) -> None:
+        self._writers: Dict[str, SharedBookWriter] = {}
+
+    def publish(self, snapshot: OrderBookSnapshot) -> None:
+        writer = self._writers.get(snapshot.pair)
+        if writer is None:
+            writer = self._writers[snapshot.pair] = SharedBookWriter(
+                snapshot.pair
+            )
+        writer.publish(snapshot)
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
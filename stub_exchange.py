@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+"""
+    Module: stub_exchange
+    Description: Local stand-in for the Coinbase, Kraken and Gemini order book
+    REST and level-2 websocket APIs, used to run the app offline.
+
+    Usage:
+        python stub_exchange.py --port 8081
+
+        COINBASE_REST_URL=http://localhost:8081/coinbase \\
+        COINBASE_WS_URL=ws://localhost:8081/coinbase/ws \\
+        KRAKEN_REST_URL=http://localhost:8081/kraken \\
+        KRAKEN_WS_URL=ws://localhost:8081/kraken/ws \\
+        GEMINI_REST_URL=http://localhost:8081/gemini \\
+        GEMINI_WS_URL=ws://localhost:8081/gemini \\
+        ORDER_BOOK_MODE=stream uvicorn app:app
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Tuple
+
+from aiohttp import web, WSMsgType
+
+MID_PRICES = {"BTC": 50000.0, "ETH": 3000.0}
+KRAKEN_RESULT_KEYS = {"BTC": "XXBTZUSD", "ETH": "XETHZUSD"}
+EXCHANGES = ("COINBASE", "KRAKEN", "GEMINI")
+
+Change = Tuple[str, float, float]  # (side, price, amount), amount 0 removes
+
+
+def get_base_currency(symbol: str) -> str:
+    """Map an exchange symbol (BTC-USD, XBT/USD, BTCUSD...) to its base."""
+    return symbol.upper().replace("XBT", "BTC")[:3]
+
+
+class SimulatedBook:
+    """
+    Randomly mutating level-2 book around a fixed mid price.
+
+    Every subscriber queue receives the list of changes made by each step.
+    """
+
+    def __init__(self, mid: float, levels: int, rng: random.Random) -> None:
+        self.mid = mid
+        self.tick = mid / 100000
+        self.levels = levels
+        self.rng = rng
+        self.bids: Dict[float, float] = {}
+        self.asks: Dict[float, float] = {}
+        self.subscribers: Set[asyncio.Queue] = set()
+        for _ in range(levels):
+            self.bids[self._random_price("bid")] = self._random_amount()
+            self.asks[self._random_price("ask")] = self._random_amount()
+
+    def _random_price(self, side: str) -> float:
+        offset = self.rng.randint(1, self.levels * 4) * self.tick
+        price = self.mid - offset if side == "bid" else self.mid + offset
+        return round(price, 2)
+
+    def _random_amount(self) -> float:
+        return round(self.rng.expovariate(2.0) + 0.0001, 8)
+
+    def step(self, changes: int) -> List[Change]:
+        """Apply random inserts, updates and removals and publish them."""
+        applied: List[Change] = []
+        for _ in range(changes):
+            side = self.rng.choice(("bid", "ask"))
+            levels = self.bids if side == "bid" else self.asks
+            if self.rng.random() < 0.3 and len(levels) > 1:
+                price = self.rng.choice(list(levels))
+                del levels[price]
+                amount = 0.0
+            else:
+                price = self._random_price(side)
+                amount = self._random_amount()
+                levels[price] = amount
+            applied.append((side, price, amount))
+        for queue in self.subscribers:
+            queue.put_nowait(applied)
+        return applied
+
+    def sorted_bids(self, depth: int = 0) -> List[Tuple[float, float]]:
+        bids = sorted(self.bids.items(), reverse=True)
+        return bids[:depth] if depth else bids
+
+    def sorted_asks(self, depth: int = 0) -> List[Tuple[float, float]]:
+        asks = sorted(self.asks.items())
+        return asks[:depth] if depth else asks
+
+
+def fmt_price(price: float) -> str:
+    return f"{price:.2f}"
+
+
+def fmt_amount(amount: float) -> str:
+    return f"{amount:.8f}"
+
+
+def get_book(request: web.Request, exchange: str, symbol: str):
+    base = get_base_currency(symbol)
+    if base not in MID_PRICES:
+        raise web.HTTPNotFound(text=f"Unknown symbol {symbol}")
+    return request.app["books"][(exchange, base)]
+
+
+async def coinbase_book(request: web.Request) -> web.Response:
+    book = get_book(request, "COINBASE", request.match_info["product"])
+    return web.json_response(
+        {
+            "sequence": int(time.time() * 1000),
+            "bids": [[fmt_price(p), fmt_amount(a), 1]
+                     for p, a in book.sorted_bids()],
+            "asks": [[fmt_price(p), fmt_amount(a), 1]
+                     for p, a in book.sorted_asks()],
+        }
+    )
+
+
+async def kraken_depth(request: web.Request) -> web.Response:
+    symbol = request.query.get("pair", "")
+    book = get_book(request, "KRAKEN", symbol)
+    count = int(request.query.get("count", 0))
+    now = int(time.time())
+    result = {
+        "bids": [[fmt_price(p), fmt_amount(a), now]
+                 for p, a in book.sorted_bids(count)],
+        "asks": [[fmt_price(p), fmt_amount(a), now]
+                 for p, a in book.sorted_asks(count)],
+    }
+    result_key = KRAKEN_RESULT_KEYS[get_base_currency(symbol)]
+    return web.json_response({"error": [], "result": {result_key: result}})
+
+
+async def gemini_book(request: web.Request) -> web.Response:
+    book = get_book(request, "GEMINI", request.match_info["symbol"])
+    limit_bids = int(request.query.get("limit_bids", 0))
+    limit_asks = int(request.query.get("limit_asks", 0))
+    now = str(int(time.time()))
+
+    def levels(items):
+        return [
+            {"price": fmt_price(p), "amount": fmt_amount(a), "timestamp": now}
+            for p, a in items
+        ]
+
+    return web.json_response(
+        {
+            "bids": levels(book.sorted_bids(limit_bids)),
+            "asks": levels(book.sorted_asks(limit_asks)),
+        }
+    )
+
+
+async def subscribe_and_stream(ws, book: SimulatedBook, send_snapshot,
+                               send_changes, send_heartbeat) -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def stream():
+        await send_snapshot()
+        while True:
+            try:
+                changes = await asyncio.wait_for(queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                await send_heartbeat()
+                continue
+            await send_changes(changes)
+
+    # Subscribe before the snapshot so no change falls in between
+    book.subscribers.add(queue)
+    stream_task = asyncio.create_task(stream())
+    try:
+        # Reading answers the client's close frame
+        async for _ in ws:
+            pass
+    finally:
+        stream_task.cancel()
+        book.subscribers.discard(queue)
+        try:
+            await stream_task
+        except (asyncio.CancelledError, ConnectionResetError):
+            pass
+
+
+async def coinbase_ws(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    message = await ws.receive()
+    if message.type != WSMsgType.TEXT:
+        return ws
+    subscription = message.json()
+    product_id = subscription["product_ids"][0]
+    book = get_book(request, "COINBASE", product_id)
+    await ws.send_json({"type": "subscriptions",
+                        "channels": subscription["channels"]})
+
+    async def send_snapshot():
+        await ws.send_json(
+            {
+                "type": "snapshot",
+                "product_id": product_id,
+                "bids": [[fmt_price(p), fmt_amount(a)]
+                         for p, a in book.sorted_bids()],
+                "asks": [[fmt_price(p), fmt_amount(a)]
+                         for p, a in book.sorted_asks()],
+            }
+        )
+
+    async def send_changes(changes: List[Change]):
+        await ws.send_json(
+            {
+                "type": "l2update",
+                "product_id": product_id,
+                "changes": [
+                    ["buy" if side == "bid" else "sell", fmt_price(p),
+                     fmt_amount(a)]
+                    for side, p, a in changes
+                ],
+                "time": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+    async def send_heartbeat():
+        if "heartbeat" in subscription["channels"]:
+            await ws.send_json({
+                "type": "heartbeat",
+                "product_id": product_id,
+                "time": datetime.now(timezone.utc).isoformat(),
+            })
+
+    await subscribe_and_stream(ws, book, send_snapshot, send_changes,
+                               send_heartbeat)
+    return ws
+
+
+async def kraken_ws(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    await ws.send_json({"event": "systemStatus", "status": "online"})
+    message = await ws.receive()
+    if message.type != WSMsgType.TEXT:
+        return ws
+    subscription = message.json()
+    pair = subscription["pair"][0]
+    depth = subscription["subscription"].get("depth", 10)
+    channel_name = f"book-{depth}"
+    book = get_book(request, "KRAKEN", pair)
+    channel_id = random.randint(1, 1000)
+    await ws.send_json({"event": "subscriptionStatus", "status": "subscribed",
+                        "channelID": channel_id, "pair": pair,
+                        "channelName": channel_name})
+
+    def levels(items):
+        now = f"{time.time():.6f}"
+        return [[fmt_price(p), fmt_amount(a), now] for p, a in items]
+
+    async def send_snapshot():
+        await ws.send_json(
+            [
+                channel_id,
+                {"as": levels(book.sorted_asks(depth)),
+                 "bs": levels(book.sorted_bids(depth))},
+                channel_name,
+                pair,
+            ]
+        )
+
+    async def send_changes(changes: List[Change]):
+        asks = [(p, a) for side, p, a in changes if side == "ask"]
+        bids = [(p, a) for side, p, a in changes if side == "bid"]
+        payloads = []
+        if asks:
+            payloads.append({"a": levels(asks)})
+        if bids:
+            payloads.append({"b": levels(bids)})
+        await ws.send_json([channel_id, *payloads, channel_name, pair])
+
+    async def send_heartbeat():
+        await ws.send_json({"event": "heartbeat"})
+
+    await subscribe_and_stream(ws, book, send_snapshot, send_changes,
+                               send_heartbeat)
+    return ws
+
+
+async def gemini_ws(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    book = get_book(request, "GEMINI", request.match_info["symbol"])
+    gap_every = request.app["gap_every"]
+    state = {"sequence": 0, "event_id": 0}
+
+    async def send(message: dict):
+        message["socket_sequence"] = state["sequence"]
+        state["sequence"] += 1
+        if gap_every and state["sequence"] % gap_every == 0:
+            state["sequence"] += 1  # Simulate a dropped message
+        await ws.send_json(message)
+
+    def events(changes: List[Change], reason: str):
+        return [
+            {"type": "change", "reason": reason, "price": fmt_price(p),
+             "delta": fmt_amount(a), "remaining": fmt_amount(a), "side": side}
+            for side, p, a in changes
+        ]
+
+    async def send_update(changes: List[Change], reason: str):
+        state["event_id"] += 1
+        await send({"type": "update", "eventId": state["event_id"],
+                    "events": events(changes, reason)})
+
+    async def send_snapshot():
+        changes = [("bid", p, a) for p, a in book.sorted_bids()]
+        changes.extend(("ask", p, a) for p, a in book.sorted_asks())
+        await send_update(changes, "initial")
+
+    async def send_changes(changes: List[Change]):
+        await send_update(changes, "place")
+
+    async def send_heartbeat():
+        await send({"type": "heartbeat"})
+
+    await subscribe_and_stream(ws, book, send_snapshot, send_changes,
+                               send_heartbeat)
+    return ws
+
+
+async def run_ticker(app: web.Application):
+    async def tick():
+        while True:
+            await asyncio.sleep(app["update_interval"])
+            for book in app["books"].values():
+                book.step(app["changes"])
+
+    task = asyncio.create_task(tick())
+    yield
+    task.cancel()
+
+
+def create_app(levels: int = 1000, update_interval: float = 0.05,
+               changes: int = 10, gap_every: int = 0,
+               seed: int = 0) -> web.Application:
+    """
+    Build the stub exchange application.
+
+    Args:
+        levels (int): Initial number of levels per side and book.
+        update_interval (float): Seconds between book mutations.
+        changes (int): Number of level changes per mutation.
+        gap_every (int): Skip a Gemini socket_sequence every N messages,
+                         0 disables gap injection.
+        seed (int): Seed for the random book generator.
+    """
+    rng = random.Random(seed)
+    app = web.Application()
+    app["books"] = {
+        (exchange, base): SimulatedBook(mid, levels, rng)
+        for exchange in EXCHANGES
+        for base, mid in MID_PRICES.items()
+    }
+    app["update_interval"] = update_interval
+    app["changes"] = changes
+    app["gap_every"] = gap_every
+    app.cleanup_ctx.append(run_ticker)
+    app.router.add_get("/coinbase/products/{product}/book", coinbase_book)
+    app.router.add_get("/coinbase/ws", coinbase_ws)
+    app.router.add_get("/kraken/0/public/Depth", kraken_depth)
+    app.router.add_get("/kraken/ws", kraken_ws)
+    app.router.add_get("/gemini/v1/book/{symbol}", gemini_book)
+    app.router.add_get("/gemini/v1/marketdata/{symbol}", gemini_ws)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--levels", type=int, default=1000)
+    parser.add_argument("--update-interval", type=float, default=0.05)
+    parser.add_argument("--changes", type=int, default=10)
+    parser.add_argument("--gap-every", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = create_app(args.levels, args.update_interval, args.changes,
+                     args.gap_every, args.seed)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
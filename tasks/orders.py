@@ -5,10 +5,14 @@ Description: Celery tasks for web crawling and related functionalities.
 """
 
 import celery
+from celery.result import GroupResult
+from celery.signals import task_prerun, task_postrun, worker_init
+from prometheus_client import start_http_server
 
 from log import LOGGER as log
 import redis
-from typing import Dict
+from typing import Dict, List, Tuple
+from uuid import uuid4
 import orjson as json
 import random
 import time
@@ -19,8 +23,17 @@ from config import (
     TASK_ID_KEY,
     EXECUTED_ORDERS_KEY,
     ORDER_STATUS_KEY,
+    ORDER_STATUS_CHANNEL,
+    ORDER_EXECUTION_DELAY,
+    ORDER_DELAY_QUEUE_KEY,
+    ORDER_DISPATCH_INTERVAL,
+    ORDER_DISPATCH_BATCH,
+    ORDER_BATCH_CHUNK_SIZE,
+    EXECUTED_ORDERS_MAX_LEN,
+    CELERY_METRICS_PORT,
 )
 from data_types import OrderStatus
+from metrics import CELERY_TASK_SECONDS
 
 REDIS_URL = REDIS_URL_LOCALHOST  # noqa
 
@@ -34,53 +47,182 @@ celery_worker = celery.Celery(
 
 redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
 
+# Start times of the tasks running in this process, by task id
+task_started_at: Dict[str, float] = {}
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """
+    Serve the task metrics on CELERY_METRICS_PORT. Tasks are timed in the
+    process running them, so this covers the solo and threads pools.
+    """
+    start_http_server(CELERY_METRICS_PORT)
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started_at = task_started_at.pop(task_id, None)
+    if started_at is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started_at
+        )
+
+
+# Stores a new order, its PENDING status and the id of the task that
+# submitted it, queues it for execution at its due time and publishes the
+# transition, atomically.
+# KEYS: order, status, task id, delay queue. ARGV: order, status, task id,
+# channel, status message, due time (ms), order id.
+SUBMIT_ORDER_SCRIPT = """
+redis.call("SET", KEYS[1], ARGV[1])
+redis.call("SET", KEYS[2], ARGV[2])
+redis.call("SET", KEYS[3], ARGV[3])
+redis.call("ZADD", KEYS[4], ARGV[6], ARGV[7])
+redis.call("PUBLISH", ARGV[4], ARGV[5])
+return 1
+"""
+
+# Fills the given due orders that are still PENDING: sets their status,
+# records them as executed and publishes the transitions. Every given order
+# leaves the delay queue, so orders that no longer exist or have left
+# PENDING are dropped and a retried batch is a no-op. Returns the number
+# filled.
+# KEYS: delay queue, executed orders, then order and status of each order.
+# ARGV: new status, PENDING, channel, timestamp, executed orders max length,
+# then the order ids.
+DISPATCH_DUE_ORDERS_SCRIPT = """
+local filled = 0
+for i = 6, #ARGV do
+    local order = redis.call("GET", KEYS[2 * i - 9])
+    local status_key = KEYS[2 * i - 8]
+    if order and redis.call("GET", status_key) == ARGV[2] then
+        redis.call("SET", status_key, ARGV[1])
+        redis.call("XADD", KEYS[2], "MAXLEN", "~", ARGV[5], "*",
+                   "order", order)
+        redis.call("PUBLISH", ARGV[3], cjson.encode({
+            orderId = ARGV[i],
+            status = ARGV[1],
+            timestamp = tonumber(ARGV[4]),
+        }))
+        filled = filled + 1
+    end
+    redis.call("ZREM", KEYS[1], ARGV[i])
+end
+return filled
+"""
+
+# Registering only hashes the scripts, they are sent on first use
+submit_order_script = redis.Redis(connection_pool=redis_pool).register_script(
+    SUBMIT_ORDER_SCRIPT
+)
+dispatch_due_orders_script = redis.Redis(
+    connection_pool=redis_pool
+).register_script(DISPATCH_DUE_ORDERS_SCRIPT)
+
 
 def get_delay():
+    if ORDER_EXECUTION_DELAY is not None:
+        return ORDER_EXECUTION_DELAY
     return random.randint(3, 10)
 
 
-@celery_worker.task(
-    name="store_executed_order",
-    bind=True,
-)
-def store_executed_order(self, order_id: str, order_data: Dict):
+def get_status_message(order_id: str, status: OrderStatus) -> bytes:
+    """The transition published on ORDER_STATUS_CHANNEL."""
+    return json.dumps({
+        "orderId": order_id,
+        "status": status.value,
+        "timestamp": int(time.time() * 1000),
+    })
+
+
+def submit_order(
+    redis_client: redis.Redis, limit_order_data: Dict, task_id: str,
+    delay: float,
+) -> None:
+    """Store a PENDING order and queue it to be filled in 'delay' seconds."""
+    order_id = limit_order_data.get("order_id")
+    submit_order_script(
+        keys=[
+            ORDER_KEY.format(order_id),
+            ORDER_STATUS_KEY.format(order_id),
+            TASK_ID_KEY.format(order_id),
+            ORDER_DELAY_QUEUE_KEY,
+        ],
+        args=[
+            json.dumps(limit_order_data),
+            OrderStatus.PENDING.value,
+            task_id,
+            ORDER_STATUS_CHANNEL,
+            get_status_message(order_id, OrderStatus.PENDING),
+            int((time.time() + delay) * 1000),
+            order_id,
+        ],
+        client=redis_client,
+    )
+
+
+def fill_due_orders(
+    redis_client: redis.Redis, batch_size: int = ORDER_DISPATCH_BATCH,
+) -> Tuple[int, int]:
     """
-    Accepts order id and data, stores it and returns response.
+    Fill the orders that are due, 'batch_size' per script call.
 
     Returns:
-    - dict: Dictionary containing response
+        Tuple[int, int]: Orders taken off the delay queue, orders filled.
     """
-    log.info(f"Storing order: {order_id}")
-    with redis.Redis(connection_pool=redis_pool) as redis_client:
-        redis_client.lpush(EXECUTED_ORDERS_KEY.format("ABCD"), json.dumps(order_data))
-    return {"status": "Done"}
+    now = int(time.time() * 1000)
+    total_due = total_filled = 0
+    while True:
+        # The ids are read first so the script is given every key it touches
+        order_ids = [
+            order_id.decode() for order_id in redis_client.zrangebyscore(
+                ORDER_DELAY_QUEUE_KEY, "-inf", now, start=0, num=batch_size
+            )
+        ]
+        if order_ids:
+            keys = [ORDER_DELAY_QUEUE_KEY, EXECUTED_ORDERS_KEY.format("ABCD")]
+            for order_id in order_ids:
+                keys += [ORDER_KEY.format(order_id),
+                         ORDER_STATUS_KEY.format(order_id)]
+            total_filled += dispatch_due_orders_script(
+                keys=keys,
+                args=[
+                    OrderStatus.FILLED.value,
+                    OrderStatus.PENDING.value,
+                    ORDER_STATUS_CHANNEL,
+                    now,
+                    EXECUTED_ORDERS_MAX_LEN,
+                    *order_ids,
+                ],
+                client=redis_client,
+            )
+        total_due += len(order_ids)
+        if len(order_ids) < batch_size:
+            return total_due, total_filled
 
 
 @celery_worker.task(
-    name="execute_limit_order",
+    name="dispatch_due_orders",
     bind=True,
+    ignore_result=True,
 )
-def execute_limit_order(self, order_id: str, delay: int = 1):
+def dispatch_due_orders(self):
     """
-    Accepts order id, executes it and returns response.
+    Fill every order whose execution delay has passed.
 
-    Returns:
-    - dict: Dictionary containing response
+    Run by beat every ORDER_DISPATCH_INTERVAL, so pending orders wait in the
+    Redis delay queue rather than in a worker.
     """
-
-    log.info(f"Executing order: {order_id}")
     with redis.Redis(connection_pool=redis_pool) as redis_client:
-        order = redis_client.get(ORDER_KEY.format(order_id))
-        if order:
-            order_data = json.loads(order)
-            log.info(f"Order data: {order_data}")
-            time.sleep(delay)
-            redis_client.set(
-                ORDER_STATUS_KEY.format(order_id), OrderStatus.FILLED.value
-            )
-            _ = store_executed_order.delay(order_id, order_data)
-            return {"status": "Done"}
-    return {"status": "Invalid Order"}
+        due, filled = fill_due_orders(redis_client)
+    if due:
+        log.info(f"Filled {filled} of {due} due orders")
 
 
 @celery_worker.task(
@@ -96,25 +238,56 @@ def send_limit_order(self, limit_order_data: Dict):
     """
     log.info(f"Sending limit order: {limit_order_data}")
     with redis.Redis(connection_pool=redis_pool) as redis_client:
-        redis_client.set(
-            ORDER_KEY.format(limit_order_data.get("order_id")),
-            json.dumps(limit_order_data),
-        )
-        redis_client.set(
-            ORDER_STATUS_KEY.format(limit_order_data.get("order_id")),
-            OrderStatus.PENDING.value,
+        submit_order(
+            redis_client, limit_order_data, self.request.id or uuid4().hex,
+            get_delay(),
         )
-    delay = get_delay()
-    result = execute_limit_order.delay(limit_order_data.get("order_id"), delay)
-    task_id = result.id
+    return {"status": "Done"}
+
+
+@celery_worker.task(
+    name="send_limit_orders",
+    bind=True,
+)
+def send_limit_orders(self, limit_orders_data: List[Dict]):
+    """
+    Accepts a chunk of limit orders and adds them all to queue in one Redis
+    round trip.
+
+    Returns:
+    - dict: Dictionary containing response
+    """
+    log.info(f"Sending {len(limit_orders_data)} limit orders")
     with redis.Redis(connection_pool=redis_pool) as redis_client:
-        redis_client.set(
-            TASK_ID_KEY.format(limit_order_data.get("order_id")), str(task_id)
-        )
+        with redis_client.pipeline(transaction=False) as pipeline:
+            for limit_order_data in limit_orders_data:
+                submit_order(pipeline, limit_order_data, self.request.id,
+                             get_delay())
+            pipeline.execute()
     return {"status": "Done"}
 
 
+def send_limit_order_batch(
+    limit_orders_data: List[Dict], chunk_size: int = ORDER_BATCH_CHUNK_SIZE,
+) -> GroupResult:
+    """Enqueue a batch of limit orders as one group of 'chunk_size' chunks."""
+    return celery.group(
+        send_limit_orders.s(limit_orders_data[start:start + chunk_size])
+        for start in range(0, len(limit_orders_data), chunk_size)
+    ).apply_async()
+
+
 celery_worker.conf.task_routes = {
     "tasks.orders.send_limit_order": "tasks",
-    "tasks.orders.execute_limit_order": "tasks",
+    "tasks.orders.send_limit_orders": "tasks",
+    "tasks.orders.dispatch_due_orders": "tasks",
+}
+
+celery_worker.conf.beat_schedule = {
+    "dispatch-due-orders": {
+        "task": "dispatch_due_orders",
+        "schedule": ORDER_DISPATCH_INTERVAL,
+        # A run the worker could not start in time is superseded by the next
+        "options": {"expires": ORDER_DISPATCH_INTERVAL},
+    },
 }
@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, List
+
+import orjson as json
+from fastapi import FastAPI, WebSocketDisconnect
+
+from order_repository import OrderRepository
+from order_status_subscriptions import OrderStatusHub
+from routes.websockets import get_limit_order_websocket_endpoint
+
+
+class FakeWebSocket:
+    """Replays 'messages' to an endpoint and records what it sends."""
+
+    def __init__(self, app: FastAPI, messages: List[Any]) -> None:
+        self.app = app
+        self.url = SimpleNamespace(path="/ws/get-limit-order-status")
+        self.messages = [json.dumps(message).decode() for message in messages]
+        self.sent: List[Any] = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_text(self) -> str:
+        if not self.messages:
+            raise WebSocketDisconnect()
+        return self.messages.pop(0)
+
+    async def send_json(self, data: Any) -> None:
+        self.sent.append(data)
+
+    async def send_text(self, data: str) -> None:
+        self.sent.append(data)
+
+    async def close(self) -> None:
+        pass
+
+
+def get_status_app() -> FastAPI:
+    # Nothing below connects to Redis until a command is sent
+    order_repository = OrderRepository()
+    status_app = FastAPI()
+    status_app.extra["order_repository"] = order_repository
+    status_app.extra["order_status_hub"] = OrderStatusHub(order_repository)
+    return status_app
+
+
+def test_get_order_statuses_of_no_orders():
+    assert asyncio.run(OrderRepository().get_order_statuses([])) == []
+
+
+def test_status_query_of_empty_batch():
+    websocket = FakeWebSocket(get_status_app(), [{"orderIds": []}])
+    asyncio.run(get_limit_order_websocket_endpoint(websocket))
+    assert websocket.sent == [{"statuses": []}]
@@ -1,39 +1,154 @@
-import asyncio
-from functools import wraps
+from heapq import merge
+from operator import attrgetter
 
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple, Union
 from collections import defaultdict
+import numpy as np
 from order_books import OrderData
 from data_types import Operation
+from columnar_order_book import ColumnarOrderBook, ColumnarOrderSide, EXCHANGES
+
+
+_price_key = attrgetter("price")
 
 
 class OrderBookMerger:
-    """Utility class for merging order books from multiple exchanges."""
+    """Utility class for merging order books from multiple exchanges.
+
+    Every exchange returns bids sorted by price descending and asks sorted by
+    price ascending, so merging k books is a k-way merge of sorted runs
+    rather than a full sort.
+    """
 
     @staticmethod
     def merge_order_books(
         order_books: List[Tuple[List[OrderData], List[OrderData]]]
-    ) -> Tuple[List[OrderData], List[OrderData]]:
+    ) -> Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
         """
         Merge order books from multiple exchanges.
 
         Args:
             order_books (List[Tuple[List[OrderData], List[OrderData]]]):
                 List of tuples containing bid and ask order books from each
-                exchange.
+                exchange, or ColumnarOrderBook instances.
 
         Returns:
-            Tuple[List[OrderData], List[OrderData]]: Merged bid and ask order
-            books.
+            Union[Tuple[List[OrderData], List[OrderData]], ColumnarOrderBook]:
+            Merged bid and ask order books, columnar if the inputs are.
         """
-        bids = []
-        asks = []
+        if order_books and isinstance(order_books[0], ColumnarOrderBook):
+            return ColumnarOrderBook.merge(order_books)
+        bids: List[OrderData] = []
+        asks: List[OrderData] = []
         for exchange_bids, exchange_asks in order_books:
             bids.extend(exchange_bids)
             asks.extend(exchange_asks)
-        return sorted(bids, key=lambda x: x.price, reverse=True), sorted(
-            asks, key=lambda x: x.price
-        )
+        # Timsort detects each exchange's pre-sorted run and merges the k
+        # runs in O(n log k), in C, which beats heapq.merge when every level
+        # is consumed anyway.
+        bids.sort(key=_price_key, reverse=True)
+        asks.sort(key=_price_key)
+        return bids, asks
+
+    @staticmethod
+    def iter_merged_order_books(
+        order_books: List[Tuple[List[OrderData], List[OrderData]]]
+    ) -> Tuple[Iterator[OrderData], Iterator[OrderData]]:
+        """
+        Lazily merge order books from multiple exchanges.
+
+        Levels are produced on demand by a heap over the k exchange books,
+        so a consumer that stops early (e.g. PriceCalculator once the
+        quantity is filled) never touches the deep tail. Each iterator can
+        be consumed only once.
+
+        Args:
+            order_books (List[Tuple[List[OrderData], List[OrderData]]]):
+                List of tuples containing bid and ask order books from each
+                exchange.
+
+        Returns:
+            Tuple[Iterator[OrderData], Iterator[OrderData]]: Merged bid and
+            ask iterators.
+        """
+        bids = merge(*(exchange_bids for exchange_bids, _ in order_books),
+                     key=_price_key, reverse=True)
+        asks = merge(*(exchange_asks for _, exchange_asks in order_books),
+                     key=_price_key)
+        return bids, asks
+
+
+class DepthIndex:
+    """
+    Cumulative depth of one merged order book side.
+
+    Built once per merged book so the volume weighted price for any quantity
+    is a binary search plus one partial level, instead of a walk over the
+    levels on every request.
+
+    Attributes:
+        prices (np.ndarray): Level prices, in book order.
+        cumulative_amount (np.ndarray): Running total of level amounts.
+        cumulative_notional (np.ndarray): Running total of amount * price.
+    """
+
+    __slots__ = ("prices", "cumulative_amount", "cumulative_notional")
+
+    def __init__(self, orders: Union[List[OrderData], ColumnarOrderSide]):
+        if isinstance(orders, ColumnarOrderSide):
+            self.prices = orders.price
+            amounts = orders.amount
+        else:
+            count = len(orders)
+            self.prices = np.fromiter((order.price for order in orders),
+                                      np.float64, count)
+            amounts = np.fromiter((order.amount for order in orders),
+                                  np.float64, count)
+        self.cumulative_amount = np.cumsum(amounts)
+        self.cumulative_notional = np.cumsum(amounts * self.prices)
+
+    def calculate_price(self, quantity: float) -> float:
+        """
+        Calculate the volume weighted price of filling 'quantity'.
+
+        Args:
+            quantity (float): The quantity of cryptocurrency to fill.
+
+        Returns:
+            float: The calculated price, averaged over the whole side if it
+            holds less than 'quantity'.
+        """
+        count = len(self.prices)
+        if quantity <= 0.0 or count == 0:
+            return 0.0
+        # First level at which the requested quantity is filled
+        index = int(np.searchsorted(self.cumulative_amount, quantity))
+        if index == count:
+            total_quantity = float(self.cumulative_amount[-1])
+            if total_quantity <= 0.0:
+                return 0.0
+            return float(self.cumulative_notional[-1]) / total_quantity
+        filled_quantity, filled_cost = 0.0, 0.0
+        if index:
+            filled_quantity = float(self.cumulative_amount[index - 1])
+            filled_cost = float(self.cumulative_notional[index - 1])
+        remaining_quantity = quantity - filled_quantity
+        total_cost = filled_cost + remaining_quantity * float(self.prices[index])
+        return total_cost / quantity
+
+
+class IndexedOrderBook(tuple):
+    """
+    Merged (bids, asks) order book carrying a DepthIndex per side.
+
+    Unpacks like a plain (bids, asks) tuple.
+    """
+
+    def __new__(cls, bids, asks) -> "IndexedOrderBook":
+        order_book = super().__new__(cls, (bids, asks))
+        order_book.bid_index = DepthIndex(bids)
+        order_book.ask_index = DepthIndex(asks)
+        return order_book
 
 
 class PriceCalculator:
@@ -41,7 +156,7 @@ class PriceCalculator:
 
     @staticmethod
     def calculate_price(
-        order_books: Tuple[List[OrderData], List[OrderData]],
+        order_books: Tuple[Iterable[OrderData], Iterable[OrderData]],
         operation: Operation,
         quantity: float,
     ) -> float:
@@ -49,8 +164,10 @@ class PriceCalculator:
         Calculate the price based on merged order books.
 
         Args:
-            order_books (Tuple[List[OrderData], List[OrderData]]):
-                Tuple containing merged bid and ask order books.
+            order_books (Tuple[Iterable[OrderData], Iterable[OrderData]]):
+                Tuple containing merged bid and ask order books, either lists
+                or the lazy iterators of
+                OrderBookMerger.iter_merged_order_books.
             operation (Operation): The type of operation, either BUY or SELL.
             quantity (float): The quantity of cryptocurrency for which to
             calculate the price.
@@ -58,9 +175,16 @@ class PriceCalculator:
         Returns:
             float: The calculated price.
         """
+        if isinstance(order_books, IndexedOrderBook):
+            depth_index = (order_books.ask_index
+                           if operation == Operation.BUY
+                           else order_books.bid_index)
+            return depth_index.calculate_price(quantity)
         bids, asks = order_books
         total_quantity, total_cost = 0.0, 0.0
         orders = asks if operation == Operation.BUY else bids
+        if isinstance(orders, ColumnarOrderSide):
+            return PriceCalculator._calculate_columnar_price(orders, quantity)
         for order in orders:
             if total_quantity + order.amount <= quantity:
                 total_quantity += order.amount
@@ -73,6 +197,25 @@ class PriceCalculator:
 
         return total_cost / total_quantity if total_quantity > 0.0 else 0.0
 
+    @staticmethod
+    def _calculate_columnar_price(
+        orders: ColumnarOrderSide, quantity: float
+    ) -> float:
+        if quantity <= 0.0 or len(orders) == 0:
+            return 0.0
+        cumulative_amount = np.cumsum(orders.amount)
+        # First level at which the requested quantity is filled
+        index = int(np.searchsorted(cumulative_amount, quantity))
+        if index == len(orders):
+            total_quantity = float(cumulative_amount[-1])
+            if total_quantity <= 0.0:
+                return 0.0
+            return float(orders.amount @ orders.price) / total_quantity
+        filled_quantity = float(cumulative_amount[index - 1]) if index else 0.0
+        total_cost = float(orders.amount[:index] @ orders.price[:index])
+        total_cost += (quantity - filled_quantity) * float(orders.price[index])
+        return total_cost / quantity
+
 
 class ExchangeLimitOrderCalculator:
     @staticmethod
@@ -85,6 +228,10 @@ class ExchangeLimitOrderCalculator:
         total_quantity, total_cost = 0.0, 0.0
         temp_dict = defaultdict(defaultdict)
         orders = asks if operation == Operation.BUY else bids
+        if isinstance(orders, ColumnarOrderSide):
+            return ExchangeLimitOrderCalculator._get_columnar_limit_orders(
+                orders, quantity
+            )
         for order in orders:
             if total_quantity + order.amount <= quantity:
                 total_quantity += order.amount
@@ -114,15 +261,34 @@ class ExchangeLimitOrderCalculator:
             for exchange, data in temp_dict.items()
         ]
 
+    @staticmethod
+    def _get_columnar_limit_orders(
+        orders: ColumnarOrderSide, quantity: float
+    ) -> List[OrderData]:
+        if quantity <= 0.0 or len(orders) == 0:
+            return []
+        cumulative_amount = np.cumsum(orders.amount)
+        end = min(int(np.searchsorted(cumulative_amount, quantity)) + 1,
+                  len(orders))
+        filled = orders.amount[:end].copy()
+        overfill = float(cumulative_amount[end - 1]) - quantity
+        if overfill > 0.0:
+            filled[-1] -= overfill
+        codes = orders.exchange[:end]
+        quantities = np.bincount(codes, weights=filled,
+                                 minlength=len(EXCHANGES))
+        # Exchanges in order of first appearance, each priced at the last
+        # (worst) level taken from it
+        exchange_codes, first_index = np.unique(codes, return_index=True)
+        _, last_index_reversed = np.unique(codes[::-1], return_index=True)
+        last_index = end - 1 - last_index_reversed
+        return [
+            OrderData(
+                price=float(orders.price[last_index[i]]),
+                amount=float(quantities[exchange_codes[i]]),
+                timestamp=0,
+                exchange=EXCHANGES[exchange_codes[i]],
+            )
+            for i in np.argsort(first_index)
+        ]
 
-def measure_latency(func):
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        start_time = asyncio.get_event_loop().time()
-        result = await func(*args, **kwargs)
-        end_time = asyncio.get_event_loop().time()
-        latency = end_time - start_time
-        print(f"Latency: {latency} seconds")
-        return result
-
-    return wrapper
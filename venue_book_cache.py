@@ -0,0 +1,90 @@
+import time
+from typing import Any, Dict, NamedTuple, Optional, Set, Tuple
+
+from log import LOGGER as log
+from config import VENUE_MAX_AGE
+
+
+class VenueBook(NamedTuple):
+    """Latest standardized book of one exchange and when it was received."""
+
+    order_book: Any
+    received_at: float
+
+
+class VenueBookCache:
+    """
+    Latest standardized book of every (pair, exchange), kept independently
+    so one slow or failing exchange does not hold back the others.
+
+    Acts as a circuit breaker per venue: get_fresh() leaves out any book
+    older than 'max_age' (the venue is dropped) until a newer book arrives
+    (the venue is restored). Both transitions are logged and counted.
+
+    Usage:
+        cache = VenueBookCache()
+        cache.update("BTCUSD", "KRAKEN", order_book)
+        ...
+        venue_books = cache.get_fresh("BTCUSD")
+    """
+
+    def __init__(self, max_age: float = VENUE_MAX_AGE) -> None:
+        self.max_age = max_age
+        self._books: Dict[str, Dict[str, VenueBook]] = {}
+        self._dropped: Set[Tuple[str, str]] = set()
+        self._drops: Dict[Tuple[str, str], int] = {}
+
+    def update(
+        self,
+        pair: str,
+        exchange: str,
+        order_book: Any,
+        received_at: Optional[float] = None,
+    ) -> None:
+        self._books.setdefault(pair, {})[exchange] = VenueBook(
+            order_book, time.time() if received_at is None else received_at
+        )
+
+    def get_fresh(
+        self, pair: str, now: Optional[float] = None
+    ) -> Dict[str, VenueBook]:
+        """
+        Return the books of 'pair' that are at most 'max_age' old.
+
+        Args:
+            pair (str): The currency pair, e.g. BTCUSD.
+            now (Optional[float]): Epoch time to measure ages against.
+
+        Returns:
+            Dict[str, VenueBook]: Fresh books by exchange name.
+        """
+        now = time.time() if now is None else now
+        fresh_books = {}
+        for exchange, venue_book in self._books.get(pair, {}).items():
+            key = (pair, exchange)
+            age = now - venue_book.received_at
+            if age <= self.max_age:
+                fresh_books[exchange] = venue_book
+                if key in self._dropped:
+                    self._dropped.discard(key)
+                    log.info(f"Restoring {exchange} to the {pair} book")
+            elif key not in self._dropped:
+                self._dropped.add(key)
+                self._drops[key] = self._drops.get(key, 0) + 1
+                log.warning(
+                    f"Dropping {exchange} from the {pair} book, its data is "
+                    f"{age:.1f}s old (max {self.max_age:.1f}s)"
+                )
+        return fresh_books
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        return {
+            f"{pair}:{exchange}": {
+                "age": round(now - venue_book.received_at, 3),
+                "dropped": (pair, exchange) in self._dropped,
+                "drops": self._drops.get((pair, exchange), 0),
+            }
+            for pair, venue_books in self._books.items()
+            for exchange, venue_book in venue_books.items()
+        }